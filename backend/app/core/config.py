@@ -5,7 +5,7 @@ from typing import List
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 ROOT_DIR = BASE_DIR.parent
-DATA_DIR = ROOT_DIR / "data"
+DATA_DIR = Path(os.getenv("DATA_DIR", str(ROOT_DIR / "data")))
 
 # CORS設定（Cookie送信を許可するため、明示的なオリジンを指定推奨）
 ALLOW_ORIGINS: List[str] = os.getenv(
@@ -17,4 +17,45 @@ ALLOW_ORIGINS: List[str] = os.getenv(
 SESSION_SECRET: str = os.getenv("SESSION_SECRET", "change-me-session-secret")
 SESSION_COOKIE_NAME: str = os.getenv("SESSION_COOKIE_NAME", "feelance_session")
 SESSION_MAX_AGE: int = int(os.getenv("SESSION_MAX_AGE", str(60 * 60 * 24 * 7)))  # 7日
+# 検証済みセッション（Cookie の値 -> ユーザー）をメモリに置く秒数と件数の上限。ユーザー表が変われば即時に検証し直す
+SESSION_CACHE_TTL_SECONDS: int = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_CACHE_MAX_ENTRIES: int = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "4096"))
 
+# ストレージバックエンド（csv / sqlite）
+STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "csv").lower()
+SQLITE_PATH: Path = Path(os.getenv("SQLITE_PATH", str(DATA_DIR / "feelance.sqlite3")))
+# CSVの配置（single: 全ユーザー共通ファイル / partitioned: data/users/<user_id>/ 配下に分割）
+CSV_LAYOUT: str = os.getenv("CSV_LAYOUT", "single").lower()
+# 取引・日記本体のファイル形式（csv / parquet / feather。parquet・feather は pyarrow が必要）
+TABLE_FORMAT: str = os.getenv("TABLE_FORMAT", "csv").lower()
+
+# 取引ジャーナル（更新・削除の追記ログ）がこのサイズを超えたらバックグラウンドで本体CSVへ畳み込む
+TX_JOURNAL_COMPACT_BYTES: int = int(os.getenv("TX_JOURNAL_COMPACT_BYTES", str(256 * 1024)))
+
+# ふりかえりまとめ文キャッシュ（取引・日記が変わっても作り直すまでは直前の文を返し、最後に使われてから TTL 時間で破棄。メモリ上の件数上限・ファイルを詰め直す追記回数）
+SUMMARY_CACHE_TTL_HOURS: int = int(os.getenv("SUMMARY_CACHE_TTL_HOURS", str(24 * 7)))
+SUMMARY_CACHE_MAX_ENTRIES: int = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "1024"))
+SUMMARY_CACHE_COMPACT_EVERY: int = int(os.getenv("SUMMARY_CACHE_COMPACT_EVERY", "256"))
+
+# ふりかえり集計（ユーザー別）をメモリに保持する人数の上限
+RETROSPECTIVE_AGGREGATE_MAX_USERS: int = int(os.getenv("RETROSPECTIVE_AGGREGATE_MAX_USERS", "1024"))
+
+# ふりかえりの集計期間（months）の上限。日ごとの気分は期間の日数分返すため
+RETROSPECTIVE_MAX_MONTHS: int = int(os.getenv("RETROSPECTIVE_MAX_MONTHS", "60"))
+
+# ふりかえりまとめ文のバックグラウンド生成（同時実行数・LLM 呼び出しの上限/分・定期確認の間隔・対象とする最近の利用）
+SUMMARY_REFRESH_CONCURRENCY: int = int(os.getenv("SUMMARY_REFRESH_CONCURRENCY", "2"))
+SUMMARY_REFRESH_RATE_PER_MINUTE: float = float(os.getenv("SUMMARY_REFRESH_RATE_PER_MINUTE", "30"))
+SUMMARY_REFRESH_INTERVAL_SECONDS: float = float(os.getenv("SUMMARY_REFRESH_INTERVAL_SECONDS", "600"))
+SUMMARY_ACTIVE_HOURS: float = float(os.getenv("SUMMARY_ACTIVE_HOURS", "24"))
+
+# 日記チャットの会話（履歴）をメモリに置く件数の上限と、最後に使われてから保持する秒数
+CHAT_CONVERSATION_CACHE_MAX_ENTRIES: int = int(os.getenv("CHAT_CONVERSATION_CACHE_MAX_ENTRIES", "512"))
+CHAT_CONVERSATION_CACHE_TTL_SECONDS: float = float(os.getenv("CHAT_CONVERSATION_CACHE_TTL_SECONDS", "1800"))
+
+# 日記チャットで LLM に渡す文脈（システムプロンプト + 履歴）のトークン数の上限。超える分は古い履歴から削る
+CHAT_CONTEXT_MAX_TOKENS: int = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "4000"))
+
+# 日記生成結果のキャッシュ（同じ会話からの再生成は LLM を呼ばずに返す）。件数の上限（メモリ・ファイルそれぞれ）と保持時間
+DIARY_GENERATION_CACHE_MAX_ENTRIES: int = int(os.getenv("DIARY_GENERATION_CACHE_MAX_ENTRIES", "1024"))
+DIARY_GENERATION_CACHE_TTL_HOURS: float = float(os.getenv("DIARY_GENERATION_CACHE_TTL_HOURS", "24"))
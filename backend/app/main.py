@@ -1,13 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import ALLOW_ORIGINS
-from app.repositories.csv_store import ensure_data_files
+from app.repositories.storage import ensure_data_files
 from app.routers import auth, diary, retrospective, transactions
+from app.services.retrospective import summary_refresher
+from app.utils.pagination import NEXT_CURSOR_HEADER
 
 ensure_data_files()
 
-app = FastAPI(title="Feelance API", version="0.2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ふりかえりまとめ文をリクエストの外で作り直すワーカー
+    await summary_refresher.start()
+    try:
+        yield
+    finally:
+        await summary_refresher.stop()
+
+
+app = FastAPI(title="Feelance API", version="0.2.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,6 +30,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 
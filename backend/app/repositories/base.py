@@ -0,0 +1,120 @@
+"""ストレージバックエンドの共通定義。
+
+サービス層は app.repositories.storage 経由でここに定義したインターフェースだけを使う。
+"""
+
+from datetime import datetime
+from typing import Callable, List, Optional, Protocol, Tuple
+
+import pandas as pd
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+USER_COLUMNS = ["user_id", "display_name"]
+TX_COLUMNS = [
+    "id",
+    "user_id",
+    "date",
+    "item",
+    "amount",
+    "mood_score",
+    "happy_amount",
+    "created_at",
+    "updated_at",
+]
+TX_DATE_COLUMNS = ["date", "created_at", "updated_at"]
+DIARY_COLUMNS = [
+    "id",
+    "tx_id",
+    "event_name",
+    "diary_title",
+    "diary_body",
+    "transaction_date",
+    "created_at",
+    "user_id",
+]
+DIARY_DATE_COLUMNS = ["transaction_date", "created_at"]
+CHAT_COLUMNS = ["tx_id", "user_id", "messages_json", "created_at"]
+
+# table_version() に渡すテーブル名
+VERSIONED_TABLES = ("users", "transactions", "diary", "chat")
+
+
+def stored_row(row: dict) -> dict:
+    """日時の値をファイルに書く精度（DATE_FORMAT の秒）に切り捨てた行を返す。"""
+    return {
+        key: pd.Timestamp(value).floor("s") if isinstance(value, datetime) else value
+        for key, value in row.items()
+    }
+
+
+def coerce_transactions(df: pd.DataFrame) -> pd.DataFrame:
+    """取引DataFrameの日付列を datetime64 に揃える。"""
+    df = df.copy()
+    for col in TX_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def coerce_diary(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    for col in DIARY_DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+class StorageBackend(Protocol):
+    def ensure_data_files(self) -> None: ...
+
+    def read_users(self) -> pd.DataFrame: ...
+
+    def get_user_row(self, user_id: str) -> Optional[dict]: ...
+
+    def read_transactions(
+        self, user_id: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame: ...
+
+    def get_transaction_row(self, tx_id: str) -> Optional[dict]: ...
+
+    def write_transactions(self, df: pd.DataFrame) -> None: ...
+
+    def insert_transaction_row(self, row: dict) -> None: ...
+
+    def update_transaction_row(self, row: dict) -> None: ...
+
+    def delete_transaction_row(self, tx_id: str, user_id: str) -> None: ...
+
+    def read_diary(self, user_id: Optional[str] = None) -> pd.DataFrame: ...
+
+    def write_diary(self, df: pd.DataFrame) -> None: ...
+
+    def upsert_diary_row(self, row: dict) -> None: ...
+
+    def write_chat_log(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        """会話を messages_json の1行だけに置き換える。"""
+        ...
+
+    def append_chat_turn(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        """会話の末尾に1ターン分（そのターンで増えたメッセージだけ）の行を足す。"""
+        ...
+
+    def read_chat_log(self, tx_id: str, user_id: str) -> pd.DataFrame:
+        """会話の全行を保存した順に返す。"""
+        ...
+
+    def table_version(self, table: str, user_id: Optional[str] = None) -> str:
+        """テーブル（user_id 指定時はそのユーザー分）が書き換わるたびに変わる版文字列。"""
+        ...
+
+    def versioned_write(
+        self, table: str, user_id: str, write: Callable[[], None]
+    ) -> Tuple[str, str]:
+        """write() を同じテーブルへの他の versioned_write と排他にして実行し、
+        その直前・直後の table_version(table, user_id) を返す（版の変化がこの書き込みだけによるもの）。"""
+        ...
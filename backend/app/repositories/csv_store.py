@@ -1,64 +1,391 @@
+import io
+import os
+import threading
 from pathlib import Path
 from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import quote, unquote
 from uuid import uuid4
 
 import pandas as pd
 
-from app.core.config import DATA_DIR
+from app.core.config import CSV_LAYOUT, DATA_DIR, TABLE_FORMAT, TX_JOURNAL_COMPACT_BYTES
+from app.repositories.base import (
+    CHAT_COLUMNS,
+    DIARY_COLUMNS,
+    TX_COLUMNS,
+    coerce_diary,
+    coerce_transactions,
+    stored_row,
+)
+from app.repositories.file_io import append_csv_rows, atomic_write_csv, file_version
+from app.repositories.locks import table_lock
+from app.repositories.table_cache import TableCache
+from app.repositories.table_formats import (
+    check_format,
+    ensure_frame,
+    is_columnar,
+    read_frame,
+    table_path,
+    write_frame,
+)
+
+check_format(TABLE_FORMAT)
 
 USERS_FILE = DATA_DIR / "users.csv"
-TX_FILE = DATA_DIR / "transactions.csv"
-DIARY_FILE = DATA_DIR / "diary.csv"
+# 取引・日記の本体は TABLE_FORMAT（csv / parquet / feather）で保存する
+TX_FILE = table_path(DATA_DIR, "transactions", TABLE_FORMAT)
+DIARY_FILE = table_path(DATA_DIR, "diary", TABLE_FORMAT)
+# チャットログは会話（user_id, tx_id）ごとに1ファイル: data/chat/<user_id>/<tx_id>.csv
+# 1行目が会話の始まり（システムプロンプトと、それまでの履歴）、以降はターンごとに増えた分の行を追記する。
+# 保存・読み込みはその会話のファイルだけを書き換える・読む（CSV_LAYOUT によらない）
+CHAT_DIR = DATA_DIR / "chat"
+# 旧形式（全会話を1ファイル）のチャットログ。最初に使うときに会話ごとのファイルへ分ける
 CHAT_FILE = DATA_DIR / "chat.csv"
+# 取引の更新・削除を追記するジャーナル。compact_transactions() で本体へ畳み込む
+TX_JOURNAL_FILE = DATA_DIR / "transactions_journal.csv"
+
+# CSV_LAYOUT=partitioned のとき、ユーザーごとのファイルを置くディレクトリ
+#   data/users/<user_id>/transactions.<fmt>, transactions_journal.csv, diary.<fmt>
+USERS_DIR = DATA_DIR / "users"
+PARTITIONED = CSV_LAYOUT == "partitioned"
+
+TX_JOURNAL_COLUMNS = ["op", *TX_COLUMNS]
+
+# 全リクエストで共有するテーブルキャッシュ
+_cache = TableCache()
+
+_legacy_chat_lock = threading.Lock()
+_legacy_chat_checked = False
+
+
+def _ensure_csv(path: Path, columns: List[str]) -> None:
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(",".join(columns) + "\n", encoding="utf-8")
 
 
 def ensure_data_files() -> None:
     DATA_DIR.mkdir(exist_ok=True)
     if not USERS_FILE.exists():
         USERS_FILE.write_text("user_id,display_name\n", encoding="utf-8")
-    if not TX_FILE.exists():
-        TX_FILE.write_text(
-            "id,user_id,date,item,amount,mood_score,happy_amount,created_at,updated_at\n",
-            encoding="utf-8",
-        )
-    if not DIARY_FILE.exists():
-        DIARY_FILE.write_text(
-            "id,tx_id,event_name,diary_title,diary_body,transaction_date,created_at,user_id\n",
-            encoding="utf-8",
-        )
-    if not CHAT_FILE.exists():
-        CHAT_FILE.write_text(
-            "tx_id,user_id,messages_json,created_at\n",
-            encoding="utf-8",
+    CHAT_DIR.mkdir(exist_ok=True)
+    _split_legacy_chat_logs()
+    if PARTITIONED:
+        USERS_DIR.mkdir(exist_ok=True)
+        return
+    _ensure_tx_table(TX_FILE, TX_JOURNAL_FILE)
+    ensure_frame(DIARY_FILE, DIARY_COLUMNS, TABLE_FORMAT)
+
+
+# --- パーティション ---
+
+
+def _escape_name(value: object) -> str:
+    """ファイル名・ディレクトリ名に使えない文字をエスケープする。"""
+    return quote(str(value), safe="").replace(".", "%2E")
+
+
+def partition_dir(user_id: str) -> Path:
+    """ユーザーのパーティションディレクトリ。"""
+    return USERS_DIR / _escape_name(user_id)
+
+
+def _partition_user_ids() -> List[str]:
+    if not USERS_DIR.exists():
+        return []
+    return sorted(unquote(p.name) for p in USERS_DIR.iterdir() if p.is_dir())
+
+
+def _tx_files(user_id: Optional[str]) -> Tuple[Path, Path]:
+    if PARTITIONED:
+        directory = partition_dir(user_id)
+        return (
+            table_path(directory, "transactions", TABLE_FORMAT),
+            directory / "transactions_journal.csv",
         )
+    return TX_FILE, TX_JOURNAL_FILE
+
+
+def _diary_file(user_id: Optional[str]) -> Path:
+    if PARTITIONED:
+        return table_path(partition_dir(user_id), "diary", TABLE_FORMAT)
+    return DIARY_FILE
+
+
+def _chat_dir(user_id: str) -> Path:
+    return CHAT_DIR / _escape_name(user_id)
+
+
+def _chat_path(tx_id: str, user_id: str) -> Path:
+    return _chat_dir(user_id) / f"{_escape_name(tx_id)}.csv"
+
+
+def _concat_partitions(read: Callable[[str], pd.DataFrame], columns: List[str]) -> pd.DataFrame:
+    """全パーティションを読み合わせる（ユーザー横断の処理・移行ツール向け）。"""
+    frames = [df for df in (read(uid) for uid in _partition_user_ids()) if not df.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _split_by_user(df: pd.DataFrame) -> dict:
+    """user_id ごとの DataFrame に分ける。既存パーティションで該当行がないものは空にする。"""
+    parts = {uid: pd.DataFrame(columns=df.columns) for uid in _partition_user_ids()}
+    for uid, group in df.groupby("user_id", sort=False):
+        parts[str(uid)] = group
+    return parts
+
+
+# --- users ---
+
+
+def _load_users() -> pd.DataFrame:
+    return pd.read_csv(USERS_FILE, dtype={"user_id": str, "display_name": str})
 
 
 def read_users() -> pd.DataFrame:
     ensure_data_files()
-    return pd.read_csv(USERS_FILE, dtype={"user_id": str, "display_name": str})
+    return _cache.get(USERS_FILE, _load_users)
 
 
-def read_transactions() -> pd.DataFrame:
+def get_user_row(user_id: str) -> Optional[dict]:
+    """user_id でユーザーを1行引く（キャッシュ上の user_id 索引を使う）。なければ None。"""
     ensure_data_files()
+    return _cache.lookup(USERS_FILE, _load_users, "user_id", user_id)
+
+
+# --- transactions ---
+
+
+def _read_tx_csv(path: Path, extra_dtype: dict | None = None) -> pd.DataFrame:
     df = pd.read_csv(
-        TX_FILE,
-        dtype={"id": str, "user_id": str, "item": str},
+        path,
+        dtype={"id": str, "user_id": str, "item": str, **(extra_dtype or {})},
         parse_dates=["date", "created_at", "updated_at"],
     )
-    if df.empty:
+    return coerce_transactions(df)
+
+
+def _fold_journal(base: pd.DataFrame, journal: pd.DataFrame) -> pd.DataFrame:
+    """ジャーナルの上書き・削除レコードを本体に適用する（id ごとに最後のレコードが有効）。"""
+    if journal.empty:
+        return base
+    latest = journal.drop_duplicates(subset="id", keep="last")
+    upserts = latest[latest["op"] == "upsert"][TX_COLUMNS]
+    base = base[~base["id"].isin(latest["id"])]
+    frames = [f for f in (base, upserts) if not f.empty]
+    if not frames:
+        return base
+    return pd.concat(frames, ignore_index=True)
+
+
+def _ensure_tx_table(base: Path, journal: Path) -> None:
+    ensure_frame(base, TX_COLUMNS, TABLE_FORMAT)
+    _ensure_csv(journal, TX_JOURNAL_COLUMNS)
+
+
+def _read_tx_base(base: Path, fmt: str = TABLE_FORMAT) -> pd.DataFrame:
+    return coerce_transactions(read_frame(base, fmt, _read_tx_csv))
+
+
+def _tx_loader(base: Path, journal: Path) -> Callable[[], pd.DataFrame]:
+    def _load() -> pd.DataFrame:
+        return _fold_journal(_read_tx_base(base), _read_tx_csv(journal, {"op": str}))
+
+    return _load
+
+
+def _empty_tx_frame() -> pd.DataFrame:
+    """まだ書き込みのないパーティションの読み込み結果（空のCSVを読んだときと同じ型）。"""
+    return _read_tx_csv(io.StringIO(",".join(TX_COLUMNS) + "\n"))
+
+
+def _read_tx_table(base: Path, journal: Path, select=None) -> pd.DataFrame:
+    # 読み込みではファイルを作らない（存在しない user_id の参照でパーティションが増えないように）。
+    # ファイルは書き込み時に _ensure_tx_table で作る
+    if not base.exists():
+        empty = _empty_tx_frame()
+        return select(empty) if select is not None else empty
+    return _cache.get(base, _tx_loader(base, journal), depends_on=[journal], select=select)
+
+
+def _lookup_tx(base: Path, journal: Path, tx_id: str) -> Optional[dict]:
+    if not base.exists():
+        return None
+    return _cache.lookup(base, _tx_loader(base, journal), "id", tx_id, depends_on=[journal])
+
+
+def _write_tx_table(base: Path, journal: Path, df: pd.DataFrame) -> None:
+    with table_lock(base):
+        df = df[TX_COLUMNS]
+        write_frame(base, df, TABLE_FORMAT)
+        journal.write_text(",".join(TX_JOURNAL_COLUMNS) + "\n", encoding="utf-8")
+        _cache.put(base, coerce_transactions(df), depends_on=[journal])
+
+
+def _select(user_id: Optional[str] = None, columns: Optional[List[str]] = None):
+    """キャッシュ上のテーブルから、コピー前に行（user_id）と列を絞り込む関数を作る。"""
+    if user_id is None and columns is None:
+        return None
+
+    def _apply(df: pd.DataFrame) -> pd.DataFrame:
+        if user_id is not None:
+            df = df[df["user_id"] == user_id]
+        if columns is not None:
+            df = df[columns]
         return df
-    return df
+
+    return _apply
+
+
+def read_transactions(
+    user_id: Optional[str] = None, columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """取引テーブルを返す。
+
+    user_id を指定するとそのユーザーの行だけに、columns を指定するとその列だけに絞る。
+    """
+    ensure_data_files()
+    if not PARTITIONED:
+        return _read_tx_table(TX_FILE, TX_JOURNAL_FILE, select=_select(user_id, columns))
+    if user_id is not None:
+        return _read_tx_table(*_tx_files(user_id), select=_select(columns=columns))
+    return _concat_partitions(
+        lambda uid: _read_tx_table(*_tx_files(uid), select=_select(columns=columns)),
+        columns or TX_COLUMNS,
+    )
+
+
+# パーティション分割時の tx_id -> user_id。見つけた（書いた）ものだけ覚えておく
+_tx_owner: dict = {}
+
+
+def get_transaction_row(tx_id: str) -> Optional[dict]:
+    """id で取引を1行引く（キャッシュ上の id 索引を使う）。なければ None。"""
+    ensure_data_files()
+    if not PARTITIONED:
+        return _lookup_tx(TX_FILE, TX_JOURNAL_FILE, tx_id)
+    owner = _tx_owner.get(tx_id)
+    candidates = [owner] if owner is not None else []
+    candidates += [uid for uid in _partition_user_ids() if uid != owner]
+    for uid in candidates:
+        row = _lookup_tx(*_tx_files(uid), tx_id)
+        if row is not None:
+            _tx_owner[tx_id] = uid
+            return row
+    return None
 
 
 def write_transactions(df: pd.DataFrame) -> None:
-    df.to_csv(TX_FILE, index=False, date_format="%Y-%m-%dT%H:%M:%S")
+    """取引テーブル全体を書き換える。ジャーナルは空に戻す。"""
+    ensure_data_files()
+    if not PARTITIONED:
+        _write_tx_table(TX_FILE, TX_JOURNAL_FILE, df)
+        return
+    for uid, part in _split_by_user(df).items():
+        _write_tx_table(*_tx_files(uid), part)
 
 
-def read_diary() -> pd.DataFrame:
-    """日記CSVを読み込み、欠損列を補完し、IDと日付型を整える。"""
+def insert_transaction_row(row: dict) -> None:
+    """新しい取引を1行だけ本体CSVへ追記する。
+
+    列指向形式の本体には追記できないため、ジャーナルへ upsert として書く。
+    """
+    ensure_data_files()
+    if PARTITIONED:
+        _tx_owner[row["id"]] = row["user_id"]
+    if is_columnar(TABLE_FORMAT):
+        _append_journal("upsert", row, row["user_id"])
+        return
+    base, journal = _tx_files(row["user_id"])
+    _ensure_tx_table(base, journal)
+    new_df = pd.DataFrame([stored_row(row)], columns=TX_COLUMNS)
+    with table_lock(base):
+        previous = _cache.signature(base, [journal])
+        append_csv_rows(base, new_df)
+        _cache.append(base, coerce_transactions(new_df), previous, [journal])
+
+
+def _append_journal(op: str, row: dict, user_id: str) -> None:
+    ensure_data_files()
+    base, journal = _tx_files(user_id)
+    _ensure_tx_table(base, journal)
+    record = pd.DataFrame([{**stored_row(row), "op": op}], columns=TX_JOURNAL_COLUMNS)
+    tx_id = row["id"]
+
+    with table_lock(base):
+        previous = _cache.signature(base, [journal])
+        append_csv_rows(journal, record)
+        if op == "upsert":
+            # 既存行は id 索引の位置をその場で書き換える
+            _cache.upsert_row(
+                base, "id", coerce_transactions(record[TX_COLUMNS]), previous, [journal]
+            )
+        else:
+            _cache.apply(base, lambda df: df[df["id"] != tx_id], previous, [journal])
+    _maybe_compact_transactions(base, journal)
+
+
+def update_transaction_row(row: dict) -> None:
+    """既存取引の上書きレコードをジャーナルへ追記する。"""
+    _append_journal("upsert", row, row["user_id"])
+
+
+def delete_transaction_row(tx_id: str, user_id: str) -> None:
+    """取引の削除（tombstone）レコードをジャーナルへ追記する。"""
+    _append_journal("delete", {"id": tx_id}, user_id)
+
+
+def _compact_tx_table(base: Path, journal: Path) -> None:
+    with table_lock(base):
+        _write_tx_table(base, journal, _read_tx_table(base, journal))
+
+
+def compact_transactions() -> None:
+    """ジャーナルを本体CSVへ畳み込み、ジャーナルを空にする。"""
     ensure_data_files()
+    if not PARTITIONED:
+        _compact_tx_table(TX_FILE, TX_JOURNAL_FILE)
+        return
+    for uid in _partition_user_ids():
+        _compact_tx_table(*_tx_files(uid))
+
+
+_compacting: set = set()
+_compacting_lock = threading.Lock()
+
+
+def _compact_in_background(base: Path, journal: Path) -> None:
+    try:
+        _compact_tx_table(base, journal)
+    finally:
+        with _compacting_lock:
+            _compacting.discard(base)
+
+
+def _maybe_compact_transactions(base: Path, journal: Path) -> None:
+    try:
+        journal_size = journal.stat().st_size
+    except FileNotFoundError:
+        return
+    if journal_size < TX_JOURNAL_COMPACT_BYTES:
+        return
+    with _compacting_lock:
+        if base in _compacting:
+            return
+        _compacting.add(base)
+    threading.Thread(
+        target=_compact_in_background, args=(base, journal), name="tx-compactor", daemon=True
+    ).start()
+
+
+# --- diary ---
+
+
+def _load_diary(path: Path) -> pd.DataFrame:
     df = pd.read_csv(
-        DIARY_FILE,
+        path,
         dtype={
             "id": str,
             "tx_id": str,
@@ -74,16 +401,7 @@ def read_diary() -> pd.DataFrame:
     if df.empty:
         return df
 
-    expected_cols = [
-        "id",
-        "tx_id",
-        "event_name",
-        "diary_title",
-        "diary_body",
-        "transaction_date",
-        "created_at",
-        "user_id",
-    ]
+    expected_cols = DIARY_COLUMNS
 
     changed = False
     for col in expected_cols:
@@ -111,51 +429,328 @@ def read_diary() -> pd.DataFrame:
     df = df[expected_cols]
 
     if changed:
-        write_diary(df)
+        _write_diary_file(path, df, "csv")
     return df
 
 
+def _load_diary_table(path: Path, fmt: str = TABLE_FORMAT) -> pd.DataFrame:
+    df = read_frame(path, fmt, _load_diary)
+    if is_columnar(fmt):
+        df = coerce_diary(df)
+        # CSV版（keep_default_na=False）と同じく、文字列列の欠損は空文字にそろえる
+        text_cols = [c for c in DIARY_COLUMNS if c not in ("transaction_date", "created_at")]
+        df[text_cols] = df[text_cols].fillna("")
+    return df
+
+
+def _read_diary_file(path: Path, select=None) -> pd.DataFrame:
+    # 取引と同じく、読み込みではファイルを作らない
+    if not path.exists():
+        return pd.DataFrame(columns=DIARY_COLUMNS)
+    df = _cache.get(path, lambda: _load_diary_table(path), select=select)
+    if df.empty:
+        return pd.DataFrame(columns=DIARY_COLUMNS)
+    return df
+
+
+def _write_diary_file(path: Path, df: pd.DataFrame, fmt: str = TABLE_FORMAT) -> None:
+    with table_lock(path):
+        write_frame(path, df[DIARY_COLUMNS], fmt)
+        _cache.put(path, coerce_diary(df))
+
+
+def read_diary(user_id: Optional[str] = None) -> pd.DataFrame:
+    """日記CSVを読み込み、欠損列を補完し、IDと日付型を整える。"""
+    ensure_data_files()
+    if not PARTITIONED:
+        return _read_diary_file(DIARY_FILE, select=_select(user_id))
+    if user_id is not None:
+        return _read_diary_file(_diary_file(user_id))
+    return _concat_partitions(lambda uid: _read_diary_file(_diary_file(uid)), DIARY_COLUMNS)
+
+
 def write_diary(df: pd.DataFrame) -> None:
-    df.to_csv(DIARY_FILE, index=False, date_format="%Y-%m-%dT%H:%M:%S")
+    ensure_data_files()
+    if not PARTITIONED:
+        _write_diary_file(DIARY_FILE, df)
+        return
+    for uid, part in _split_by_user(df).items():
+        _write_diary_file(_diary_file(uid), part)
 
 
-def append_chat_log(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> None:
+def upsert_diary_row(row: dict) -> None:
+    """同一ユーザー・同一トランザクションの既存日記を置き換えて保存する。"""
     ensure_data_files()
+    path = _diary_file(row["user_id"])
+    # 読み込みから書き込みまでを同じロック内で行い、並行保存での取りこぼしを防ぐ
+    with table_lock(path):
+        df = _read_diary_file(path)
+        if not df.empty and "tx_id" in df.columns:
+            df = df[~((df["tx_id"] == row["tx_id"]) & (df["user_id"] == row["user_id"]))]
+        new_df = pd.DataFrame([stored_row(row)], columns=DIARY_COLUMNS)
+        df = pd.concat([df, new_df], ignore_index=True) if not df.empty else new_df
+        _write_diary_file(path, df)
+
+
+# --- chat ---
+
+
+def _load_chat_log(path: Path) -> pd.DataFrame:
     try:
-        df = pd.read_csv(
-            CHAT_FILE,
+        return pd.read_csv(
+            path,
             dtype={"tx_id": str, "user_id": str, "messages_json": str},
             parse_dates=["created_at"],
         )
     except Exception:
-        df = pd.DataFrame(columns=["tx_id", "user_id", "messages_json", "created_at"])
+        return pd.DataFrame(columns=CHAT_COLUMNS)
+
+
+def _write_chat_log(path: Path, df: pd.DataFrame) -> None:
+    with table_lock(path.parent):
+        atomic_write_csv(path, df[CHAT_COLUMNS])
+
+
+def _split_legacy_chat_logs() -> None:
+    """旧形式の chat.csv（単一構成・パーティション構成）を会話ごとのファイルへ分ける（プロセスごとに1回）。
+
+    会話ごとのファイルが既にあればそちらを優先する。分け終えたファイルは chat.csv.migrated へ改名する。
+    """
+    global _legacy_chat_checked
+    if _legacy_chat_checked:
+        return
+    with _legacy_chat_lock:
+        if _legacy_chat_checked:
+            return
+        legacy = [CHAT_FILE]
+        if USERS_DIR.exists():
+            legacy += [p / "chat.csv" for p in USERS_DIR.iterdir() if p.is_dir()]
+        for path in legacy:
+            # ロックファイルを残さないよう、旧形式のファイルがあるときだけロックを取る
+            if not path.exists():
+                continue
+            with table_lock(path):
+                if not path.exists():
+                    continue
+                df = _load_chat_log(path)
+                if not df.empty:
+                    df = df.sort_values(by="created_at").drop_duplicates(
+                        subset=["tx_id", "user_id"], keep="last"
+                    )
+                for row in df.to_dict("records"):
+                    target = _chat_path(row["tx_id"], row["user_id"])
+                    if not target.exists():
+                        _write_chat_log(target, _chat_row(**row))
+                os.replace(path, path.with_name(path.name + ".migrated"))
+        _legacy_chat_checked = True
 
-    # tx_id & user_id 単位で最新を上書き
-    df = df[(df["tx_id"] != tx_id) | (df["user_id"] != user_id)]
-    new_row = {
+
+def read_chat_logs() -> pd.DataFrame:
+    """全ユーザー分のチャットログを返す（移行ツール向け）。"""
+    ensure_data_files()
+    frames = [
+        df
+        for df in (_load_chat_log(path) for path in sorted(CHAT_DIR.glob("*/*.csv")))
+        if not df.empty
+    ]
+    if not frames:
+        return pd.DataFrame(columns=CHAT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _chat_row(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> pd.DataFrame:
+    row = {
         "tx_id": tx_id,
         "user_id": user_id,
         "messages_json": messages_json,
         "created_at": created_at,
     }
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    df.to_csv(CHAT_FILE, index=False, date_format="%Y-%m-%dT%H:%M:%S")
+    return pd.DataFrame([row], columns=CHAT_COLUMNS)
+
+
+def write_chat_log(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> None:
+    """(tx_id, user_id) の会話を1行に置き換える。書き換えるのはその会話のファイルだけ。"""
+    ensure_data_files()
+    _write_chat_log(_chat_path(tx_id, user_id), _chat_row(tx_id, user_id, messages_json, created_at))
+
+
+def append_chat_turn(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> None:
+    """(tx_id, user_id) の会話ファイルに1ターン分の行を追記する（なければ作る）。"""
+    ensure_data_files()
+    path = _chat_path(tx_id, user_id)
+    row = _chat_row(tx_id, user_id, messages_json, created_at)
+    with table_lock(path.parent):
+        if not path.exists():
+            atomic_write_csv(path, row)
+            return
+        append_csv_rows(path, row)
+        # 追記ではディレクトリの mtime が変わらないため、版（table_version）を進めるために触る
+        os.utime(path.parent)
 
 
 def read_chat_log(tx_id: str, user_id: str) -> pd.DataFrame:
-    """指定されたトランザクションの最新チャットログを返す。なければ空DataFrame。"""
+    """指定されたトランザクションの会話の全行を保存順に返す。なければ空DataFrame。"""
     ensure_data_files()
-    try:
-        df = pd.read_csv(
-            CHAT_FILE,
-            dtype={"tx_id": str, "user_id": str, "messages_json": str},
-            parse_dates=["created_at"],
+    path = _chat_path(tx_id, user_id)
+    if not path.exists():
+        return pd.DataFrame(columns=CHAT_COLUMNS)
+    return _load_chat_log(path)
+
+
+# --- レイアウト移行 ---
+
+
+def migrate_to_partitioned() -> dict:
+    """単一ファイル構成のCSVを data/users/<user_id>/ 配下へ分割して書き出す。
+
+    元のファイルはそのまま残す。何度実行しても同じ結果になる。件数を返す。
+    チャットログは構成によらず会話ごとのファイル（data/chat/）なので移さない。
+    """
+    transactions = _read_tx_table(TX_FILE, TX_JOURNAL_FILE)
+    diary = _read_diary_file(DIARY_FILE)
+
+    counts = {"users": 0, "transactions": len(transactions), "diary": len(diary)}
+    user_ids = set(transactions["user_id"].dropna()) | set(diary["user_id"].dropna())
+    for uid in sorted(str(u) for u in user_ids if str(u)):
+        directory = partition_dir(uid)
+        _write_tx_table(
+            table_path(directory, "transactions", TABLE_FORMAT),
+            directory / "transactions_journal.csv",
+            transactions[transactions["user_id"] == uid],
         )
-    except Exception:
-        return pd.DataFrame(columns=["tx_id", "user_id", "messages_json", "created_at"])
-    df = df[(df["tx_id"] == tx_id) & (df["user_id"] == user_id)]
-    if df.empty:
-        return pd.DataFrame(columns=["tx_id", "user_id", "messages_json", "created_at"])
-    # 最新のみ返す
-    df = df.sort_values(by="created_at")
-    return df.iloc[[-1]]
+        _write_diary_file(
+            table_path(directory, "diary", TABLE_FORMAT), diary[diary["user_id"] == uid]
+        )
+        counts["users"] += 1
+    return counts
+
+
+def convert_table_format(source: str = "csv") -> dict:
+    """source 形式で保存された取引・日記の本体を、TABLE_FORMAT の形式で書き直す。
+
+    取引のジャーナルは畳み込んでから書き出す。元のファイルは残す。件数を返す。
+    """
+    check_format(source)
+    counts = {"transactions": 0, "diary": 0}
+    if source == TABLE_FORMAT:
+        return counts
+    directories = (
+        [partition_dir(uid) for uid in _partition_user_ids()] if PARTITIONED else [DATA_DIR]
+    )
+    for directory in directories:
+        src_tx = table_path(directory, "transactions", source)
+        if src_tx.exists():
+            journal = directory / "transactions_journal.csv"
+            _ensure_csv(journal, TX_JOURNAL_COLUMNS)
+            df = _fold_journal(_read_tx_base(src_tx, source), _read_tx_csv(journal, {"op": str}))
+            # ジャーナルは変換先に合わせて空になるため、変換元にも畳み込んでおく
+            with table_lock(src_tx):
+                write_frame(src_tx, df[TX_COLUMNS], source)
+            _write_tx_table(table_path(directory, "transactions", TABLE_FORMAT), journal, df)
+            counts["transactions"] += len(df)
+        src_diary = table_path(directory, "diary", source)
+        if src_diary.exists():
+            df = _load_diary_table(src_diary, source)
+            if df.empty:
+                df = pd.DataFrame(columns=DIARY_COLUMNS)
+            _write_diary_file(table_path(directory, "diary", TABLE_FORMAT), df)
+            counts["diary"] += len(df)
+    return counts
+
+
+# --- 版 ---
+
+
+def _table_files(table: str, user_id: Optional[str]) -> List[Path]:
+    if table == "users":
+        return [USERS_FILE]
+    if table == "transactions":
+        return list(_tx_files(user_id))
+    if table == "diary":
+        return [_diary_file(user_id)]
+    if table == "chat":
+        # 会話ファイルの差し替え（os.replace）でディレクトリの mtime が変わる
+        if user_id is None:
+            return [CHAT_DIR, *sorted(p for p in CHAT_DIR.glob("*") if p.is_dir())]
+        return [_chat_dir(user_id)]
+    raise ValueError(f"Unknown table: {table}")
+
+
+def table_version(table: str, user_id: Optional[str] = None) -> str:
+    """ファイルの stat から作る版。読み込みはしないので、変更の有無だけを安く判定できる。"""
+    if PARTITIONED and user_id is None and table != "users":
+        return "|".join(
+            f"{uid}:{file_version(_table_files(table, uid))}" for uid in _partition_user_ids()
+        )
+    return file_version(_table_files(table, user_id))
+
+
+def versioned_write(table: str, user_id: str, write: Callable[[], None]) -> Tuple[str, str]:
+    """write() をテーブル（取引は本体CSV）のロック内で実行し、前後の版を返す。"""
+    with table_lock(_table_files(table, user_id)[0]):
+        before = table_version(table, user_id)
+        write()
+        return before, table_version(table, user_id)
+
+
+class CsvStorage:
+    """DATA_DIR 配下のCSVファイルを使うバックエンド（既定）。"""
+
+    def ensure_data_files(self) -> None:
+        ensure_data_files()
+
+    def read_users(self) -> pd.DataFrame:
+        return read_users()
+
+    def get_user_row(self, user_id: str) -> Optional[dict]:
+        return get_user_row(user_id)
+
+    def read_transactions(
+        self, user_id: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        return read_transactions(user_id, columns)
+
+    def get_transaction_row(self, tx_id: str) -> Optional[dict]:
+        return get_transaction_row(tx_id)
+
+    def write_transactions(self, df: pd.DataFrame) -> None:
+        write_transactions(df)
+
+    def insert_transaction_row(self, row: dict) -> None:
+        insert_transaction_row(row)
+
+    def update_transaction_row(self, row: dict) -> None:
+        update_transaction_row(row)
+
+    def delete_transaction_row(self, tx_id: str, user_id: str) -> None:
+        delete_transaction_row(tx_id, user_id)
+
+    def read_diary(self, user_id: Optional[str] = None) -> pd.DataFrame:
+        return read_diary(user_id)
+
+    def write_diary(self, df: pd.DataFrame) -> None:
+        write_diary(df)
+
+    def upsert_diary_row(self, row: dict) -> None:
+        upsert_diary_row(row)
+
+    def write_chat_log(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        write_chat_log(tx_id, user_id, messages_json, created_at)
+
+    def append_chat_turn(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        append_chat_turn(tx_id, user_id, messages_json, created_at)
+
+    def read_chat_log(self, tx_id: str, user_id: str) -> pd.DataFrame:
+        return read_chat_log(tx_id, user_id)
+
+    def table_version(self, table: str, user_id: Optional[str] = None) -> str:
+        return table_version(table, user_id)
+
+    def versioned_write(
+        self, table: str, user_id: str, write: Callable[[], None]
+    ) -> Tuple[str, str]:
+        return versioned_write(table, user_id, write)
@@ -0,0 +1,93 @@
+"""日記生成結果のキャッシュ（生成に渡す内容から作るキーで引く）。
+
+キーは (モデル, システムプロンプト, 会話テキスト) のハッシュ。入力が同じなら同じ結果を返してよいので、
+無効化はせず、期限と件数だけで捨てる。
+- メモリ: 上限 DIARY_GENERATION_CACHE_MAX_ENTRIES 件の LRU。メモリに載せてから
+  DIARY_GENERATION_CACHE_TTL_HOURS を過ぎたものは捨てる
+- ファイル: data/diary_generation_cache/<key>.json に1件1ファイル（他のワーカーと共有する）。
+  ファイルから読むたびに mtime を進め、最後に使われてから DIARY_GENERATION_CACHE_TTL_HOURS を
+  過ぎたものと、件数の上限を超えた古いものを書き込み時に消す
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import (
+    DATA_DIR,
+    DIARY_GENERATION_CACHE_MAX_ENTRIES,
+    DIARY_GENERATION_CACHE_TTL_HOURS,
+)
+from app.repositories.locks import table_lock
+from app.utils.ttl_cache import TTLCache
+
+CACHE_DIR = DATA_DIR / "diary_generation_cache"
+
+
+class DiaryGenerationCacheStore:
+    def __init__(self, directory: Path, max_entries: int, ttl_seconds: float) -> None:
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: TTLCache[str, dict] = TTLCache(max_entries, ttl_seconds=ttl_seconds)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        result = self._memory.get(key)
+        if result is not None:
+            return result
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                return None
+            result = json.loads(path.read_text(encoding="utf-8"))
+            # ファイル側の最終利用時刻を進める（件数の上限で消す順番に使う）
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._memory.set(key, result)
+        return result
+
+    def put(self, key: str, result: dict) -> None:
+        self._memory.set(key, result)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, path)
+        self.prune()
+
+    def prune(self) -> None:
+        """期限切れのファイルと、新しく使われた順で max_entries 件を超えるファイルを消す。"""
+        with table_lock(self.directory):
+            entries = []
+            for path in self.directory.glob("*.json"):
+                try:
+                    entries.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    continue
+            entries.sort(reverse=True)
+            cutoff = time.time() - self.ttl_seconds
+            for rank, (mtime, path) in enumerate(entries):
+                if rank >= self.max_entries or mtime < cutoff:
+                    path.unlink(missing_ok=True)
+
+
+_store = DiaryGenerationCacheStore(
+    CACHE_DIR,
+    max_entries=DIARY_GENERATION_CACHE_MAX_ENTRIES,
+    ttl_seconds=DIARY_GENERATION_CACHE_TTL_HOURS * 3600,
+)
+
+
+def read_diary_generation_cache(key: str) -> Optional[dict]:
+    """同じ入力（key）から生成済みの日記（diary_title / diary_body）を返す。なければNone。"""
+    return _store.get(key)
+
+
+def write_diary_generation_cache(key: str, result: dict) -> None:
+    _store.put(key, result)
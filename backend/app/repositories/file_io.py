@@ -0,0 +1,44 @@
+"""CSVファイルへの安全な書き込み。呼び出し側で table_lock() を取ってから使う。"""
+
+import os
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+from app.repositories.base import DATE_FORMAT
+
+
+def append_csv_rows(path: Path, df: pd.DataFrame) -> None:
+    """ヘッダーなしで行を追記し、fsync まで行う。"""
+    with path.open("a", encoding="utf-8", newline="") as f:
+        df.to_csv(f, header=False, index=False, date_format=DATE_FORMAT)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def atomic_write_csv(path: Path, df: pd.DataFrame) -> None:
+    """一時ファイルへ書き出して fsync した後、os.replace で差し替える。
+
+    途中でプロセスが落ちても、元のファイルが中途半端な状態で残ることはない。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8", newline="") as f:
+        df.to_csv(f, index=False, date_format=DATE_FORMAT)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def file_version(paths: Iterable[Path]) -> str:
+    """ファイル群の (inode, mtime_ns, size) から作る版文字列。書き込み・差し替えのたびに変わる。"""
+    parts = []
+    for path in paths:
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            parts.append("0")
+            continue
+        parts.append(f"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}")
+    return ".".join(parts)
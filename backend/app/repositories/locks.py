@@ -0,0 +1,63 @@
+"""テーブル単位の排他ロック。
+
+同一プロセス内のスレッド間は RLock で、プロセス間は `<file>.lock` に対する
+fcntl.flock で排他する。fcntl が使えない環境（Windows）ではスレッド間のみ。
+"""
+
+import threading
+from pathlib import Path
+from typing import Dict, Optional, TextIO
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+class TableLock:
+    def __init__(self, path: Path) -> None:
+        self._lock_path = path.with_name(path.name + ".lock")
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle: Optional[TextIO] = None
+
+    def __enter__(self) -> "TableLock":
+        self._lock.acquire()
+        if self._depth == 0:
+            # flock は同一プロセスでも別ファイル記述子同士で競合するため、最外側でのみ取得する
+            try:
+                self._lock_path.parent.mkdir(parents=True, exist_ok=True)
+                handle = open(self._lock_path, "a+", encoding="utf-8")
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                self._lock.release()
+                raise
+            self._handle = handle
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._handle is not None:
+            handle, self._handle = self._handle, None
+            try:
+                if fcntl is not None:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            finally:
+                handle.close()
+        self._lock.release()
+
+
+_locks: Dict[Path, TableLock] = {}
+_registry_lock = threading.Lock()
+
+
+def table_lock(path: Path) -> TableLock:
+    """path に対応するロックを返す（同じ path には常に同じインスタンス）。"""
+    with _registry_lock:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = TableLock(path)
+            _locks[path] = lock
+        return lock
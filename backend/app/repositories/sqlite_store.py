@@ -0,0 +1,361 @@
+"""SQLite（標準ライブラリ sqlite3, WALモード）を使うストレージバックエンド。
+
+STORAGE_BACKEND=sqlite のときに使われる。既存CSVからの移行は migrate_from_csv() で行う。
+"""
+
+import math
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from app.core.config import SQLITE_PATH
+from app.repositories.base import (
+    CHAT_COLUMNS,
+    DATE_FORMAT,
+    DIARY_COLUMNS,
+    TX_COLUMNS,
+    USER_COLUMNS,
+    coerce_diary,
+    coerce_transactions,
+)
+from app.repositories.locks import table_lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    display_name TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    date TEXT,
+    item TEXT,
+    amount REAL,
+    mood_score INTEGER,
+    happy_amount REAL,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions(user_id, date);
+CREATE TABLE IF NOT EXISTS diary (
+    id TEXT PRIMARY KEY,
+    tx_id TEXT,
+    event_name TEXT,
+    diary_title TEXT,
+    diary_body TEXT,
+    transaction_date TEXT,
+    created_at TEXT,
+    user_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_diary_user_tx ON diary(user_id, tx_id);
+CREATE TABLE IF NOT EXISTS chat (
+    tx_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    messages_json TEXT,
+    created_at TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_tx_user ON chat(tx_id, user_id);
+-- chat は会話の始まりの1行、chat_turns はその後にターンごとに増えた分（rowid 順）
+CREATE TABLE IF NOT EXISTS chat_turns (
+    tx_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    messages_json TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_chat_turns_tx_user ON chat_turns(tx_id, user_id);
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (name, user_id)
+);
+"""
+
+# テーブル全体の置き換え（移行など）は user_id='' の行を進める
+ALL_USERS = ""
+
+DIARY_TEXT_COLUMNS = ["id", "tx_id", "event_name", "diary_title", "diary_body", "user_id"]
+
+
+def _to_db(value: object) -> object:
+    """pandas/datetime の値を sqlite3 に渡せる形へ変換する（欠損は NULL）。"""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.strftime(DATE_FORMAT)
+    if hasattr(value, "item"):
+        # numpy のスカラーは Python の型へ
+        return value.item()
+    return value
+
+
+def _row_params(row: dict, columns: Sequence[str]) -> List[object]:
+    return [_to_db(row.get(col)) for col in columns]
+
+
+def _insert_sql(table: str, columns: Sequence[str], verb: str = "INSERT") -> str:
+    placeholders = ", ".join("?" for _ in columns)
+    return f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+
+
+def _bump(table: str, user_id: str = ALL_USERS) -> tuple:
+    """書き込みと同じトランザクションで実行する、版カウンタを1つ進める文。"""
+    return (
+        "INSERT INTO table_versions (name, user_id, version) VALUES (?, ?, 1) "
+        "ON CONFLICT(name, user_id) DO UPDATE SET version = version + 1",
+        [table, user_id],
+    )
+
+
+class SqliteStorage:
+    def __init__(self, path: Path = SQLITE_PATH) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 の接続はスレッドごとに持つ（uvicorn のスレッドプールから呼ばれるため）
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def ensure_data_files(self) -> None:
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn = self._connect()
+            conn.executescript(SCHEMA)
+            conn.commit()
+            self._initialized = True
+
+    def _query(
+        self, sql: str, params: Sequence[object], columns: Sequence[str]
+    ) -> pd.DataFrame:
+        self.ensure_data_files()
+        rows = self._connect().execute(sql, params).fetchall()
+        return pd.DataFrame.from_records(rows, columns=list(columns))
+
+    def _executemany(self, statements: Iterable[tuple]) -> None:
+        self.ensure_data_files()
+        conn = self._connect()
+        with conn:
+            for sql, params in statements:
+                conn.execute(sql, params)
+
+    # --- users ---
+
+    def read_users(self) -> pd.DataFrame:
+        return self._query(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users", [], USER_COLUMNS
+        )
+
+    def get_user_row(self, user_id: str) -> Optional[dict]:
+        df = self._query(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE user_id = ?",
+            [user_id],
+            USER_COLUMNS,
+        )
+        return df.iloc[0].to_dict() if not df.empty else None
+
+    def write_users(self, df: pd.DataFrame) -> None:
+        sql = _insert_sql("users", USER_COLUMNS, "INSERT OR REPLACE")
+        self._executemany(
+            [*((sql, _row_params(row, USER_COLUMNS)) for row in df.to_dict("records")), _bump("users")]
+        )
+
+    # --- transactions ---
+
+    def read_transactions(
+        self, user_id: Optional[str] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        selected = [c for c in TX_COLUMNS if columns is None or c in columns]
+        sql = f"SELECT {', '.join(selected)} FROM transactions"
+        params: List[object] = []
+        if user_id is not None:
+            sql += " WHERE user_id = ? ORDER BY date"
+            params.append(user_id)
+        df = coerce_transactions(self._query(sql, params, selected))
+        return df[columns] if columns is not None else df
+
+    def get_transaction_row(self, tx_id: str) -> Optional[dict]:
+        df = coerce_transactions(
+            self._query(
+                f"SELECT {', '.join(TX_COLUMNS)} FROM transactions WHERE id = ?",
+                [tx_id],
+                TX_COLUMNS,
+            )
+        )
+        return df.iloc[0].to_dict() if not df.empty else None
+
+    def write_transactions(self, df: pd.DataFrame) -> None:
+        sql = _insert_sql("transactions", TX_COLUMNS)
+        self._executemany(
+            [("DELETE FROM transactions", [])]
+            + [(sql, _row_params(row, TX_COLUMNS)) for row in df.to_dict("records")]
+            + [_bump("transactions")]
+        )
+
+    def insert_transaction_row(self, row: dict) -> None:
+        self._executemany(
+            [
+                (_insert_sql("transactions", TX_COLUMNS), _row_params(row, TX_COLUMNS)),
+                _bump("transactions", row["user_id"]),
+            ]
+        )
+
+    def update_transaction_row(self, row: dict) -> None:
+        sql = _insert_sql("transactions", TX_COLUMNS, "INSERT OR REPLACE")
+        self._executemany(
+            [(sql, _row_params(row, TX_COLUMNS)), _bump("transactions", row["user_id"])]
+        )
+
+    def delete_transaction_row(self, tx_id: str, user_id: str) -> None:
+        self._executemany(
+            [
+                ("DELETE FROM transactions WHERE id = ? AND user_id = ?", [tx_id, user_id]),
+                _bump("transactions", user_id),
+            ]
+        )
+
+    # --- diary ---
+
+    def read_diary(self, user_id: Optional[str] = None) -> pd.DataFrame:
+        sql = f"SELECT {', '.join(DIARY_COLUMNS)} FROM diary"
+        params: List[object] = []
+        if user_id is not None:
+            sql += " WHERE user_id = ?"
+            params.append(user_id)
+        df = self._query(sql, params, DIARY_COLUMNS)
+        # CSV版（keep_default_na=False）と同じく、文字列列の欠損は空文字にそろえる
+        df[DIARY_TEXT_COLUMNS] = df[DIARY_TEXT_COLUMNS].fillna("")
+        return coerce_diary(df)
+
+    def write_diary(self, df: pd.DataFrame) -> None:
+        sql = _insert_sql("diary", DIARY_COLUMNS)
+        self._executemany(
+            [("DELETE FROM diary", [])]
+            + [(sql, _row_params(row, DIARY_COLUMNS)) for row in df.to_dict("records")]
+            + [_bump("diary")]
+        )
+
+    def upsert_diary_row(self, row: dict) -> None:
+        self._executemany(
+            [
+                (
+                    "DELETE FROM diary WHERE user_id = ? AND tx_id = ?",
+                    [row["user_id"], row["tx_id"]],
+                ),
+                (_insert_sql("diary", DIARY_COLUMNS), _row_params(row, DIARY_COLUMNS)),
+                _bump("diary", row["user_id"]),
+            ]
+        )
+
+    # --- chat ---
+
+    def write_chat_log(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        sql = _insert_sql("chat", CHAT_COLUMNS, "INSERT OR REPLACE")
+        self._executemany(
+            [
+                (sql, [tx_id, user_id, messages_json, _to_db(created_at)]),
+                ("DELETE FROM chat_turns WHERE tx_id = ? AND user_id = ?", [tx_id, user_id]),
+                _bump("chat", user_id),
+            ]
+        )
+
+    def append_chat_turn(
+        self, tx_id: str, user_id: str, messages_json: str, created_at: datetime
+    ) -> None:
+        sql = _insert_sql("chat_turns", CHAT_COLUMNS)
+        self._executemany(
+            [(sql, [tx_id, user_id, messages_json, _to_db(created_at)]), _bump("chat", user_id)]
+        )
+
+    def read_chat_log(self, tx_id: str, user_id: str) -> pd.DataFrame:
+        columns = ", ".join(CHAT_COLUMNS)
+        df = self._query(
+            f"SELECT {columns} FROM ("
+            f"SELECT {columns}, 0 AS part, 0 AS seq FROM chat WHERE tx_id = ? AND user_id = ? "
+            f"UNION ALL SELECT {columns}, 1 AS part, rowid AS seq FROM chat_turns "
+            "WHERE tx_id = ? AND user_id = ?) ORDER BY part, seq",
+            [tx_id, user_id, tx_id, user_id],
+            CHAT_COLUMNS,
+        )
+        df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce")
+        return df
+
+    # --- 版 ---
+
+    def table_version(self, table: str, user_id: Optional[str] = None) -> str:
+        """全体置き換えの版と、ユーザー単位（未指定なら全ユーザー合計）の版を組み合わせる。"""
+        self.ensure_data_files()
+        conn = self._connect()
+        epoch, total = conn.execute(
+            "SELECT COALESCE(SUM(CASE WHEN user_id = ? THEN version END), 0), "
+            "COALESCE(SUM(CASE WHEN user_id != ? AND (? IS NULL OR user_id = ?) THEN version END), 0) "
+            "FROM table_versions WHERE name = ?",
+            [ALL_USERS, ALL_USERS, user_id, user_id, table],
+        ).fetchone()
+        return f"{epoch}.{total}"
+
+    def versioned_write(
+        self, table: str, user_id: str, write: Callable[[], None]
+    ) -> Tuple[str, str]:
+        # 版の読み取りから書き込みまでを、他のワーカーの versioned_write とファイルロックで排他にする
+        with table_lock(self.path.with_name(f"{self.path.name}.{table}")):
+            before = self.table_version(table, user_id)
+            write()
+            return before, self.table_version(table, user_id)
+
+
+def migrate_from_csv(target: Optional[SqliteStorage] = None) -> dict:
+    """既存CSV（users / transactions / diary / chat）を SQLite へ丸ごと移す。
+
+    何度実行しても結果は同じ（各テーブルを置き換える）。件数を返す。
+    """
+    from app.repositories import csv_store
+
+    target = target or SqliteStorage()
+    target.ensure_data_files()
+
+    users = csv_store.read_users()
+    transactions = csv_store.read_transactions()
+    diary = csv_store.read_diary()
+    chat = csv_store.read_chat_logs()
+
+    target._executemany([("DELETE FROM users", [])])
+    target.write_users(users)
+    target.write_transactions(transactions)
+    target.write_diary(diary if not diary.empty else pd.DataFrame(columns=DIARY_COLUMNS))
+
+    # 会話ごとに先頭の行を chat へ、続くターンの行を保存順のまま chat_turns へ移す
+    first = chat.groupby(["tx_id", "user_id"], sort=False).cumcount() == 0
+    chat_sql = _insert_sql("chat", CHAT_COLUMNS)
+    turn_sql = _insert_sql("chat_turns", CHAT_COLUMNS)
+    target._executemany(
+        [("DELETE FROM chat", []), ("DELETE FROM chat_turns", [])]
+        + [(chat_sql, _row_params(row, CHAT_COLUMNS)) for row in chat[first].to_dict("records")]
+        + [(turn_sql, _row_params(row, CHAT_COLUMNS)) for row in chat[~first].to_dict("records")]
+        + [_bump("chat")]
+    )
+    return {
+        "users": len(users),
+        "transactions": len(transactions),
+        "diary": len(diary),
+        "chat": int(first.sum()),
+    }
@@ -0,0 +1,96 @@
+"""サービス層から使うストレージの窓口。
+
+STORAGE_BACKEND の設定に応じて CSV / SQLite のどちらかに委譲する。
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+
+from app.core.config import STORAGE_BACKEND
+from app.repositories.base import StorageBackend
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "csv":
+        from app.repositories.csv_store import CsvStorage
+
+        return CsvStorage()
+    if STORAGE_BACKEND == "sqlite":
+        from app.repositories.sqlite_store import SqliteStorage
+
+        return SqliteStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+def ensure_data_files() -> None:
+    get_storage().ensure_data_files()
+
+
+def read_users() -> pd.DataFrame:
+    return get_storage().read_users()
+
+
+def get_user_row(user_id: str) -> Optional[dict]:
+    return get_storage().get_user_row(user_id)
+
+
+def read_transactions(
+    user_id: Optional[str] = None, columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    return get_storage().read_transactions(user_id, columns)
+
+
+def get_transaction_row(tx_id: str) -> Optional[dict]:
+    return get_storage().get_transaction_row(tx_id)
+
+
+def write_transactions(df: pd.DataFrame) -> None:
+    get_storage().write_transactions(df)
+
+
+def insert_transaction_row(row: dict) -> None:
+    get_storage().insert_transaction_row(row)
+
+
+def update_transaction_row(row: dict) -> None:
+    get_storage().update_transaction_row(row)
+
+
+def delete_transaction_row(tx_id: str, user_id: str) -> None:
+    get_storage().delete_transaction_row(tx_id, user_id)
+
+
+def read_diary(user_id: Optional[str] = None) -> pd.DataFrame:
+    return get_storage().read_diary(user_id)
+
+
+def write_diary(df: pd.DataFrame) -> None:
+    get_storage().write_diary(df)
+
+
+def upsert_diary_row(row: dict) -> None:
+    get_storage().upsert_diary_row(row)
+
+
+def write_chat_log(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> None:
+    get_storage().write_chat_log(tx_id, user_id, messages_json, created_at)
+
+
+def append_chat_turn(tx_id: str, user_id: str, messages_json: str, created_at: datetime) -> None:
+    get_storage().append_chat_turn(tx_id, user_id, messages_json, created_at)
+
+
+def read_chat_log(tx_id: str, user_id: str) -> pd.DataFrame:
+    return get_storage().read_chat_log(tx_id, user_id)
+
+
+def table_version(table: str, user_id: Optional[str] = None) -> str:
+    return get_storage().table_version(table, user_id)
+
+
+def versioned_write(table: str, user_id: str, write: Callable[[], None]) -> Tuple[str, str]:
+    return get_storage().versioned_write(table, user_id, write)
@@ -1,61 +1,384 @@
+"""ふりかえりまとめ文のキャッシュ。
+
+(user_id, months) ごとに1エントリを持つキー付きストア。
+- メモリ: 上限 SUMMARY_CACHE_MAX_ENTRIES 件の LRU。ヒットすればファイルは読まない
+- ファイル: 書き込みは1行追記（fsync 付き）。SUMMARY_CACHE_COMPACT_EVERY 回追記するごとに
+  キーごとの最新行だけ・期限内の行だけに詰め直す
+- 期限: 最後に使われてから SUMMARY_CACHE_TTL_HOURS を過ぎたエントリは捨てる
+- 更新: エントリは捨てずに残す（stale-while-revalidate）。取引・日記が変わると入力の
+  content_hash が変わって get() は当たらなくなるが、作り直している間は latest() で直前の
+  テキストを返し、バックグラウンドで生成した新しいテキストを put() で上書きする
+
+ファイルは他のワーカーも書き込む。メモリにないキーは、ファイルの行の位置（オフセット）の索引から
+その1行だけを読む。索引は (user_id, months) ごとの最新行の位置・content_hash・時刻を持ち、ファイルが
+伸びた分だけを読んで足していく（詰め直しなどでファイルが差し替わったときだけ全体を読み直す）。
+"""
+
+import csv
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 import pandas as pd
 
-from app.core.config import DATA_DIR
+from app.core.config import (
+    DATA_DIR,
+    SUMMARY_CACHE_COMPACT_EVERY,
+    SUMMARY_CACHE_MAX_ENTRIES,
+    SUMMARY_CACHE_TTL_HOURS,
+)
+from app.repositories.file_io import append_csv_rows, atomic_write_csv
+from app.repositories.locks import table_lock
 
 CACHE_FILE = DATA_DIR / "retrospective_summary_cache.csv"
+CACHE_COLUMNS = ["user_id", "months", "content_hash", "summary_text", "generated_at", "used_at"]
+HEADER = ",".join(CACHE_COLUMNS)
 
+Key = Tuple[str, int]
 
-def _ensure_cache_file() -> None:
-    DATA_DIR.mkdir(exist_ok=True)
-    if not CACHE_FILE.exists():
-        CACHE_FILE.write_text(
-            "user_id,months,summary_text,generated_at\n", encoding="utf-8"
-        )
 
+@dataclass
+class _Entry:
+    content_hash: str
+    summary_text: str
+    generated_at: datetime
+    used_at: datetime
 
-def read_summary_cache(
-    user_id: str, months: int, ttl: timedelta
-) -> Optional[str]:
-    """キャッシュされたまとめテキストを返す。期限切れならNone。"""
-    _ensure_cache_file()
-    df = pd.read_csv(
-        CACHE_FILE,
-        dtype={"user_id": str, "months": int, "summary_text": str},
-        parse_dates=["generated_at"],
-    )
-    df = df[(df["user_id"] == user_id) & (df["months"] == int(months))]
-    if df.empty:
-        return None
-    latest = df.sort_values(by="generated_at").iloc[-1]
-    generated_at = latest["generated_at"]
-    if pd.isna(generated_at):
+
+@dataclass
+class _Indexed:
+    """ファイル上のキーごとの最新行（本文は持たず、位置だけ持つ）。"""
+
+    offset: int
+    length: int
+    content_hash: str
+    generated_at: datetime
+    used_at: datetime
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    if not value:
         return None
     try:
-        generated_dt = pd.to_datetime(generated_at).to_pydatetime()
-    except Exception:
-        return None
-    if datetime.utcnow() - generated_dt > ttl:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        ts = pd.to_datetime(value, errors="coerce")
+        return None if pd.isna(ts) else ts.to_pydatetime()
+
+
+def _parse_record(data: bytes) -> List[str]:
+    return next(csv.reader(io.StringIO(data.decode("utf-8"))), [])
+
+
+def _records(data: bytes) -> Iterator[Tuple[int, int]]:
+    """data の中の完結した行を (先頭位置, 長さ) で返す。
+
+    改行を含む値は引用符で囲まれるので、引用符の数が偶数になった改行で行が終わる。
+    書き込み途中の最後の行は返さない（次に読むときに拾う）。
+    """
+    start = pos = quotes = 0
+    while True:
+        newline = data.find(b"\n", pos)
+        if newline < 0:
+            return
+        quotes += data.count(b'"', pos, newline)
+        pos = newline + 1
+        if quotes % 2 == 0:
+            yield start, pos - start
+            start, quotes = pos, 0
+
+
+class SummaryCacheStore:
+    def __init__(self, path: Path, max_entries: int, ttl: timedelta, compact_every: int) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        # 本文のメモリキャッシュ（LRU）
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        # ファイルの索引。_indexed_size バイト目までを読んである
+        self._index: Dict[Key, _Indexed] = {}
+        self._months_by_user: Dict[str, Set[int]] = {}
+        self._indexed_inode: Optional[int] = None
+        self._indexed_size = 0
+        self._appended = 0
+        self._header_checked = False
+
+    # --- ファイル ---
+
+    def _ensure_file(self) -> None:
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(HEADER + "\n", encoding="utf-8")
+            self._header_checked = True
+            return
+        if not self._header_checked:
+            with self.path.open(encoding="utf-8") as f:
+                header = f.readline().strip()
+            if header != HEADER:
+                # 旧形式（列が違う）のファイルには追記できないので、今の列で書き直す
+                with table_lock(self.path):
+                    atomic_write_csv(self.path, self._read_file())
+            self._header_checked = True
+
+    def _read_file(self) -> pd.DataFrame:
+        df = pd.read_csv(
+            self.path,
+            dtype={"user_id": str, "content_hash": str, "summary_text": str},
+            keep_default_na=False,
+        )
+        # 列が足りない旧形式のファイルも読めるようにする
+        for col in CACHE_COLUMNS:
+            if col not in df.columns:
+                df[col] = ""
+        df["months"] = pd.to_numeric(df["months"], errors="coerce")
+        df["generated_at"] = pd.to_datetime(df["generated_at"], errors="coerce")
+        df["used_at"] = pd.to_datetime(df["used_at"], errors="coerce").fillna(df["generated_at"])
+        df = df.dropna(subset=["months", "generated_at"])
+        df["months"] = df["months"].astype(int)
+        # 以前の版が追記した無効化の印（content_hash 空の行）より前の行を落とす（印自体も落ちる）
+        pos = pd.Series(range(len(df)), index=df.index)
+        marks = pos[df["content_hash"] == ""].groupby(df["user_id"]).max()
+        if not marks.empty:
+            df = df[pos > df["user_id"].map(marks).fillna(-1)]
+        return df.drop_duplicates(subset=["user_id", "months"], keep="last")[CACHE_COLUMNS]
+
+    def _refresh_index(self) -> None:
+        """ファイルが伸びた分だけを読んで索引に足す。差し替わっていたら先頭から読み直す。"""
+        self._ensure_file()
+        st = self.path.stat()
+        if st.st_ino != self._indexed_inode or st.st_size < self._indexed_size:
+            self._index = {}
+            self._months_by_user = {}
+            self._indexed_inode = st.st_ino
+            self._indexed_size = 0
+        if st.st_size == self._indexed_size:
+            return
+        with self.path.open("rb") as f:
+            f.seek(self._indexed_size)
+            data = f.read(st.st_size - self._indexed_size)
+        base = self._indexed_size
+        consumed = 0
+        for start, length in _records(data):
+            consumed = start + length
+            if base + start == 0:
+                continue  # ヘッダー
+            self._index_record(base + start, length, _parse_record(data[start:consumed]))
+        self._indexed_size = base + consumed
+
+    def _index_record(self, offset: int, length: int, values: List[str]) -> None:
+        if len(values) != len(CACHE_COLUMNS):
+            return
+        user_id, months, content_hash, _, generated_at, used_at = values
+        try:
+            key = (user_id, int(float(months)))
+        except ValueError:
+            return
+        if content_hash == "":
+            # 以前の版が追記した無効化の印。それより前のこのユーザーの行を落とす
+            for m in self._months_by_user.pop(user_id, set()):
+                self._index.pop((user_id, m), None)
+            return
+        generated = _parse_time(generated_at)
+        if generated is None:
+            return
+        used = _parse_time(used_at) or generated
+        self._index[key] = _Indexed(offset, length, content_hash, generated, used)
+        self._months_by_user.setdefault(user_id, set()).add(key[1])
+
+    def _read_record(self, key: Key, indexed: _Indexed) -> Optional[List[str]]:
+        with self.path.open("rb") as f:
+            if os.fstat(f.fileno()).st_ino != self._indexed_inode:
+                return None
+            f.seek(indexed.offset)
+            values = _parse_record(f.read(indexed.length))
+        if len(values) != len(CACHE_COLUMNS) or values[0] != key[0] or values[2] != indexed.content_hash:
+            return None
+        return values
+
+    def _entry(self, key: Key, indexed: _Indexed) -> Optional[_Entry]:
+        """索引の行の本文を、メモリになければファイルのその1行だけを読んで返す。"""
+        entry = self._entries.get(key)
+        if (
+            entry is None
+            or entry.content_hash != indexed.content_hash
+            or entry.generated_at != indexed.generated_at
+        ):
+            values = self._read_record(key, indexed)
+            if values is None:
+                # 他のワーカーの詰め直しでファイルが差し替わっていた。索引し直して読み直す
+                self._refresh_index()
+                indexed = self._index.get(key)
+                values = self._read_record(key, indexed) if indexed is not None else None
+                if values is None:
+                    return None
+            entry = _Entry(indexed.content_hash, values[3], indexed.generated_at, indexed.used_at)
+        # メモリ上の最終利用時刻のほうが新しいことがある
+        entry.used_at = max(entry.used_at, indexed.used_at)
+        self._store(key, entry)
+        return entry
+
+    def _to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            [
+                {
+                    "user_id": user_id,
+                    "months": months,
+                    "content_hash": e.content_hash,
+                    "summary_text": e.summary_text,
+                    "generated_at": e.generated_at,
+                    "used_at": e.used_at,
+                }
+                for (user_id, months), e in self._entries.items()
+            ],
+            columns=CACHE_COLUMNS,
+        )
+
+    def compact(self) -> None:
+        """ファイルをキーごとの最新・期限内の行だけに書き直す。"""
+        with self._lock, table_lock(self.path):
+            self._ensure_file()
+            df = self._read_file()
+            cutoff = datetime.utcnow() - self.ttl
+            memory = self._to_frame()
+            if not memory.empty:
+                # メモリの最終利用時刻を反映する。ファイル側で無効化・上書き済みのエントリは戻さない
+                keys = ["user_id", "months", "content_hash"]
+                df = df.merge(
+                    memory[keys + ["used_at"]].rename(columns={"used_at": "_used_at"}),
+                    on=keys,
+                    how="left",
+                )
+                df["used_at"] = df[["used_at", "_used_at"]].max(axis=1)
+            df = df[df["used_at"] >= cutoff]
+            atomic_write_csv(self.path, df[CACHE_COLUMNS])
+            # 差し替えたファイルを索引し直す（メモリの本文は content_hash と生成時刻が同じならそのまま使う）
+            self._refresh_index()
+            self._appended = 0
+
+    # --- メモリ（LRU） ---
+
+    def _store(self, key: Key, entry: _Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _find(self, user_id: str, months: int, content_hash: str) -> Optional[str]:
+        now = datetime.utcnow()
+        # 同じ months を先に見て、なければ同じユーザーの他の months（同じ日記が選ばれている場合）
+        candidates = [months] + sorted(self._months_by_user.get(user_id, set()) - {months})
+        for m in candidates:
+            key = (user_id, m)
+            indexed = self._index.get(key)
+            if indexed is None or indexed.content_hash != content_hash:
+                continue
+            entry = self._entry(key, indexed)
+            if entry is None or now - entry.used_at > self.ttl:
+                continue
+            entry.used_at = now
+            return entry.summary_text
         return None
-    return str(latest["summary_text"])
-
-
-def write_summary_cache(user_id: str, months: int, summary_text: str) -> None:
-    _ensure_cache_file()
-    now = datetime.utcnow()
-    df = pd.read_csv(
-        CACHE_FILE,
-        dtype={"user_id": str, "months": int, "summary_text": str},
-        parse_dates=["generated_at"],
-    )
-    new_row = {
-        "user_id": user_id,
-        "months": int(months),
-        "summary_text": summary_text,
-        "generated_at": now,
-    }
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    df.to_csv(CACHE_FILE, index=False, date_format="%Y-%m-%dT%H:%M:%S")
 
+    # --- 公開API ---
+
+    def get(self, user_id: str, months: int, content_hash: str) -> Optional[str]:
+        with self._lock:
+            text = self._find(user_id, months, content_hash)
+            if text is None:
+                # 他のワーカーが書いたかもしれないので、伸びた分を索引に足してから探し直す
+                self._refresh_index()
+                text = self._find(user_id, months, content_hash)
+            return text
+
+    def latest(self, user_id: str, months: int) -> Optional[str]:
+        """(user_id, months) に最後に保存されたテキスト（入力が変わった後の古いものでもよい）。"""
+        key = (user_id, int(months))
+        with self._lock:
+            indexed = self._index.get(key)
+            if indexed is None:
+                self._refresh_index()
+                indexed = self._index.get(key)
+            if indexed is None:
+                return None
+            entry = self._entry(key, indexed)
+            if entry is None or datetime.utcnow() - entry.used_at > self.ttl:
+                return None
+            return entry.summary_text
+
+    def put(self, user_id: str, months: int, content_hash: str, summary_text: str) -> None:
+        # ファイルと同じ秒単位にそろえる（索引から読んだ行とメモリのエントリを generated_at で突き合わせる）
+        now = datetime.utcnow().replace(microsecond=0)
+        entry = _Entry(content_hash, summary_text, generated_at=now, used_at=now)
+        row = pd.DataFrame(
+            [{"user_id": user_id, "months": int(months), "content_hash": content_hash,
+              "summary_text": summary_text, "generated_at": now, "used_at": now}],
+            columns=CACHE_COLUMNS,
+        )
+        with self._lock:
+            with table_lock(self.path):
+                self._ensure_file()
+                append_csv_rows(self.path, row)
+                # 自分の行（と、それまでに他のワーカーが追記した行）を索引に足す
+                self._refresh_index()
+            self._store((user_id, int(months)), entry)
+            self._appended += 1
+            if self._appended >= self.compact_every:
+                self.compact()
+
+    def user_version(self, user_id: str) -> str:
+        """user_id の全 months 分のエントリ（content_hash と生成時刻）から作る版。
+
+        他のユーザーの書き込みや詰め直しでは変わらない。他のワーカーの書き込みは索引に足して反映する。
+        """
+        with self._lock:
+            self._refresh_index()
+            cutoff = datetime.utcnow() - self.ttl
+            parts = []
+            for m in sorted(self._months_by_user.get(user_id, ())):
+                indexed = self._index[(user_id, m)]
+                entry = self._entries.get((user_id, m))
+                used_at = max(indexed.used_at, entry.used_at) if entry is not None else indexed.used_at
+                if used_at >= cutoff:
+                    parts.append(f"{m}:{indexed.content_hash}:{indexed.generated_at.isoformat()}")
+            return "|".join(parts)
+
+
+_store = SummaryCacheStore(
+    CACHE_FILE,
+    max_entries=SUMMARY_CACHE_MAX_ENTRIES,
+    ttl=timedelta(hours=SUMMARY_CACHE_TTL_HOURS),
+    compact_every=SUMMARY_CACHE_COMPACT_EVERY,
+)
+
+
+def read_summary_cache(user_id: str, months: int, content_hash: str) -> Optional[str]:
+    """同じ入力（content_hash）から生成済みのまとめテキストを返す。なければNone。
+
+    入力が同じなら、同じユーザーの別の months のエントリも使う。
+    """
+    return _store.get(user_id, months, content_hash)
+
+
+def read_latest_summary(user_id: str, months: int) -> Optional[str]:
+    """入力（content_hash）を問わず、(user_id, months) の直近のまとめテキストを返す。なければNone。"""
+    return _store.latest(user_id, months)
+
+
+def write_summary_cache(user_id: str, months: int, content_hash: str, summary_text: str) -> None:
+    _store.put(user_id, months, content_hash, summary_text)
+
+
+def compact_summary_cache() -> None:
+    _store.compact()
+
+
+def summary_cache_user_version(user_id: str) -> str:
+    """user_id のまとめ文が保存・更新されるたびに変わる版（ETag 用）。"""
+    return _store.user_version(user_id)
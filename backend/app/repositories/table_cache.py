@@ -0,0 +1,227 @@
+"""CSVテーブルのプロセス内キャッシュ。
+
+ファイルの (mtime, size) をシグネチャとして保持し、他プロセスによる書き込みで
+シグネチャが変わったときだけ再パースする。自プロセスの書き込みは put() /
+append() / upsert_row() / apply() でキャッシュへ直接反映する（write-through）。
+lookup() はキー列の値→行位置の索引を使い、テーブルの行数によらず1行を引く。
+反映する行の日時はファイルと同じ秒単位に切り捨てる（読み直したときと同じ値を返すため）。
+"""
+
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+Signature = Tuple[Optional[Tuple[int, int]], ...]
+
+# ファイルに書く日時の精度（DATE_FORMAT が秒まで）
+STORED_PRECISION = "s"
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def as_stored(frame: pd.DataFrame) -> pd.DataFrame:
+    """日時の列をファイルに書かれる精度にそろえたコピーを返す。"""
+    frame = frame.copy()
+    for col in frame.columns:
+        if pd.api.types.is_datetime64_any_dtype(frame[col]):
+            frame[col] = frame[col].dt.floor(STORED_PRECISION)
+    return frame
+
+
+@dataclass
+class _Entry:
+    signature: Signature
+    frame: pd.DataFrame
+    # 追記された行は次の読み込み時にまとめて concat する
+    pending: List[pd.DataFrame] = field(default_factory=list)
+    # キー列名 -> {キー値: 行位置}。必要になった列だけ遅延して作る
+    indexes: Dict[str, Dict[Hashable, int]] = field(default_factory=dict)
+
+    def materialize(self) -> pd.DataFrame:
+        if self.pending:
+            frames = [f for f in [self.frame, *self.pending] if not f.empty]
+            if frames:
+                self.frame = pd.concat(frames, ignore_index=True)
+            self.pending = []
+        return self.frame
+
+    def index(self, key: str) -> Dict[Hashable, int]:
+        idx = self.indexes.get(key)
+        if idx is None:
+            frame = self.materialize()
+            idx = {value: pos for pos, value in enumerate(frame[key].tolist())}
+            self.indexes[key] = idx
+        return idx
+
+    def add_pending(self, rows: pd.DataFrame) -> None:
+        # 追記行の位置は「確定済み + 未結合分」の後ろに続く
+        start = len(self.frame) + sum(len(p) for p in self.pending)
+        for key, idx in list(self.indexes.items()):
+            if key not in rows.columns:
+                del self.indexes[key]
+                continue
+            for offset, value in enumerate(rows[key].tolist()):
+                idx[value] = start + offset
+        self.pending.append(rows.copy())
+
+
+class TableCache:
+    def __init__(self) -> None:
+        self._entries: Dict[Path, _Entry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(path: Path, depends_on: Sequence[Path] = ()) -> Signature:
+        return tuple(file_signature(p) for p in (path, *depends_on))
+
+    def get(
+        self,
+        path: Path,
+        loader: Callable[[], pd.DataFrame],
+        depends_on: Sequence[Path] = (),
+        select: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+    ) -> pd.DataFrame:
+        """キャッシュ済みのテーブルを返す。ファイルが変わっていれば loader で読み直す。
+
+        呼び出し側が自由に加工できるよう、常にコピーを返す。
+        depends_on にはテーブルの内容に影響する追加ファイル（ジャーナルなど）を渡す。
+        select を渡すと、テーブル全体をコピーせずに絞り込んだ結果だけを返す。
+        """
+        entry = self._fresh_entry(path, loader, depends_on)
+        with self._lock:
+            frame = entry.materialize()
+            return (select(frame) if select else frame).copy()
+
+    def lookup(
+        self,
+        path: Path,
+        loader: Callable[[], pd.DataFrame],
+        key: str,
+        value: Hashable,
+        depends_on: Sequence[Path] = (),
+    ) -> Optional[dict]:
+        """key 列が value の行を dict で返す（索引を使うので行数に依存しない）。なければ None。"""
+        entry = self._fresh_entry(path, loader, depends_on)
+        with self._lock:
+            pos = entry.index(key).get(value)
+            if pos is None:
+                return None
+            return entry.materialize().iloc[pos].to_dict()
+
+    def _fresh_entry(
+        self,
+        path: Path,
+        loader: Callable[[], pd.DataFrame],
+        depends_on: Sequence[Path],
+    ) -> _Entry:
+        signature = self.signature(path, depends_on)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.signature == signature:
+                return entry
+
+        # 読み込み前のシグネチャで登録する（読み込み中に書き換わっても次回に再読込される）
+        entry = _Entry(signature=signature, frame=loader().reset_index(drop=True))
+        with self._lock:
+            self._entries[path] = entry
+        return entry
+
+    def put(self, path: Path, frame: pd.DataFrame, depends_on: Sequence[Path] = ()) -> None:
+        """書き込み直後のテーブルをキャッシュへ反映する。"""
+        signature = self.signature(path, depends_on)
+        with self._lock:
+            self._entries[path] = _Entry(
+                signature=signature, frame=as_stored(frame.reset_index(drop=True))
+            )
+
+    def append(
+        self,
+        path: Path,
+        rows: pd.DataFrame,
+        previous: Signature,
+        depends_on: Sequence[Path] = (),
+    ) -> None:
+        """追記した行をキャッシュへ反映する。
+
+        previous は追記前のシグネチャ。キャッシュがそれと一致しない
+        （他プロセスの書き込みを取り込んでいない）場合は破棄して次回読み直す。
+        """
+        rows = as_stored(rows)
+        self._update(path, previous, depends_on, lambda entry: entry.add_pending(rows))
+
+    def upsert_row(
+        self,
+        path: Path,
+        key: str,
+        row: pd.DataFrame,
+        previous: Signature,
+        depends_on: Sequence[Path] = (),
+    ) -> None:
+        """1行の DataFrame をキーで上書き（なければ追記）する。索引を使い O(1) で反映する。"""
+        row = as_stored(row)
+
+        def _upsert(entry: _Entry) -> None:
+            value = row[key].iloc[0]
+            pos = entry.index(key).get(value)
+            if pos is None:
+                entry.add_pending(row)
+                return
+            frame = entry.materialize()
+            try:
+                for col in frame.columns:
+                    if col in row.columns:
+                        frame.iat[pos, frame.columns.get_loc(col)] = row[col].iloc[0]
+            except (TypeError, ValueError):
+                # 型が合わず代入できない列がある（int 列に小数など）ときは行を差し替える
+                rest = frame.drop(index=pos)
+                entry.frame = pd.concat([rest, row[frame.columns]], ignore_index=True)
+                entry.indexes.clear()
+
+        self._update(path, previous, depends_on, _upsert)
+
+    def apply(
+        self,
+        path: Path,
+        fn: Callable[[pd.DataFrame], pd.DataFrame],
+        previous: Signature,
+        depends_on: Sequence[Path] = (),
+    ) -> None:
+        """キャッシュ済みテーブルに変更関数を適用する。条件は append() と同じ。"""
+
+        def _apply(entry: _Entry) -> None:
+            entry.frame = fn(entry.materialize()).reset_index(drop=True)
+            entry.indexes.clear()
+
+        self._update(path, previous, depends_on, _apply)
+
+    def _update(
+        self,
+        path: Path,
+        previous: Signature,
+        depends_on: Sequence[Path],
+        mutate: Callable[[_Entry], None],
+    ) -> None:
+        signature = self.signature(path, depends_on)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry.signature != previous:
+                self._entries.pop(path, None)
+                return
+            mutate(entry)
+            entry.signature = signature
+
+    def invalidate(self, path: Optional[Path] = None) -> None:
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
@@ -0,0 +1,91 @@
+"""取引・日記テーブル本体のファイル形式（csv / parquet / feather）。
+
+parquet / feather は pyarrow が必要（`pip install pyarrow`）。日付は timestamp 型、
+user_id は categorical のまま保存されるため、読み込み時の日付パースが不要になる。
+行単位の追記ができないので、列指向形式では新規行もジャーナル（CSV）に書き、
+コンパクション時に本体へ畳み込む。
+"""
+
+import os
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+from app.repositories.file_io import atomic_write_csv
+
+FORMATS = ("csv", "parquet", "feather")
+COLUMNAR_FORMATS = ("parquet", "feather")
+
+
+def check_format(fmt: str) -> None:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown TABLE_FORMAT: {fmt} (expected one of {', '.join(FORMATS)})")
+    if fmt in COLUMNAR_FORMATS:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as exc:
+            raise RuntimeError(f"TABLE_FORMAT={fmt} requires pyarrow (pip install pyarrow)") from exc
+
+
+def is_columnar(fmt: str) -> bool:
+    return fmt in COLUMNAR_FORMATS
+
+
+def table_path(directory: Path, name: str, fmt: str) -> Path:
+    return directory / f"{name}.{fmt}"
+
+
+def _for_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reset_index(drop=True)
+    if "user_id" in df.columns:
+        df = df.assign(user_id=df["user_id"].astype("category"))
+    return df
+
+
+def write_frame(path: Path, df: pd.DataFrame, fmt: str) -> None:
+    """テーブル本体を原子的に書き換える（一時ファイル → fsync → os.replace）。"""
+    if fmt == "csv":
+        atomic_write_csv(path, df)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    df = _for_columnar(df)
+    if fmt == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_feather(tmp_path)
+    with tmp_path.open("rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_frame(
+    path: Path,
+    fmt: str,
+    read_csv: Callable[[Path], pd.DataFrame],
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """テーブル本体を読む。csv はテーブルごとの読み込み関数（dtype や日付パース込み）に任せる。"""
+    if fmt == "csv":
+        df = read_csv(path)
+        return df[columns] if columns is not None else df
+    if fmt == "parquet":
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_feather(path, columns=columns)
+    if "user_id" in df.columns and isinstance(df["user_id"].dtype, pd.CategoricalDtype):
+        # 追記行（文字列）との結合や比較で型が揺れないよう、メモリ上では文字列に戻す
+        df["user_id"] = df["user_id"].astype(str)
+    return df
+
+
+def ensure_frame(path: Path, columns: List[str], fmt: str) -> None:
+    """ファイルがなければ空のテーブルを作る。"""
+    if path.exists():
+        return
+    if fmt == "csv":
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(",".join(columns) + "\n", encoding="utf-8")
+        return
+    write_frame(path, pd.DataFrame({col: pd.Series(dtype="object") for col in columns}), fmt)
@@ -1,14 +1,30 @@
-from fastapi import APIRouter, HTTPException, Request, Response
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from itsdangerous import BadSignature, SignatureExpired, TimestampSigner
 
-from app.core.config import SESSION_COOKIE_NAME, SESSION_MAX_AGE, SESSION_SECRET
-from app.repositories.csv_store import read_users
+from app.core.config import (
+    SESSION_CACHE_MAX_ENTRIES,
+    SESSION_CACHE_TTL_SECONDS,
+    SESSION_COOKIE_NAME,
+    SESSION_MAX_AGE,
+    SESSION_SECRET,
+)
+from app.repositories.storage import get_user_row, table_version
 from app.schemas.auth import LoginRequest, User
+from app.utils.ttl_cache import TTLCache
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 signer = TimestampSigner(SESSION_SECRET)
 
+# 検証済みの Cookie の値 -> (ユーザー, 検証時のユーザー表の版)。
+# 期限は SESSION_CACHE_TTL_SECONDS と署名の残り有効期間の短いほう
+_sessions: TTLCache[str, Tuple[User, str]] = TTLCache(
+    SESSION_CACHE_MAX_ENTRIES, ttl_seconds=SESSION_CACHE_TTL_SECONDS
+)
+
 
 def _issue_cookie(response: Response, user_id: str) -> None:
     token = signer.sign(user_id.encode("utf-8")).decode("utf-8")
@@ -32,43 +48,66 @@ def _clear_cookie(response: Response) -> None:
     )
 
 
-def _get_user_from_cookie(request: Request) -> User:
-    token = request.cookies.get(SESSION_COOKIE_NAME)
-    if not token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+def _find_user(user_id: str) -> Optional[User]:
+    row = get_user_row(user_id)
+    if row is None:
+        return None
+    return User(user_id=row["user_id"], display_name=row.get("display_name"))
+
+
+def _verify_session(token: str) -> Tuple[User, float]:
+    """署名とユーザーを確かめ、ユーザーと署名の残り有効秒数を返す。"""
     try:
-        user_id = signer.unsign(token, max_age=SESSION_MAX_AGE).decode("utf-8")
+        value, signed_at = signer.unsign(token, max_age=SESSION_MAX_AGE, return_timestamp=True)
     except SignatureExpired:
         raise HTTPException(status_code=401, detail="Session expired")
     except BadSignature:
         raise HTTPException(status_code=401, detail="Invalid session")
 
-    df = read_users()
-    match = df[df["user_id"] == user_id]
-    if match.empty:
+    user = _find_user(value.decode("utf-8"))
+    if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    row = match.iloc[0]
-    return User(user_id=row["user_id"], display_name=row.get("display_name"))
+    remaining = SESSION_MAX_AGE - (datetime.now(timezone.utc) - signed_at).total_seconds()
+    return user, remaining
+
+
+def get_current_user(request: Request) -> User:
+    """Cookie のセッションからログイン中のユーザーを返す（ルーターの Depends 用）。
+
+    検証結果は Cookie の値ごとにキャッシュし、ユーザー表の版が変わっていなければ
+    署名の検証とユーザーの検索を省く。
+    """
+    token = request.cookies.get(SESSION_COOKIE_NAME)
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    users_version = table_version("users")
+    cached = _sessions.get(token)
+    if cached is not None and cached[1] == users_version:
+        return cached[0]
+
+    user, remaining = _verify_session(token)
+    _sessions.set(token, (user, users_version), ttl_seconds=remaining)
+    return user
 
 
 @router.post("/login", response_model=User)
 def login(payload: LoginRequest, response: Response) -> User:
-    df = read_users()
-    match = df[df["user_id"] == payload.user_id]
-    if match.empty:
+    user = _find_user(payload.user_id)
+    if user is None:
         raise HTTPException(status_code=401, detail="User not found")
-    row = match.iloc[0]
-    user = User(user_id=row["user_id"], display_name=row.get("display_name"))
     _issue_cookie(response, user.user_id)
     return user
 
 
 @router.post("/logout", status_code=204)
-def logout(response: Response) -> None:
+def logout(request: Request, response: Response) -> None:
+    token = request.cookies.get(SESSION_COOKIE_NAME)
+    if token:
+        _sessions.pop(token)
     _clear_cookie(response)
 
 
 @router.get("/me", response_model=User)
-def me(request: Request) -> User:
-    return _get_user_from_cookie(request)
+def me(user: User = Depends(get_current_user)) -> User:
+    return user
 
@@ -1,9 +1,11 @@
 from typing import List, Optional
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse
 
-from app.routers.auth import _get_user_from_cookie
+from app.repositories.storage import table_version
+from app.routers.auth import get_current_user
+from app.schemas.auth import User
 from app.schemas.diary import (
     ChatHistoryResponse,
     ChatStreamRequest,
@@ -14,17 +16,23 @@ from app.schemas.diary import (
     SaveDiaryResponse,
 )
 from app.services.diary import generate_diary, get_chat_history, list_diaries, save_diary, stream_chat
+from app.utils.etag import cache_headers, is_not_modified, make_etag, not_modified
+from app.utils.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from app.utils.serialize import RecordsResponse
 
 router = APIRouter(prefix="/diary", tags=["diary"])
 
 
 @router.post("/chat/stream")
-async def chat_stream(payload: ChatStreamRequest, request: Request) -> StreamingResponse:
-    user = _get_user_from_cookie(request)
+async def chat_stream(
+    payload: ChatStreamRequest, user: User = Depends(get_current_user)
+) -> StreamingResponse:
 
     async def event_generator():
         try:
-            for token in stream_chat(payload.tx_id, payload.messages, user.user_id):
+            async for token in stream_chat(
+                payload.tx_id, payload.messages, user.user_id, new_message=payload.message
+            ):
                 yield f"data: {token}\n\n"
             yield "data: [DONE]\n\n"
         except Exception as exc:
@@ -34,14 +42,14 @@ async def chat_stream(payload: ChatStreamRequest, request: Request) -> Streaming
 
 
 @router.post("/generate", response_model=GenerateDiaryResponse)
-def generate(payload: GenerateDiaryRequest, request: Request) -> GenerateDiaryResponse:
-    user = _get_user_from_cookie(request)
+def generate(
+    payload: GenerateDiaryRequest, user: User = Depends(get_current_user)
+) -> GenerateDiaryResponse:
     return generate_diary(payload.tx_id, payload.messages, user.user_id)
 
 
 @router.post("/save", response_model=SaveDiaryResponse)
-def save(payload: SaveDiaryRequest, request: Request) -> SaveDiaryResponse:
-    user = _get_user_from_cookie(request)
+def save(payload: SaveDiaryRequest, user: User = Depends(get_current_user)) -> SaveDiaryResponse:
     saved = save_diary(payload.tx_id, payload.diary_title, payload.diary_body, user.user_id)
     return SaveDiaryResponse(
         id=saved["id"],
@@ -64,9 +72,22 @@ def list_diary(
     price_min: Optional[float] = None,
     price_max: Optional[float] = None,
     sentiment: Optional[int] = None,
-) -> List[DiaryEntry]:
-    user = _get_user_from_cookie(request)
-    return list_diaries(
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(default=None, description="返す列（カンマ区切り）"),
+    user: User = Depends(get_current_user),
+) -> Response:
+    # 金額・感情スコアの絞り込みに取引も使うため、両方の版を含める
+    etag = make_etag(
+        "diary",
+        user.user_id,
+        table_version("diary", user.user_id),
+        table_version("transactions", user.user_id),
+        request.url.query,
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    records, next_cursor = list_diaries(
         user.user_id,
         year=year,
         month=month,
@@ -74,12 +95,22 @@ def list_diary(
         price_min=price_min,
         price_max=price_max,
         sentiment=sentiment,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
     )
+    extra = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return RecordsResponse(records, headers=cache_headers(etag, extra))
 
 
 @router.get("/chat", response_model=ChatHistoryResponse)
-def get_chat(tx_id: str, request: Request) -> ChatHistoryResponse:
-    user = _get_user_from_cookie(request)
+def get_chat(
+    tx_id: str, request: Request, response: Response, user: User = Depends(get_current_user)
+) -> ChatHistoryResponse:
+    etag = make_etag("chat", user.user_id, table_version("chat", user.user_id), tx_id)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
     messages = get_chat_history(tx_id, user.user_id)
+    response.headers.update(cache_headers(etag))
     return ChatHistoryResponse(messages=messages)
 
@@ -1,15 +1,43 @@
-from fastapi import APIRouter, Request
+from datetime import date
+from typing import Literal
 
-from app.routers.auth import _get_user_from_cookie
+from fastapi import APIRouter, Depends, Query, Request, Response
+
+from app.core.config import RETROSPECTIVE_MAX_MONTHS
+from app.repositories.storage import table_version
+from app.repositories.summary_cache import summary_cache_user_version
+from app.routers.auth import get_current_user
+from app.schemas.auth import User
 from app.schemas.retrospective import RetrospectiveSummary
 from app.services.retrospective import summarize_retrospective
+from app.utils.etag import cache_headers, is_not_modified, make_etag, not_modified
 
 router = APIRouter(prefix="/retrospective", tags=["retrospective"])
 
 
 @router.get("/summary", response_model=RetrospectiveSummary)
-def get_retrospective_summary(request: Request, months: int = 12) -> RetrospectiveSummary:
-    user = _get_user_from_cookie(request)
-    safe_months = months if months > 0 else 12
-    return summarize_retrospective(user.user_id, months=safe_months)
+def get_retrospective_summary(
+    request: Request,
+    response: Response,
+    months: int = Query(default=12, ge=1),
+    daily_format: Literal["full", "compact"] = "full",
+    user: User = Depends(get_current_user),
+) -> RetrospectiveSummary:
+    # 日ごとの気分は期間の日数分になるため、期間は RETROSPECTIVE_MAX_MONTHS までに抑える
+    safe_months = min(months, RETROSPECTIVE_MAX_MONTHS)
+    # 集計期間は今日基準、まとめ文はキャッシュの更新で変わるため、日付とこのユーザーのキャッシュの版も含める
+    etag = make_etag(
+        "retrospective",
+        user.user_id,
+        safe_months,
+        daily_format,
+        date.today().isoformat(),
+        table_version("transactions", user.user_id),
+        table_version("diary", user.user_id),
+        summary_cache_user_version(user.user_id),
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers.update(cache_headers(etag))
+    return summarize_retrospective(user.user_id, months=safe_months, daily_format=daily_format)
 
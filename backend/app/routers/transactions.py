@@ -1,9 +1,11 @@
 from datetime import date
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 
+from app.repositories.storage import table_version
 from app.schemas.transactions import (
+    HappyTotal,
     TransactionCreate,
     TransactionOut,
     TransactionUpdate,
@@ -12,26 +14,61 @@ from app.services.transactions import (
     create_transaction,
     delete_transaction,
     get_transaction,
+    happy_totals,
     list_transactions,
     update_transaction,
 )
+from app.utils.etag import cache_headers, is_not_modified, make_etag, not_modified
+from app.utils.pagination import MAX_PAGE_SIZE, NEXT_CURSOR_HEADER
+from app.utils.serialize import RecordsResponse
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 
 
 @router.get("", response_model=List[TransactionOut])
 def list_tx(
+    request: Request,
     user_id: str,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     date_exact: Optional[date] = None,
-) -> List[TransactionOut]:
-    return list_transactions(
+    limit: Optional[int] = Query(default=None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(default=None, description="返す列（カンマ区切り）"),
+) -> Response:
+    etag = make_etag(
+        "transactions", user_id, table_version("transactions", user_id), request.url.query
+    )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    records, next_cursor = list_transactions(
         user_id=user_id,
         start_date=start_date,
         end_date=end_date,
         date_exact=date_exact,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
+    )
+    extra = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return RecordsResponse(records, headers=cache_headers(etag, extra))
+
+
+@router.get("/happy-totals", response_model=List[HappyTotal])
+def happy_totals_tx(
+    request: Request,
+    user_id: str,
+    period: Literal["month", "year"] = "year",
+    year: Optional[int] = None,
+) -> Response:
+    if period == "month" and year is None:
+        raise HTTPException(status_code=422, detail="year is required when period=month")
+    etag = make_etag(
+        "happy-totals", user_id, table_version("transactions", user_id), request.url.query
     )
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    return RecordsResponse(happy_totals(user_id, period, year), headers=cache_headers(etag))
 
 
 @router.get("/{tx_id}", response_model=TransactionOut)
@@ -11,8 +11,13 @@ class ChatMessage(BaseModel):
 
 class ChatStreamRequest(BaseModel):
     tx_id: str = Field(..., description="対象となるトランザクションID")
+    message: Optional[str] = Field(
+        default=None,
+        description="新しいユーザー発話。指定したときは履歴をサーバー側の保存済みの会話から組み立て、messages は使わない",
+    )
     messages: List[ChatMessage] = Field(
-        default_factory=list, description="これまでのチャット履歴（systemはサーバー側で付与）"
+        default_factory=list,
+        description="これまでのチャット履歴（systemはサーバー側で付与）。message を指定しないときに使う。空なら会話をやり直す",
     )
 
 
@@ -37,6 +37,18 @@ class DailyMood(BaseModel):
     count: int
 
 
+class DailyMoodGrid(BaseModel):
+    """start から days 日分の日ごとの気分。
+
+    mood_scores は int8（-2〜2）、counts は uint16 のリトルエンディアン列を base64 にしたもの。
+    """
+
+    start: date
+    days: int
+    mood_scores: str
+    counts: str
+
+
 class RetrospectiveSummary(BaseModel):
     happy_money_top3_diaries: List[RetrospectiveDiary]
     happy_money_worst3_diaries: List[RetrospectiveDiary]
@@ -44,6 +56,7 @@ class RetrospectiveSummary(BaseModel):
     yearly_happy_money_worst3: List[RetrospectiveEvent]
     emotion_buckets: List[EmotionBucket]
     daily_moods: List[DailyMood]
+    daily_mood_grid: Optional[DailyMoodGrid] = None
     summary_text: str
     diary_top_insufficient: bool = False
     diary_worst_insufficient: bool = False
@@ -30,3 +30,9 @@ class TransactionOut(TransactionBase):
     created_at: datetime
     updated_at: datetime
 
+
+class HappyTotal(BaseModel):
+    # 月ごとは "YYYY-MM"、年ごとは "YYYY"
+    label: str
+    positive: float
+    negative: float
@@ -1,39 +1,102 @@
 import os
 import json
+import hashlib
+import asyncio
 import textwrap
 import logging
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Generator, Iterable, List, Optional
+from typing import Any, AsyncGenerator, Dict, Iterable, Iterator, List, Optional, Tuple
 from uuid import uuid4
 
 import pandas as pd
 from fastapi import HTTPException
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
 
 from app.constants.mood import get_mood_label
-from app.repositories.csv_store import append_chat_log, read_chat_log, read_diary, read_transactions, write_diary
+from app.core.config import (
+    CHAT_CONTEXT_MAX_TOKENS,
+    CHAT_CONVERSATION_CACHE_MAX_ENTRIES,
+    CHAT_CONVERSATION_CACHE_TTL_SECONDS,
+)
+from app.repositories.diary_generation_cache import (
+    read_diary_generation_cache,
+    write_diary_generation_cache,
+)
+from app.repositories.storage import (
+    append_chat_turn,
+    read_chat_log,
+    read_diary,
+    read_transactions,
+    table_version,
+    upsert_diary_row,
+    versioned_write,
+    write_chat_log,
+)
 from app.schemas.diary import ChatMessage, DiaryEntry, GenerateDiaryResponse
 from app.services.transactions import get_transaction
+from app.utils.events import DIARY_SAVED, ChangeEvent, publish
+from app.utils.pagination import keyset_page, parse_fields
+from app.utils.serialize import frame_to_records
+from app.utils.single_flight import SingleFlight
+from app.utils.tokens import count_message_tokens, leading_items_to_drop
+from app.utils.ttl_cache import TTLCache
 
 
 load_dotenv()
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# 互換サーバー（ベンチマーク用スタブなど）を使う場合の接続先。未指定なら OpenAI 本番
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL) if OPENAI_API_KEY else None
+# ストリーミングはイベントループを塞がないよう非同期クライアントで行う
+async_client = (
+    AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL) if OPENAI_API_KEY else None
+)
 SESSION_ID = "debug-session"
 RUN_ID = "run1"
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(logging.DEBUG)
 
 
+# チャットの人格・進め方の指示。毎回同じ文字列をプロンプトの先頭に置き、
+# LLM 側のプロンプトキャッシュ（先頭が一致する部分の再利用）が効くようにする。イベント情報はこの後ろに付ける
+CHAT_PERSONA_PROMPT = (
+    "あなたはユーザーの日記作成を支援するアシスタントです。\n"
+    "以下のイベント情報を踏まえ、あなたが主体となって質問を投げかけ、ユーザーから詳細を引き出してください。\n"
+    "【やりたいこと】 以下の「出来事」と「実際の金額」「感情」「得られた価値」をもとに、ユーザー自身の感情がリアルに伝わる日記を書きたいです。\n"
+    " 商品の購入場所や商品・サービスの詳しい説明などの「ハード面」の情報は不要です。\n"
+    "それよりも、ユーザーの喜怒哀楽、期待と不安、落胆や感動など、**「主観的な感情のドラマ」**に焦点を当てて、魅力的な文章にしたい。\n"
+    "質問は1ターンに1つのみを厳守し、分かりやすく平易な言葉を用いてください。簡単・簡潔に答えられるものにしてください。\n"
+    "最終的には日記タイトルと本文を組み立てやすい情報を集めます。\n"
+    "日記を生成するために十分の情報が得られた場合、「ありがとうっピィ！日記作成に進んでほしいっピィ！」と伝えて。最大でも7個の質問までにしてください\n"
+    "「感情」の値を基に、値が低ければ辛い出来事、値が高ければ嬉しい出来事として質問してください。\n"
+    "あなたの名前はハッピーちゃんです。幸せを運ぶ青い鳥がモチーフの妖精です。「っピィ」が語尾です。\n"
+    "敬語は使わず、口調はユーザーと同じくらいの口調でください。「っピィ？」と質問してください。\n"
+)
+# 同じ入力の日記生成が同時に来たら、LLM 呼び出しは1回にまとめる
+_generation_flight: SingleFlight[GenerateDiaryResponse] = SingleFlight()
+
+# 履歴を削ったときに、残した履歴の前に入れる断り書き
+CHAT_HISTORY_OMITTED_NOTE = "（これより前の会話は長いため省略しています）"
+# 履歴は古いほうからこの件数単位で削る（削る位置がターンごとに動かないようにする）
+CHAT_HISTORY_TRIM_STEP = 8
+
+
 def _ensure_client() -> OpenAI:
     if client is None:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not set")
     return client
 
 
+def _ensure_async_client() -> AsyncOpenAI:
+    if async_client is None:
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not set")
+    return async_client
+
+
 def _log_debug(hypothesis_id: str, location: str, message: str, data: dict) -> None:
     payload = {
         "sessionId": SESSION_ID,
@@ -59,32 +122,123 @@ def _format_messages(system_prompt: str, messages: Iterable[ChatMessage]):
     return formatted
 
 
-def _load_chat_messages(tx_id: str, user_id: str) -> List[ChatMessage]:
-    """CSVからチャット履歴をロードし、user/assistantのみを返す。"""
-    df = read_chat_log(tx_id, user_id)
-    if df.empty:
-        return []
-    try:
-        raw = json.loads(df.iloc[-1]["messages_json"])
-        if not isinstance(raw, list):
-            return []
-    except Exception:
-        return []
+def _replay_chat_log(df: pd.DataFrame) -> Iterator[dict]:
+    """保存済みの会話の行を順に展開し、メッセージを1件ずつ返す。
 
-    messages: List[ChatMessage] = []
-    for m in raw:
+    各行の messages_json はその行で増えたメッセージだけを持つ（1行目は会話の始まり）。
+    会話全体を1行で持つ旧形式も同じ規則で読める。壊れた行は飛ばす。
+    """
+    for messages_json in df["messages_json"].tolist():
         try:
-            role = m.get("role")
-            content = m.get("content")
+            raw = json.loads(messages_json)
         except Exception:
             continue
-        if role not in ("user", "assistant"):
-            # systemなどはUIには返さない
+        if not isinstance(raw, list):
             continue
+        for m in raw:
+            if isinstance(m, dict):
+                yield m
+
+
+def _load_chat_state(tx_id: str, user_id: str) -> Tuple[Optional[str], List[ChatMessage]]:
+    """保存済みの会話から、最後に保存したシステムプロンプトと user/assistant の履歴を返す。"""
+    df = read_chat_log(tx_id, user_id)
+    system_prompt: Optional[str] = None
+    messages: List[ChatMessage] = []
+    if df.empty:
+        return system_prompt, messages
+    for m in _replay_chat_log(df):
+        role = m.get("role")
+        content = m.get("content")
         if not isinstance(content, str):
             continue
-        messages.append(ChatMessage(role=role, content=content))
-    return messages
+        if role == "system":
+            system_prompt = content
+        elif role in ("user", "assistant"):
+            # systemなどはUIには返さない
+            messages.append(ChatMessage(role=role, content=content))
+    return system_prompt, messages
+
+
+@dataclass
+class _Conversation:
+    # 読み込んだときのチャットログの版（table_version("chat", user_id)）
+    version: str
+    system_prompt: Optional[str]
+    messages: List[ChatMessage]
+
+
+# 最近使われた会話の履歴。(user_id, tx_id) -> 会話。
+# 別ワーカーの書き込みに追従するため、版が変わっていれば読み直す
+_conversations: TTLCache[Tuple[str, str], _Conversation] = TTLCache(
+    CHAT_CONVERSATION_CACHE_MAX_ENTRIES, ttl_seconds=CHAT_CONVERSATION_CACHE_TTL_SECONDS
+)
+
+
+def _load_conversation(tx_id: str, user_id: str) -> _Conversation:
+    # 版は読み込みより先に取る（読み込み中に書き込まれても、次に使うときに読み直される）
+    version = table_version("chat", user_id)
+    cached = _conversations.get((user_id, tx_id))
+    if cached is not None and cached.version == version:
+        return cached
+    system_prompt, messages = _load_chat_state(tx_id, user_id)
+    conversation = _Conversation(version, system_prompt, messages)
+    _conversations.set((user_id, tx_id), conversation)
+    return conversation
+
+
+def _load_chat_messages(tx_id: str, user_id: str) -> List[ChatMessage]:
+    """保存済みのチャット履歴をロードし、user/assistantのみを返す。"""
+    return list(_load_conversation(tx_id, user_id).messages)
+
+
+def _save_chat_turn(
+    tx_id: str,
+    user_id: str,
+    system_prompt: str,
+    messages: List[ChatMessage],
+    assistant_content: Optional[str],
+) -> None:
+    """1ターン分の会話を保存する。保存済みの履歴に続く分（と、変わったときだけシステムプロンプト）を追記する。
+
+    クライアントの履歴が保存済みの履歴の続きになっていない（やり直しなど）ときは、会話ごと書き直す。
+    assistant_content が None のときは、応答を待たずに messages までを保存する。
+    """
+    conversation = _load_conversation(tx_id, user_id)
+    stored = conversation.messages
+    if assistant_content is not None:
+        messages = [*messages, ChatMessage(role="assistant", content=assistant_content)]
+    created_at = datetime.utcnow()
+    continues = len(stored) <= len(messages) and all(
+        s.role == m.role and s.content == m.content for s, m in zip(stored, messages)
+    )
+    in_sync = table_version("chat", user_id) == conversation.version
+    if conversation.system_prompt is not None and continues:
+        delta = [{"role": m.role, "content": m.content} for m in messages[len(stored):]]
+        if conversation.system_prompt != system_prompt:
+            delta.insert(0, {"role": "system", "content": system_prompt})
+        if delta:
+            append_chat_turn(tx_id, user_id, json.dumps(delta, ensure_ascii=False), created_at)
+    else:
+        write_chat_log(
+            tx_id,
+            user_id,
+            json.dumps(_format_messages(system_prompt, messages), ensure_ascii=False),
+            created_at,
+        )
+    if not in_sync:
+        # 読み込み後に別ワーカーが書き込んでいる。次に使うときに読み直す
+        _conversations.pop((user_id, tx_id))
+        return
+    # 自分の書き込みだけなら、保存した内容をそのままメモリに持つ
+    _conversations.set(
+        (user_id, tx_id),
+        _Conversation(
+            table_version("chat", user_id),
+            system_prompt,
+            list(messages),
+        ),
+    )
 
 
 def _build_conversation_history_text(event, messages: Iterable[ChatMessage]) -> str:
@@ -128,36 +282,57 @@ def _build_conversation_history_text(event, messages: Iterable[ChatMessage]) ->
     return "\n".join(lines)
 
 
-def stream_chat(tx_id: str, messages: List[ChatMessage], user_id: str) -> Generator[str, None, None]:
-    event = get_transaction(tx_id)
+def _chat_system_prompt(event) -> str:
+    """固定の人格プロンプトの後ろに、イベント情報を付ける。"""
     mood_label = get_mood_label(event.mood_score)
-    system_prompt = (
-        "あなたはユーザーの日記作成を支援するアシスタントです。\n"
-        "以下のイベント情報を踏まえ、あなたが主体となって質問を投げかけ、ユーザーから詳細を引き出してください。\n"
-        "【やりたいこと】 以下の「出来事」と「実際の金額」「感情」「得られた価値」をもとに、ユーザー自身の感情がリアルに伝わる日記を書きたいです。\n"
-        " 商品の購入場所や商品・サービスの詳しい説明などの「ハード面」の情報は不要です。\n"
-        "それよりも、ユーザーの喜怒哀楽、期待と不安、落胆や感動など、**「主観的な感情のドラマ」**に焦点を当てて、魅力的な文章にしたい。\n"
-        "質問は1ターンに1つのみを厳守し、分かりやすく平易な言葉を用いてください。簡単・簡潔に答えられるものにしてください。\n"
-        "最終的には日記タイトルと本文を組み立てやすい情報を集めます。\n"
-        "日記を生成するために十分の情報が得られた場合、「ありがとうっピィ！日記作成に進んでほしいっピィ！」と伝えて。最大でも7個の質問までにしてください\n"
-        "「感情」の値を基に、値が低ければ辛い出来事、値が高ければ嬉しい出来事として質問してください。\n"
-        "あなたの名前はハッピーちゃんです。幸せを運ぶ青い鳥がモチーフの妖精です。「っピィ」が語尾です。\n"
-        "敬語は使わず、口調はユーザーと同じくらいの口調でください。「っピィ？」と質問してください。"
+    return (
+        f"{CHAT_PERSONA_PROMPT}"
+        "【イベント情報】\n"
         f"- 日付: {event.date}\n"
         f"- イベント名: {event.item}\n"
         f"- 金額: {event.amount} 円\n"
         f"- 感情: {mood_label}\n"
         f"- ユーザー自身が感じた価値: {event.happy_amount} 円\n"
     )
-    formatted_messages = _format_messages(system_prompt, messages)
+
+
+def _chat_context(system_prompt: str, messages: List[ChatMessage]) -> List[dict]:
+    """LLM に渡すメッセージ列。システムプロンプトと合わせて CHAT_CONTEXT_MAX_TOKENS に収まるよう古い履歴を削る。"""
+    budget = CHAT_CONTEXT_MAX_TOKENS - count_message_tokens(system_prompt, MODEL)
+    budget -= count_message_tokens(CHAT_HISTORY_OMITTED_NOTE, MODEL)
+    drop = leading_items_to_drop(
+        [m.content for m in messages], budget, MODEL, CHAT_HISTORY_TRIM_STEP
+    )
+    formatted = _format_messages(system_prompt, messages[drop:])
+    if drop:
+        formatted.insert(1, {"role": "system", "content": CHAT_HISTORY_OMITTED_NOTE})
+    return formatted
+
+
+async def stream_chat(
+    tx_id: str, messages: List[ChatMessage], user_id: str, new_message: Optional[str] = None
+) -> AsyncGenerator[str, None]:
+    """new_message を渡したときは、履歴をクライアントから受け取らず保存済みの会話から組み立てる。"""
+    # ファイル読み込み・書き込みはスレッドへ逃がし、トークン待ちの間も他のリクエストを処理できるようにする
+    event = await asyncio.to_thread(get_transaction, tx_id)
+    system_prompt = _chat_system_prompt(event)
+    if new_message is not None:
+        conversation = await asyncio.to_thread(_load_conversation, tx_id, user_id)
+        messages = [*conversation.messages, ChatMessage(role="user", content=new_message)]
+        # クライアントは送った発言をすぐ表示するので、応答が途中で切断・失敗しても
+        # 次のターンの履歴が画面と食い違わないよう、ストリームの前に保存しておく
+        await asyncio.to_thread(_save_chat_turn, tx_id, user_id, system_prompt, messages, None)
+    formatted_messages = _chat_context(system_prompt, messages)
     assistant_chunks: List[str] = []
     try:
-        stream = _ensure_client().chat.completions.create(
+        stream = await _ensure_async_client().chat.completions.create(
             model=MODEL,
             messages=formatted_messages,
             stream=True,
         )
-        for chunk in stream:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
             delta = chunk.choices[0].delta.content
             if delta:
                 assistant_chunks.append(delta)
@@ -167,14 +342,10 @@ def stream_chat(tx_id: str, messages: List[ChatMessage], user_id: str) -> Genera
     except Exception as exc:  # pragma: no cover - OpenAIエラーは上位で処理
         raise HTTPException(status_code=500, detail=str(exc)) from exc
     assistant_content = "".join(assistant_chunks)
-    # 生成されたアシスタント発話も含めて保存する
-    final_messages = [*formatted_messages, {"role": "assistant", "content": assistant_content}]
+    # 生成されたアシスタント発話も含めて、このターンで増えた分だけを保存する
     try:
-        append_chat_log(
-            tx_id=tx_id,
-            user_id=user_id,
-            messages_json=json.dumps(final_messages, ensure_ascii=False),
-            created_at=datetime.utcnow(),
+        await asyncio.to_thread(
+            _save_chat_turn, tx_id, user_id, system_prompt, messages, assistant_content
         )
     except Exception:
         _log_debug(
@@ -201,6 +372,35 @@ def generate_diary(tx_id: str, messages: List[ChatMessage], user_id: str) -> Gen
         "\n例: {\"diary_title\": \"日記タイトル\", \"diary_body\": \"日記本文\"}"
     )
     conversation_text = _build_conversation_history_text(event, messages)
+    cache_key = _generation_cache_key(system_prompt, conversation_text)
+    cached = read_diary_generation_cache(cache_key)
+    if cached is not None:
+        return GenerateDiaryResponse.model_validate(cached)
+
+    def _generate() -> GenerateDiaryResponse:
+        # 直前に別のリクエストが同じ入力で生成し終えていれば、それを使う
+        cached = read_diary_generation_cache(cache_key)
+        if cached is not None:
+            return GenerateDiaryResponse.model_validate(cached)
+        result = _request_diary(tx_id, system_prompt, conversation_text)
+        # 解析に失敗したときは例外になり、キャッシュしない
+        write_diary_generation_cache(cache_key, result.model_dump())
+        return result
+
+    return _generation_flight.do(cache_key, _generate)
+
+
+def _generation_cache_key(system_prompt: str, conversation_text: str) -> str:
+    """モデル・システムプロンプト・会話テキストが同じなら同じ値になるキャッシュキー。"""
+    raw = json.dumps(
+        {"model": MODEL, "system": system_prompt, "conversation": conversation_text},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _request_diary(tx_id: str, system_prompt: str, conversation_text: str) -> GenerateDiaryResponse:
     user_generation_prompt = f"{conversation_text}"
     generation_messages = [ChatMessage(role="user", content=user_generation_prompt)]
     formatted_messages = _format_messages(system_prompt, generation_messages)
@@ -294,10 +494,6 @@ def save_diary(tx_id: str, diary_title: str, diary_body: str, user_id: str) -> d
             tx_datetime = datetime.combine(tx_date, datetime.min.time())
         except Exception:
             tx_datetime = None
-    df = read_diary()
-    # 同一ユーザー・同一トランザクションの既存日記は上書き
-    if not df.empty and "tx_id" in df.columns:
-        df = df[~((df["tx_id"] == tx_id) & (df["user_id"] == user_id))]
     new_row = {
         "id": str(uuid4()),
         "tx_id": tx_id,
@@ -308,29 +504,12 @@ def save_diary(tx_id: str, diary_title: str, diary_body: str, user_id: str) -> d
         "created_at": now,
         "user_id": user_id,
     }
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    write_diary(df)
+    # 同一ユーザー・同一トランザクションの既存日記は上書き
+    versions = versioned_write("diary", user_id, lambda: upsert_diary_row(new_row))
+    publish(ChangeEvent(DIARY_SAVED, user_id, tx_id, row=new_row, versions=versions))
     return new_row
 
 
-def _row_to_entry(row) -> DiaryEntry:
-    def _to_dt(val: Optional[pd.Timestamp]) -> Optional[datetime]:
-        if pd.isna(val):
-            return None
-        return pd.to_datetime(val).to_pydatetime()
-
-    return DiaryEntry(
-        id=row["id"],
-        tx_id=row.get("tx_id", "") or "",
-        event_name=row["event_name"],
-        diary_title=row["diary_title"],
-        diary_body=row["diary_body"],
-        transaction_date=_to_dt(row.get("transaction_date")),
-        created_at=_to_dt(row.get("created_at")),
-        user_id=row["user_id"],
-    )
-
-
 def list_diaries(
     user_id: str,
     year: Optional[int] = None,
@@ -339,11 +518,18 @@ def list_diaries(
     price_min: Optional[float] = None,
     price_max: Optional[float] = None,
     sentiment: Optional[int] = None,
-) -> List[DiaryEntry]:
-    df = read_diary()
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """DiaryEntry と同じ形の dict を新しい順で返す（列単位で変換する）。
+
+    limit / cursor / fields の扱いは list_transactions と同じ。
+    """
+    out_columns = parse_fields(fields, list(DiaryEntry.model_fields))
+    df = read_diary(user_id)
     if df.empty:
-        return []
-    df = df[df["user_id"] == user_id].copy()
+        return [], None
     if tx_id:
         df = df[df["tx_id"] == tx_id]
 
@@ -356,9 +542,8 @@ def list_diaries(
         df = df[df["effective_date"].dt.month == int(month)]
 
     # 取引情報を付与して金額・感情スコアでフィルタリング
-    tx_df = read_transactions()
+    tx_df = read_transactions(user_id, columns=["id", "amount", "mood_score"])
     if not tx_df.empty:
-        tx_df = tx_df[tx_df["user_id"] == user_id][["id", "amount", "mood_score"]]
         df = df.merge(tx_df, left_on="tx_id", right_on="id", how="left", suffixes=("", "_tx"))
     else:
         df["amount"] = None
@@ -375,7 +560,15 @@ def list_diaries(
         df = df[df["mood_value"].notna() & (df["mood_value"] == int(sentiment))]
 
     if df.empty:
-        return []
+        return [], None
 
-    df = df.sort_values(by=["effective_date", "created_at"], ascending=False)
-    return [_row_to_entry(row) for _, row in df.iterrows()]
+    page, next_cursor = keyset_page(
+        df, ["effective_date", "created_at", "id"], limit, cursor, ascending=False
+    )
+    records = frame_to_records(
+        page,
+        out_columns,
+        datetime_columns=["transaction_date", "created_at"],
+        text_columns=["tx_id"],
+    )
+    return records, next_cursor
@@ -1,23 +1,78 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
-from datetime import date, datetime, timedelta
-from typing import List, Optional
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
 
-import pandas as pd
+import numpy as np
 from openai import OpenAI
 
-from app.repositories.csv_store import read_diary, read_transactions
-from app.repositories.summary_cache import read_summary_cache, write_summary_cache
+from app.core.config import (
+    SUMMARY_ACTIVE_HOURS,
+    SUMMARY_REFRESH_CONCURRENCY,
+    SUMMARY_REFRESH_INTERVAL_SECONDS,
+    SUMMARY_REFRESH_RATE_PER_MINUTE,
+)
+from app.repositories.summary_cache import (
+    read_latest_summary,
+    read_summary_cache,
+    write_summary_cache,
+)
 from app.schemas.retrospective import (
     DailyMood,
+    DailyMoodGrid,
     EmotionBucket,
     RetrospectiveDiary,
     RetrospectiveEvent,
     RetrospectiveSummary,
 )
-SUMMARY_CACHE_TTL_HOURS = int(os.getenv("SUMMARY_CACHE_TTL_HOURS", "24"))
+from app.services.retrospective_aggregates import (
+    MOOD_VALUES,
+    DayFact,
+    UserAggregate,
+    get_user_aggregate,
+)
+from app.utils.events import ChangeEvent, subscribe
+from app.utils.refresh_worker import RateLimiter, RefreshWorker
+from app.utils.single_flight import SingleFlight
+
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+_client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL) if OPENAI_API_KEY else None
+
+
+# 同じ (user_id, months) のまとめ生成が同時に来たら、LLM 呼び出しは1回にまとめる
+_summary_flight: SingleFlight[Optional[str]] = SingleFlight()
+
+# 最近ふりかえりを開いた (user_id, months) と、その時刻（time.monotonic()）
+_active: Dict[Tuple[str, int], float] = {}
+_active_lock = threading.Lock()
+
+
+def _touch_active(user_id: str, months: int) -> None:
+    with _active_lock:
+        _active[(user_id, months)] = time.monotonic()
+
+
+def _active_keys(user_id: Optional[str] = None) -> List[Tuple[str, int]]:
+    """SUMMARY_ACTIVE_HOURS 以内に開かれた (user_id, months)。古いものはここで捨てる。"""
+    cutoff = time.monotonic() - SUMMARY_ACTIVE_HOURS * 3600
+    with _active_lock:
+        for key in [key for key, seen in _active.items() if seen < cutoff]:
+            del _active[key]
+        return [key for key in _active if user_id is None or key[0] == user_id]
+
+
+@subscribe
+def _on_change(event: ChangeEvent) -> None:
+    # 取引・日記が変わったユーザーの分だけ、開いていた期間のまとめ文を作り直す（他のユーザーは触らない）
+    for key in _active_keys(event.user_id):
+        summary_refresher.submit(key)
 
 
 def _ensure_client() -> OpenAI:
@@ -26,20 +81,6 @@ def _ensure_client() -> OpenAI:
     return _client
 
 
-
-def _safe_date(val: object) -> Optional[date]:
-    try:
-        ts = pd.to_datetime(val)
-    except Exception:
-        return None
-    if pd.isna(ts):
-        return None
-    try:
-        return ts.date()
-    except Exception:
-        return None
-
-
 def _default_summary() -> RetrospectiveSummary:
     return RetrospectiveSummary(
         happy_money_top3_diaries=[],
@@ -56,58 +97,6 @@ def _default_summary() -> RetrospectiveSummary:
     )
 
 
-def _filter_last_year(df: pd.DataFrame, date_col: str, start_date: date) -> pd.DataFrame:
-    if df.empty:
-        return df
-    df = df.copy()
-    df["__effective_date"] = df[date_col].apply(_safe_date)
-    df = df[df["__effective_date"].notna()]
-    df = df[df["__effective_date"] >= start_date]
-    return df
-
-
-def _pick_diary_rows(df: pd.DataFrame) -> List[RetrospectiveDiary]:
-    diaries: List[RetrospectiveDiary] = []
-    for _, row in df.iterrows():
-        # マージ後は diary.id が id_diary になり、取引側の id は id_tx になるため安全に取得する
-        diary_id_raw = row.get("id_diary")
-        if diary_id_raw is None:
-            diary_id_raw = row.get("id")
-        if diary_id_raw is None:
-            diary_id_raw = row.get("tx_id")
-
-        event_id_raw = row.get("tx_id")
-        if event_id_raw is None:
-            event_id_raw = row.get("id_tx")
-        if event_id_raw is None:
-            event_id_raw = row.get("id")
-
-        if diary_id_raw is None or event_id_raw is None:
-            continue
-
-        diary_id = str(diary_id_raw)
-        event_id = str(event_id_raw)
-        title = row.get("diary_title") or ""
-        content = row.get("diary_body") or ""
-        amount = float(row.get("happy_amount_tx", row.get("happy_amount", 0)) or 0)
-        sentiment = int(row.get("mood_score_tx", row.get("mood_score", 0)) or 0)
-        event_date = _safe_date(row.get("__effective_date"))
-        if event_date is None:
-            continue
-        diaries.append(
-            RetrospectiveDiary(
-                diary_id=diary_id,
-                event_id=event_id,
-                title=title,
-                date=event_date,
-                amount=amount,
-                sentiment=sentiment,
-                content=content,
-            )
-        )
-    return diaries
-
-
 def _fallback_summary_text(
     diaries_top: List[RetrospectiveDiary],
     diaries_worst: List[RetrospectiveDiary],
@@ -128,42 +117,43 @@ def _fallback_summary_text(
     )
 
 
-def _build_daily_moods(tx_df: pd.DataFrame, start_date: date) -> List[DailyMood]:
+def _daily_mood_grid(
+    window_days: List[Tuple[date, DayFact]], start_date: date
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """start_date〜今日の日付・気分（平均を -2〜2 に丸めた値）・件数を、1日1要素の配列で返す。
+
+    記録のある日だけを日数オフセットの位置に書き込み、それ以外は 0 のままにする。
+    """
+    today = date.today()
+    days = (today - start_date).days + 1
+    dates = np.datetime64(start_date, "D") + np.arange(days)
+    recorded = [(d, day) for d, day in window_days if d <= today]
+    offsets = np.array([(d - start_date).days for d, _ in recorded], dtype=np.int64)
+    counts = np.zeros(days, dtype=np.int64)
+    sums = np.zeros(days, dtype=np.int64)
+    counts[offsets] = [day.count for _, day in recorded]
+    sums[offsets] = [day.mood_sum for _, day in recorded]
+    mood = np.zeros(days, dtype=np.int8)
+    mood[offsets] = np.round(np.clip(sums[offsets] / counts[offsets], -2, 2))
+    return dates, mood, counts
+
+
+def _build_daily_moods(dates: np.ndarray, mood: np.ndarray, counts: np.ndarray) -> List[DailyMood]:
     """過去1年分の日単位ムードをGitHub草形式で使いやすい配列に整形"""
-    if tx_df.empty:
-        return []
+    return [
+        DailyMood(date=d, mood_score=m, count=c)
+        for d, m, c in zip(dates.tolist(), mood.tolist(), counts.tolist())
+    ]
 
-    # Pythonのdate型に揃えたキーで平均値と件数を持つ辞書を構築
-    mean_by_date: dict[date, int] = {}
-    count_by_date: dict[date, int] = {}
 
-    mood_means = (
-        tx_df.groupby("__date_only")["mood_score"]
-        .mean()
-        .apply(lambda v: int(round(max(min(v, 2), -2))))
+def _encode_daily_moods(start_date: date, mood: np.ndarray, counts: np.ndarray) -> DailyMoodGrid:
+    # 気分は int8、件数は uint16（上限で頭打ち）のリトルエンディアン列を base64 にする
+    return DailyMoodGrid(
+        start=start_date,
+        days=len(mood),
+        mood_scores=base64.b64encode(mood.astype("<i1").tobytes()).decode("ascii"),
+        counts=base64.b64encode(np.minimum(counts, 0xFFFF).astype("<u2").tobytes()).decode("ascii"),
     )
-    for idx, val in mood_means.items():
-        key = idx.date() if hasattr(idx, "date") else idx
-        mean_by_date[key] = int(val)
-
-    mood_counts = tx_df["__date_only"].value_counts()
-    for idx, val in mood_counts.items():
-        key = idx.date() if hasattr(idx, "date") else idx
-        count_by_date[key] = int(val)
-
-    today = date.today()
-    daily: List[DailyMood] = []
-    current = start_date
-    while current <= today:
-        daily.append(
-            DailyMood(
-                date=current,
-                mood_score=mean_by_date.get(current, 0),
-                count=count_by_date.get(current, 0),
-            )
-        )
-        current += timedelta(days=1)
-    return daily
 
 
 def _format_diary_lines(diaries: List[RetrospectiveDiary], label: str) -> str:
@@ -177,18 +167,10 @@ def _format_diary_lines(diaries: List[RetrospectiveDiary], label: str) -> str:
     return "\n".join(lines)
 
 
-def _generate_summary_with_openai(
-    diaries_top: List[RetrospectiveDiary],
-    diaries_worst: List[RetrospectiveDiary],
-    diary_top_insufficient: bool,
-    diary_worst_insufficient: bool,
-) -> str:
-    if not diaries_top and not diaries_worst:
-        return _fallback_summary_text(
-            diaries_top, diaries_worst, diary_top_insufficient, diary_worst_insufficient
-        )
-
-    messages = [
+def _summary_messages(
+    diaries_top: List[RetrospectiveDiary], diaries_worst: List[RetrospectiveDiary]
+) -> List[dict]:
+    return [
         {
             "role": "system",
             "content": (
@@ -209,6 +191,15 @@ def _generate_summary_with_openai(
         },
     ]
 
+
+def _summary_content_hash(messages: List[dict]) -> str:
+    """モデルとプロンプト（TOP / WORST の日記内容）が同じなら同じ値になるキャッシュキー。"""
+    raw = json.dumps({"model": MODEL, "messages": messages}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _request_summary(messages: List[dict]) -> Optional[str]:
+    """LLM でまとめ文を作る。失敗・空応答なら None。"""
     try:
         client = _ensure_client()
         res = client.chat.completions.create(
@@ -217,91 +208,165 @@ def _generate_summary_with_openai(
             temperature=0.7,
             max_tokens=300,
         )
-        content = res.choices[0].message.content or ""
-        return content.strip()
+        content = (res.choices[0].message.content or "").strip()
+        return content or None
     except Exception:
+        return None
+
+
+def _generate_summary_text(
+    user_id: str,
+    months: int,
+    diaries_top: List[RetrospectiveDiary],
+    diaries_worst: List[RetrospectiveDiary],
+    diary_top_insufficient: bool,
+    diary_worst_insufficient: bool,
+) -> str:
+    if not diaries_top and not diaries_worst:
         return _fallback_summary_text(
             diaries_top, diaries_worst, diary_top_insufficient, diary_worst_insufficient
         )
 
+    messages = _summary_messages(diaries_top, diaries_worst)
+    content_hash = _summary_content_hash(messages)
+    cached = read_summary_cache(user_id, months, content_hash)
+    if cached is not None:
+        return cached
+
+    if summary_refresher.submit((user_id, months)):
+        # 生成はバックグラウンドに任せ、前回のまとめ文（なければ定型文）をすぐ返す
+        stale = read_latest_summary(user_id, months)
+        if stale is not None:
+            return stale
+        return _fallback_summary_text(
+            diaries_top, diaries_worst, diary_top_insufficient, diary_worst_insufficient
+        )
 
-def summarize_retrospective(user_id: str, months: int = 12) -> RetrospectiveSummary:
+    # ワーカーが動いていない（lifespan の外から呼ばれた）ときは、その場で生成する
+    def _generate() -> Optional[str]:
+        # 直前に別のリクエストが同じ入力で生成し終えていれば、それを使う
+        cached = read_summary_cache(user_id, months, content_hash)
+        if cached is not None:
+            return cached
+        text = _request_summary(messages)
+        if text is not None:
+            # 失敗時の定型文はキャッシュしない（次のリクエストで再生成する）
+            write_summary_cache(user_id, months, content_hash, text)
+        return text
+
+    text = _summary_flight.do((user_id, months), _generate)
+    if text is None:
+        return _fallback_summary_text(
+            diaries_top, diaries_worst, diary_top_insufficient, diary_worst_insufficient
+        )
+    return text
+
+
+def _stale_summary_input(user_id: str, months: int) -> Optional[Tuple[List[dict], str]]:
+    """まとめ文の作り直しが必要なら (messages, content_hash) を返す。最新ならNone。"""
     start_date = date.today() - timedelta(days=months * 30)
+    diaries_top, diaries_worst = _pick_diaries(get_user_aggregate(user_id), start_date)
+    if not diaries_top and not diaries_worst:
+        return None
+    messages = _summary_messages(diaries_top, diaries_worst)
+    content_hash = _summary_content_hash(messages)
+    # 読めれば最終利用時刻も延びるので、開かれ続けているまとめ文は期限切れにならない
+    if read_summary_cache(user_id, months, content_hash) is not None:
+        return None
+    return messages, content_hash
+
+
+async def _refresh_summary(key: Tuple[str, int]) -> None:
+    user_id, months = key
+    stale = await asyncio.to_thread(_stale_summary_input, user_id, months)
+    if stale is None:
+        return
+    messages, content_hash = stale
+    await _summary_rate.acquire()
+    text = await asyncio.to_thread(_request_summary, messages)
+    if text is not None:
+        await asyncio.to_thread(write_summary_cache, user_id, months, content_hash, text)
+
+
+# まとめ文をバックグラウンドで作り直すワーカー（app.main の lifespan で起動する）
+_summary_rate = RateLimiter(SUMMARY_REFRESH_RATE_PER_MINUTE)
+summary_refresher: RefreshWorker[Tuple[str, int]] = RefreshWorker(
+    _refresh_summary,
+    concurrency=SUMMARY_REFRESH_CONCURRENCY,
+    interval=SUMMARY_REFRESH_INTERVAL_SECONDS,
+    sweep=_active_keys,
+)
 
-    tx_df = read_transactions()
-    if tx_df.empty:
-        return _default_summary()
-    tx_df = tx_df[tx_df["user_id"] == user_id].copy()
-    tx_df["__date_only"] = tx_df["date"].dt.date
-    tx_df = _filter_last_year(tx_df, "__date_only", start_date)
-    if tx_df.empty:
-        return _default_summary()
 
-    diary_df = read_diary()
-    diary_df = diary_df[diary_df["user_id"] == user_id].copy()
-    if not diary_df.empty:
-        diary_df = diary_df.merge(
-            tx_df,
-            left_on="tx_id",
-            right_on="id",
-            how="inner",
-            suffixes=("_diary", "_tx"),
-        )
-        diary_df["__effective_date"] = diary_df["transaction_date"].fillna(
-            diary_df["date"]
-        )
-        diary_df = _filter_last_year(diary_df, "__effective_date", start_date)
-    else:
-        diary_df = pd.DataFrame()
-
-    diaries_sorted = _pick_diary_rows(diary_df)
-    diaries_positive = [d for d in diaries_sorted if d.sentiment > 0]
-    diaries_negative = [d for d in diaries_sorted if d.sentiment < 0]
-    diary_top_insufficient = len(diaries_positive) == 0
-    diary_worst_insufficient = len(diaries_negative) == 0
-    diaries_top3 = sorted(diaries_positive, key=lambda d: d.amount, reverse=True)[:3]
-    diaries_worst3 = sorted(diaries_negative, key=lambda d: d.amount)[:3]
-
-    # Map event_id -> diary_id for quick lookup
-    diary_by_event = {}
-    for diary in diaries_sorted:
-        diary_by_event.setdefault(diary.event_id, diary.diary_id)
-
-    def to_event_row(row) -> RetrospectiveEvent:
-        event_id = str(row["id"])
-        title = row.get("item") or ""
-        amount = float(row.get("happy_amount", 0) or 0)
-        sentiment = int(row.get("mood_score", 0) or 0)
-        event_date = _safe_date(row.get("__date_only")) or date.today()
-        diary_id = diary_by_event.get(event_id)
-        return RetrospectiveEvent(
-            event_id=event_id,
-            title=title,
-            date=event_date,
-            amount=amount,
-            sentiment=sentiment,
-            has_diary=diary_id is not None,
-            diary_id=diary_id,
-        )
+def _diary_item(agg: UserAggregate, tx_id: str) -> RetrospectiveDiary:
+    tx = agg.txs[tx_id]
+    diary = agg.diaries[tx_id]
+    return RetrospectiveDiary(
+        diary_id=diary.diary_id,
+        event_id=tx_id,
+        title=diary.title,
+        date=diary.date,
+        amount=tx.amount,
+        sentiment=tx.sentiment,
+        content=diary.content,
+    )
+
+
+def _event_item(agg: UserAggregate, tx_id: str, start_date: date) -> RetrospectiveEvent:
+    tx = agg.txs[tx_id]
+    has_diary = agg.has_diary_since(tx_id, start_date)
+    return RetrospectiveEvent(
+        event_id=tx_id,
+        title=tx.title,
+        date=tx.date,
+        amount=tx.amount,
+        sentiment=tx.sentiment,
+        has_diary=has_diary,
+        diary_id=agg.diaries[tx_id].diary_id if has_diary else None,
+    )
 
-    tx_positive = tx_df[tx_df["mood_score"] > 0]
-    tx_negative = tx_df[tx_df["mood_score"] < 0]
 
-    event_top_insufficient = tx_positive.empty
-    event_worst_insufficient = tx_negative.empty
+def _pick_diaries(
+    agg: UserAggregate, start_date: date
+) -> Tuple[List[RetrospectiveDiary], List[RetrospectiveDiary]]:
+    top = agg.pick(start_date, positive=True, diary=True)
+    worst = agg.pick(start_date, positive=False, diary=True)
+    return [_diary_item(agg, tx_id) for tx_id in top], [_diary_item(agg, tx_id) for tx_id in worst]
+
+
+def summarize_retrospective(
+    user_id: str, months: int = 12, daily_format: str = "full"
+) -> RetrospectiveSummary:
+    _touch_active(user_id, months)
+    return summarize_aggregate(user_id, months, get_user_aggregate(user_id), daily_format)
+
+
+def summarize_aggregate(
+    user_id: str, months: int, agg: UserAggregate, daily_format: str = "full"
+) -> RetrospectiveSummary:
+    """集計済みの状態から、直近 months か月分を切り出してふりかえりを作る。
+
+    daily_format="compact" のときは日ごとの気分を daily_moods ではなく daily_mood_grid（base64 の配列）で返す。
+    """
+    start_date = date.today() - timedelta(days=months * 30)
+    window_days = [(d, day) for d, day in agg.days.items() if d >= start_date and day.count]
+    if not window_days:
+        return _default_summary()
+
+    diaries_top3, diaries_worst3 = _pick_diaries(agg, start_date)
+    diary_top_insufficient = len(diaries_top3) == 0
+    diary_worst_insufficient = len(diaries_worst3) == 0
 
     events_top3 = [
-        to_event_row(row)
-        for _, row in tx_positive.sort_values(by="happy_amount", ascending=False)
-        .head(3)
-        .iterrows()
+        _event_item(agg, tx_id, start_date)
+        for tx_id in agg.pick(start_date, positive=True, diary=False)
     ]
     events_worst3 = [
-        to_event_row(row)
-        for _, row in tx_negative.sort_values(by="happy_amount", ascending=True)
-        .head(3)
-        .iterrows()
+        _event_item(agg, tx_id, start_date)
+        for tx_id in agg.pick(start_date, positive=False, diary=False)
     ]
+    event_top_insufficient = len(events_top3) == 0
+    event_worst_insufficient = len(events_worst3) == 0
 
     # Emotion buckets (5段階)
     mood_labels = {
@@ -311,43 +376,37 @@ def summarize_retrospective(user_id: str, months: int = 12) -> RetrospectiveSumm
         -1: ("やや悪", "やや悪"),
         -2: ("最悪", "最悪"),
     }
-
-    if tx_df.empty:
-        buckets: List[EmotionBucket] = []
-    else:
-        mood_values = tx_df["mood_score"].dropna().apply(
-            lambda x: max(min(int(x), 2), -2)
-        )
-        counts = mood_values.value_counts().to_dict()
-        buckets = []
-        for val in [2, 1, 0, -1, -2]:
-            count = counts.get(val, 0)
-            if count <= 0:
-                continue
-            label, short_label = mood_labels.get(val, (f"スコア{val}", f"スコア{val}"))
-            buckets.append(
-                EmotionBucket(
-                    value=val,
-                    label=label,
-                    short_label=short_label,
-                    count=int(count),
-                )
+    counts = [sum(day.buckets[i] for _, day in window_days) for i in range(len(MOOD_VALUES))]
+    buckets: List[EmotionBucket] = []
+    for val, count in zip(MOOD_VALUES, counts):
+        if count <= 0:
+            continue
+        label, short_label = mood_labels.get(val, (f"スコア{val}", f"スコア{val}"))
+        buckets.append(
+            EmotionBucket(
+                value=val,
+                label=label,
+                short_label=short_label,
+                count=int(count),
             )
-
-    cache_ttl = timedelta(hours=SUMMARY_CACHE_TTL_HOURS)
-    cached_summary = read_summary_cache(user_id, months, cache_ttl)
-    if cached_summary:
-        summary_text = cached_summary
-    else:
-        summary_text = _generate_summary_with_openai(
-            diaries_top3,
-            diaries_worst3,
-            diary_top_insufficient,
-            diary_worst_insufficient,
         )
-        write_summary_cache(user_id, months, summary_text)
 
-    daily_moods = _build_daily_moods(tx_df, start_date)
+    summary_text = _generate_summary_text(
+        user_id,
+        months,
+        diaries_top3,
+        diaries_worst3,
+        diary_top_insufficient,
+        diary_worst_insufficient,
+    )
+
+    dates, mood, day_counts = _daily_mood_grid(window_days, start_date)
+    if daily_format == "compact":
+        daily_moods: List[DailyMood] = []
+        daily_mood_grid: Optional[DailyMoodGrid] = _encode_daily_moods(start_date, mood, day_counts)
+    else:
+        daily_moods = _build_daily_moods(dates, mood, day_counts)
+        daily_mood_grid = None
 
     return RetrospectiveSummary(
         happy_money_top3_diaries=diaries_top3,
@@ -356,10 +415,10 @@ def summarize_retrospective(user_id: str, months: int = 12) -> RetrospectiveSumm
         yearly_happy_money_worst3=events_worst3,
         emotion_buckets=buckets,
         daily_moods=daily_moods,
+        daily_mood_grid=daily_mood_grid,
         summary_text=summary_text,
         diary_top_insufficient=diary_top_insufficient,
         diary_worst_insufficient=diary_worst_insufficient,
         event_top_insufficient=event_top_insufficient,
         event_worst_insufficient=event_worst_insufficient,
     )
-
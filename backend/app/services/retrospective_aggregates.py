@@ -0,0 +1,506 @@
+"""ふりかえり用のユーザー別集計（メモリ上に保持し、書き込みイベントで更新する）。
+
+ユーザーごとに次を持つ。
+- 日ごとの気分スコア合計・件数・5段階の件数
+- 日ごとに、気分がプラス / マイナスの取引の happy_amount 上位 TOP_K 件（日記付きのものは別にも持つ）
+
+取引の作成・更新・削除と日記の保存は差分で反映する（更新・削除は古い値を引いてから新しい値を足す）。
+差分は集計の複製に反映してから差し替える。取引・日記は区画ごとに複製するマップ、日ごとの集計は
+書き換えない DayFact で持つので、複製で写すのは触った区画と日だけになり、読み手が受け取った集計が
+後から書き換わることもない。ふりかえりは期間内の日の上位 TOP_K 件を合わせて選ぶ
+（CSV の読み直し・並べ替えはしない）。
+
+別ワーカーの書き込みはイベントで届かないため、作成時のテーブルの版を持っておき、
+読むときに版が変わっていれば作り直す。差分を反映したときは、版の変化がその書き込みだけによる
+（イベントの書き込み前の版が集計の版と同じ）場合に限って版を進め、そうでなければ捨てて作り直す。
+"""
+
+import heapq
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import date
+from itertools import chain
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from app.core.config import RETROSPECTIVE_AGGREGATE_MAX_USERS
+from app.repositories.storage import read_diary, read_transactions, table_version
+from app.utils.events import (
+    DIARY_SAVED,
+    TRANSACTION_CREATED,
+    TRANSACTION_DELETED,
+    TRANSACTION_UPDATED,
+    ChangeEvent,
+    subscribe,
+)
+from app.utils.sharded_map import ShardedMap
+from app.utils.single_flight import SingleFlight
+
+MOOD_VALUES = [2, 1, 0, -1, -2]
+
+# 日ごとに持つ上位件数（ふりかえりで使うのは上位3件）
+TOP_K = 3
+
+# 並び順のキー（小さいほど上位）
+RankKey = Tuple[float, str]
+Ranked = Tuple[RankKey, ...]
+
+
+@dataclass(slots=True)
+class TxFact:
+    date: date
+    title: str
+    amount: float
+    sentiment: int
+
+
+@dataclass(slots=True)
+class DiaryFact:
+    diary_id: str
+    title: str
+    content: str
+    # 取引日（日記側の transaction_date、なければ取引の日付）
+    date: date
+    # 取引日が日記側になく、取引の日付を使っている（取引の日付が変わったら追従する）
+    from_tx: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class DayFact:
+    """1日分の集計。書き換えずに replace() で新しいものを作る（複製元と共有しているため）。"""
+
+    mood_sum: int = 0
+    count: int = 0
+    # MOOD_VALUES の順の件数（-2〜2 に丸めた値で数える）
+    buckets: Tuple[int, ...] = (0,) * len(MOOD_VALUES)
+    tx_ids: FrozenSet[str] = frozenset()
+    # この日の取引の上位 TOP_K 件（プラス / マイナス）
+    top: Ranked = ()
+    worst: Ranked = ()
+    # 日記付きの取引は「取引日と日記の取引日の早い方」の日に数える（どちらも期間内のときだけ選ぶため）
+    diary_ids: FrozenSet[str] = frozenset()
+    top_diaries: Ranked = ()
+    worst_diaries: Ranked = ()
+
+    @property
+    def empty(self) -> bool:
+        return not self.tx_ids and not self.diary_ids
+
+
+def _rank_key(tx_id: str, tx: TxFact) -> RankKey:
+    # プラスは金額の大きい順、マイナスは小さい順
+    if tx.sentiment > 0:
+        return (-tx.amount, tx_id)
+    return (tx.amount, tx_id)
+
+
+def _offer(ranked: Ranked, key: RankKey) -> Ranked:
+    """上位 TOP_K 件に key を加える（入らなければそのまま）。"""
+    if len(ranked) >= TOP_K and key >= ranked[-1]:
+        return ranked
+    return tuple(sorted(ranked + (key,))[:TOP_K])
+
+
+class UserAggregate:
+    def __init__(self, stamp: Tuple[str, str]) -> None:
+        self.stamp = stamp
+        self.txs: ShardedMap[str, TxFact] = ShardedMap()
+        self.diaries: ShardedMap[str, DiaryFact] = ShardedMap()
+        self.days: Dict[date, DayFact] = {}
+
+    def copy(self, stamp: Tuple[str, str]) -> "UserAggregate":
+        """差分を反映するための複製（日の辞書だけを写す。取引・日記のマップと DayFact は共有する）。"""
+        clone = UserAggregate(stamp)
+        clone.txs = self.txs
+        clone.diaries = self.diaries
+        clone.days = dict(self.days)
+        return clone
+
+    def _set_day(self, day_date: date, day: DayFact) -> None:
+        if day.empty:
+            self.days.pop(day_date, None)
+        else:
+            self.days[day_date] = day
+
+    def _top_of(self, tx_ids: Iterable[str], positive: bool) -> Ranked:
+        """tx_ids から上位 TOP_K 件を選び直す（上位の1件が抜けたとき用。その日の件数分だけ見る）。"""
+        keys = []
+        for tx_id in tx_ids:
+            tx = self.txs[tx_id]
+            if (tx.sentiment > 0) if positive else (tx.sentiment < 0):
+                keys.append(_rank_key(tx_id, tx))
+        return tuple(heapq.nsmallest(TOP_K, keys))
+
+    def _rank_diary(self, tx_id: str, tx: TxFact, diary: DiaryFact) -> None:
+        day_date = min(tx.date, diary.date)
+        day = self.days.get(day_date) or DayFact()
+        key = _rank_key(tx_id, tx)
+        day = replace(day, diary_ids=day.diary_ids | {tx_id})
+        if tx.sentiment > 0:
+            day = replace(day, top_diaries=_offer(day.top_diaries, key))
+        elif tx.sentiment < 0:
+            day = replace(day, worst_diaries=_offer(day.worst_diaries, key))
+        self._set_day(day_date, day)
+
+    def _unrank_diary(self, tx_id: str, tx: TxFact, diary: DiaryFact) -> None:
+        day_date = min(tx.date, diary.date)
+        day = self.days[day_date]
+        key = _rank_key(tx_id, tx)
+        diary_ids = day.diary_ids - {tx_id}
+        day = replace(day, diary_ids=diary_ids)
+        if key in day.top_diaries:
+            day = replace(day, top_diaries=self._top_of(diary_ids, positive=True))
+        if key in day.worst_diaries:
+            day = replace(day, worst_diaries=self._top_of(diary_ids, positive=False))
+        self._set_day(day_date, day)
+
+    def add_transaction(self, tx_id: str, tx: TxFact) -> None:
+        if tx_id in self.txs:
+            return
+        self.txs = self.txs.set(tx_id, tx)
+        day = self.days.get(tx.date) or DayFact()
+        buckets = list(day.buckets)
+        buckets[MOOD_VALUES.index(max(min(tx.sentiment, 2), -2))] += 1
+        day = replace(
+            day,
+            mood_sum=day.mood_sum + tx.sentiment,
+            count=day.count + 1,
+            buckets=tuple(buckets),
+            tx_ids=day.tx_ids | {tx_id},
+        )
+        key = _rank_key(tx_id, tx)
+        if tx.sentiment > 0:
+            day = replace(day, top=_offer(day.top, key))
+        elif tx.sentiment < 0:
+            day = replace(day, worst=_offer(day.worst, key))
+        self._set_day(tx.date, day)
+
+        diary = self.diaries.get(tx_id)
+        if diary is not None:
+            if diary.from_tx and diary.date != tx.date:
+                diary = replace(diary, date=tx.date)
+                self.diaries = self.diaries.set(tx_id, diary)
+            self._rank_diary(tx_id, tx, diary)
+
+    def remove_transaction(self, tx_id: str) -> None:
+        """取引を集計から引く（日記は残し、同じ取引が足されたらまた並び順に載せる）。"""
+        tx = self.txs.get(tx_id)
+        if tx is None:
+            return
+        diary = self.diaries.get(tx_id)
+        if diary is not None:
+            self._unrank_diary(tx_id, tx, diary)
+        self.txs = self.txs.delete(tx_id)
+
+        day = self.days[tx.date]
+        buckets = list(day.buckets)
+        buckets[MOOD_VALUES.index(max(min(tx.sentiment, 2), -2))] -= 1
+        tx_ids = day.tx_ids - {tx_id}
+        day = replace(
+            day,
+            mood_sum=day.mood_sum - tx.sentiment,
+            count=day.count - 1,
+            buckets=tuple(buckets),
+            tx_ids=tx_ids,
+        )
+        key = _rank_key(tx_id, tx)
+        if key in day.top:
+            day = replace(day, top=self._top_of(tx_ids, positive=True))
+        if key in day.worst:
+            day = replace(day, worst=self._top_of(tx_ids, positive=False))
+        self._set_day(tx.date, day)
+
+    def update_transaction(self, tx_id: str, tx: TxFact) -> None:
+        """古い値を引いてから新しい値を足す（日付が変わっても、前の日から引かれる）。"""
+        self.remove_transaction(tx_id)
+        self.add_transaction(tx_id, tx)
+
+    def upsert_diary(self, tx_id: str, diary: DiaryFact) -> None:
+        tx = self.txs.get(tx_id)
+        previous = self.diaries.get(tx_id)
+        if tx is not None and previous is not None:
+            self._unrank_diary(tx_id, tx, previous)
+        # 並び順に載せる前に日記を入れておく（選んだ tx_id で日記を引くため）
+        self.diaries = self.diaries.set(tx_id, diary)
+        if tx is not None:
+            self._rank_diary(tx_id, tx, diary)
+
+    # --- 期間の切り出し ---
+
+    def pick(self, start_date: date, positive: bool, diary: bool, limit: int = TOP_K) -> List[str]:
+        """start_date 以降の日の上位 TOP_K 件を合わせ、上位 limit 件（TOP_K まで）を tx_id で返す。"""
+        window = [day for d, day in self.days.items() if d >= start_date]
+        if diary:
+            ranked = (day.top_diaries if positive else day.worst_diaries for day in window)
+        else:
+            ranked = (day.top if positive else day.worst for day in window)
+        return [tx_id for _, tx_id in heapq.nsmallest(min(limit, TOP_K), chain.from_iterable(ranked))]
+
+    def has_diary_since(self, tx_id: str, start_date: date) -> bool:
+        diary = self.diaries.get(tx_id)
+        return diary is not None and diary.date >= start_date
+
+
+def _to_date(value: object) -> Optional[date]:
+    ts = pd.to_datetime(value, errors="coerce")
+    if pd.isna(ts):
+        return None
+    return ts.date()
+
+
+def _tx_fact(row: dict) -> Optional[TxFact]:
+    tx_date = _to_date(row.get("date"))
+    if tx_date is None:
+        return None
+    return TxFact(
+        date=tx_date,
+        title=row.get("item") or "",
+        amount=float(row.get("happy_amount") or 0),
+        sentiment=int(row.get("mood_score") or 0),
+    )
+
+
+def _diary_fact(row: dict, tx: Optional[TxFact]) -> Optional[DiaryFact]:
+    diary_date = _to_date(row.get("transaction_date"))
+    from_tx = diary_date is None
+    if from_tx and tx is not None:
+        diary_date = tx.date
+    if diary_date is None:
+        return None
+    return DiaryFact(
+        diary_id=str(row["id"]),
+        title=row.get("diary_title") or "",
+        content=row.get("diary_body") or "",
+        date=diary_date,
+        from_tx=from_tx,
+    )
+
+
+def _stamp(user_id: str) -> Tuple[str, str]:
+    return (table_version("transactions", user_id), table_version("diary", user_id))
+
+
+def _frame_dates(values: pd.Series) -> pd.Series:
+    """列ごとに日付（date）へ変換する。変換できない値は NaT のまま。"""
+    return pd.to_datetime(values, errors="coerce").dt.normalize()
+
+
+def _ranked_by_day(frame: pd.DataFrame, day_column: str) -> Dict[date, Ranked]:
+    """並べ替え済みのフレームから、日ごとの上位 TOP_K 件を取り出す。"""
+    head = frame.groupby(day_column, sort=False).head(TOP_K)
+    ranked: Dict[date, List[RankKey]] = {}
+    for d, key, tx_id in zip(head[day_column].dt.date.tolist(), head["key"].tolist(), head["id"].tolist()):
+        ranked.setdefault(d, []).append((key, tx_id))
+    return {d: tuple(keys) for d, keys in ranked.items()}
+
+
+def _ids_by_day(frame: pd.DataFrame, day_column: str) -> Dict[date, FrozenSet[str]]:
+    ids: Dict[date, List[str]] = {}
+    for d, tx_id in zip(frame[day_column].dt.date.tolist(), frame["id"].tolist()):
+        ids.setdefault(d, []).append(tx_id)
+    return {d: frozenset(values) for d, values in ids.items()}
+
+
+def _sorted_by_rank(frame: pd.DataFrame, positive: bool) -> pd.DataFrame:
+    # プラスは金額の大きい順、マイナスは小さい順（同額は tx_id 順）
+    if positive:
+        picked = frame[frame["sentiment"] > 0].assign(key=lambda f: -f["amount"])
+    else:
+        picked = frame[frame["sentiment"] < 0].assign(key=lambda f: f["amount"])
+    return picked.sort_values(["key", "id"])
+
+
+def aggregate_from_frames(
+    stamp: Tuple[str, str], tx_df: pd.DataFrame, diary_df: pd.DataFrame
+) -> UserAggregate:
+    """取引・日記のフレームからユーザーの集計を作る（行ごとの処理はせず、列単位で計算する）。"""
+    agg = UserAggregate(stamp)
+    if tx_df.empty:
+        return agg
+
+    tx = pd.DataFrame(
+        {
+            "id": tx_df["id"].astype(str),
+            "day": _frame_dates(tx_df["date"]),
+            "title": tx_df["item"].fillna("").astype(str),
+            "amount": pd.to_numeric(tx_df["happy_amount"], errors="coerce").fillna(0.0).astype(float),
+            "sentiment": pd.to_numeric(tx_df["mood_score"], errors="coerce").fillna(0).astype(int),
+        }
+    )
+    tx = tx[tx["day"].notna()].drop_duplicates(subset="id", keep="first")
+    agg.txs = ShardedMap.from_items(
+        (tx_id, TxFact(d, title, amount, sentiment))
+        for tx_id, d, title, amount, sentiment in zip(
+            tx["id"].tolist(), tx["day"].dt.date.tolist(), tx["title"].tolist(),
+            tx["amount"].tolist(), tx["sentiment"].tolist(),
+        )
+    )
+
+    # 日ごとの合計・件数と、-2〜2 に丸めた5段階の件数
+    by_day = tx.assign(bucket=tx["sentiment"].clip(-2, 2)).groupby("day")
+    totals = by_day["sentiment"].agg(["sum", "count"])
+    bucket_counts = (
+        by_day["bucket"].value_counts().unstack(fill_value=0).reindex(columns=MOOD_VALUES, fill_value=0)
+    )
+    tx_ids = _ids_by_day(tx, "day")
+    top = _ranked_by_day(_sorted_by_rank(tx, positive=True), "day")
+    worst = _ranked_by_day(_sorted_by_rank(tx, positive=False), "day")
+    days = {
+        d: DayFact(
+            mood_sum, count, tuple(buckets), tx_ids[d], top.get(d, ()), worst.get(d, ())
+        )
+        for d, mood_sum, count, buckets in zip(
+            totals.index.date.tolist(), totals["sum"].tolist(), totals["count"].tolist(),
+            bucket_counts.loc[totals.index].to_numpy().tolist(),
+        )
+    }
+
+    # 日記: 同じ取引の日記は後の行が優先。取引日がなければ取引の日付を使う
+    if not diary_df.empty:
+        diaries = diary_df.assign(tx_id=diary_df["tx_id"].astype(str)).drop_duplicates(
+            subset="tx_id", keep="last"
+        )
+        tx_day = diaries["tx_id"].map(tx.set_index("id")["day"])
+        own_day = _frame_dates(diaries["transaction_date"])
+        diaries = diaries.assign(day=own_day.fillna(tx_day), from_tx=own_day.isna(), tx_day=tx_day)
+        diaries = diaries[diaries["day"].notna()]
+        agg.diaries = ShardedMap.from_items(
+            (tx_id, DiaryFact(str(diary_id), title, content, d, from_tx))
+            for tx_id, diary_id, title, content, d, from_tx in zip(
+                diaries["tx_id"].tolist(), diaries["id"].tolist(),
+                diaries["diary_title"].fillna("").astype(str).tolist(),
+                diaries["diary_body"].fillna("").astype(str).tolist(),
+                diaries["day"].dt.date.tolist(), diaries["from_tx"].tolist(),
+            )
+        )
+
+        # 取引のある日記を、取引日と日記の取引日の早い方の日に数える
+        ranked = diaries[diaries["tx_day"].notna()]
+        ranked = tx.merge(
+            pd.DataFrame(
+                {"id": ranked["tx_id"], "rank_day": ranked[["day", "tx_day"]].min(axis=1)}
+            ),
+            on="id",
+        )
+        diary_ids = _ids_by_day(ranked, "rank_day")
+        top_diaries = _ranked_by_day(_sorted_by_rank(ranked, positive=True), "rank_day")
+        worst_diaries = _ranked_by_day(_sorted_by_rank(ranked, positive=False), "rank_day")
+        for d, ids in diary_ids.items():
+            days[d] = replace(
+                days.get(d) or DayFact(),
+                diary_ids=ids,
+                top_diaries=top_diaries.get(d, ()),
+                worst_diaries=worst_diaries.get(d, ()),
+            )
+
+    agg.days = days
+    return agg
+
+
+def build_user_aggregate(user_id: str) -> UserAggregate:
+    # 版は読み込みより先に取る（読み込み中に書き込まれても、次に読むときに作り直される）
+    stamp = _stamp(user_id)
+    tx_df = read_transactions(user_id, ["id", "date", "item", "happy_amount", "mood_score"])
+    return aggregate_from_frames(stamp, tx_df, read_diary(user_id))
+
+
+# 差分で反映するイベントと、その書き込み先のテーブルが版（stamp）の何番目か
+_STAMP_INDEX = {
+    TRANSACTION_CREATED: 0,
+    TRANSACTION_UPDATED: 0,
+    TRANSACTION_DELETED: 0,
+    DIARY_SAVED: 1,
+}
+
+
+class AggregateStore:
+    def __init__(self, max_users: int) -> None:
+        self.max_users = max_users
+        # 辞書の参照と差し替えだけを守る（作り直しや差分の反映はロックの外で行う）
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, UserAggregate]" = OrderedDict()
+        self._builds: SingleFlight[UserAggregate] = SingleFlight()
+
+    def get(self, user_id: str) -> UserAggregate:
+        with self._lock:
+            agg = self._users.get(user_id)
+            if agg is not None:
+                self._users.move_to_end(user_id)
+        if agg is not None and agg.stamp == _stamp(user_id):
+            return agg
+        # 作り直しはユーザーごとに1回だけ行い、他のユーザーの読み書きは止めない
+        return self._builds.do(user_id, lambda: self._rebuild(user_id))
+
+    def _rebuild(self, user_id: str) -> UserAggregate:
+        agg = build_user_aggregate(user_id)
+        with self._lock:
+            self._users[user_id] = agg
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return agg
+
+    def apply(self, event: ChangeEvent) -> None:
+        with self._lock:
+            agg = self._users.get(event.user_id)
+        if agg is None:
+            return
+        index = _STAMP_INDEX.get(event.kind)
+        if (
+            index is None
+            or (event.row is None and event.kind != TRANSACTION_DELETED)
+            or event.versions is None
+            or agg.stamp[index] != event.versions[0]
+        ):
+            # 書き込み前の版が集計の版と違う（別ワーカーの書き込みが挟まった）ときは作り直す
+            self._swap(event.user_id, agg, None)
+            return
+        stamp = list(agg.stamp)
+        stamp[index] = event.versions[1]
+        updated = agg.copy((stamp[0], stamp[1]))
+        if event.kind == TRANSACTION_CREATED:
+            tx = _tx_fact(event.row)
+            if tx is not None:
+                updated.add_transaction(event.tx_id, tx)
+        elif event.kind == TRANSACTION_UPDATED:
+            tx = _tx_fact(event.row)
+            if tx is None:
+                updated.remove_transaction(event.tx_id)
+            else:
+                updated.update_transaction(event.tx_id, tx)
+        elif event.kind == TRANSACTION_DELETED:
+            updated.remove_transaction(event.tx_id)
+        else:
+            diary = _diary_fact(event.row, updated.txs.get(event.tx_id))
+            if diary is not None:
+                updated.upsert_diary(event.tx_id, diary)
+        self._swap(event.user_id, agg, updated)
+
+    def _swap(self, user_id: str, expected: UserAggregate, updated: Optional[UserAggregate]) -> None:
+        """保持している集計が expected のままなら updated に差し替える（None なら捨てる）。
+
+        反映している間に別のイベントや作り直しで差し替わっていたら、どちらが新しいか分からないので捨てる。
+        """
+        with self._lock:
+            if self._users.get(user_id) is not expected or updated is None:
+                self._users.pop(user_id, None)
+                return
+            self._users[user_id] = updated
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+_store = AggregateStore(RETROSPECTIVE_AGGREGATE_MAX_USERS)
+
+
+@subscribe
+def _on_change(event: ChangeEvent) -> None:
+    _store.apply(event)
+
+
+def get_user_aggregate(user_id: str) -> UserAggregate:
+    return _store.get(user_id)
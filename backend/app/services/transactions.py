@@ -1,26 +1,41 @@
 from datetime import datetime, date
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
 import pandas as pd
 from fastapi import HTTPException
 
-from app.repositories.csv_store import (
+from app.repositories.base import TX_COLUMNS
+from app.repositories.storage import (
+    delete_transaction_row,
+    get_transaction_row,
+    get_user_row,
+    insert_transaction_row,
     read_transactions,
-    read_users,
-    write_transactions,
+    update_transaction_row,
+    versioned_write,
 )
 from app.schemas.transactions import (
     TransactionCreate,
     TransactionOut,
     TransactionUpdate,
 )
+from app.utils.events import (
+    TRANSACTION_CREATED,
+    TRANSACTION_DELETED,
+    TRANSACTION_UPDATED,
+    ChangeEvent,
+    publish,
+)
 from app.utils.happy import compute_happy
+from app.utils.pagination import keyset_page, parse_fields
+from app.utils.serialize import frame_to_records
+
+OUT_COLUMNS = list(TransactionOut.model_fields)
 
 
 def _ensure_user(user_id: str) -> None:
-    users = read_users()
-    if users[users["user_id"] == user_id].empty:
+    if get_user_row(user_id) is None:
         raise HTTPException(status_code=400, detail="User not registered")
 
 
@@ -43,29 +58,81 @@ def list_transactions(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     date_exact: Optional[date] = None,
-) -> List[TransactionOut]:
-    df = read_transactions()
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """TransactionOut と同じ形の dict を (date, id) 順で返す（列単位で変換し、行ごとのモデル生成はしない）。
+
+    limit を指定するとキーセットページングになり、続きがあれば次ページのカーソルも返す。
+    fields を指定するとその列だけを返す（読み込みもその列とソートキーだけ）。
+    """
+    out_columns = parse_fields(fields, OUT_COLUMNS)
+    needed = set(out_columns) | {"date", "id"}
+    df = read_transactions(user_id, columns=[c for c in TX_COLUMNS if c in needed])
     if df.empty:
-        return []
-    df = df[df["user_id"] == user_id]
+        return [], None
+    day = df["date"].dt.normalize()
+    mask = pd.Series(True, index=df.index)
     if date_exact:
-        df = df[df["date"].dt.date == date_exact]
+        mask &= day == pd.Timestamp(date_exact)
     if start_date:
-        df = df[df["date"].dt.date >= start_date]
+        mask &= day >= pd.Timestamp(start_date)
     if end_date:
-        df = df[df["date"].dt.date <= end_date]
-    df = df.sort_values(by="date")
-    return [_row_to_out(row) for _, row in df.iterrows()]
+        mask &= day <= pd.Timestamp(end_date)
+    page, next_cursor = keyset_page(df[mask], ["date", "id"], limit, cursor)
+    records = frame_to_records(
+        page,
+        out_columns,
+        date_columns=["date"],
+        datetime_columns=["created_at", "updated_at"],
+        float_columns=["amount", "happy_amount"],
+        int_columns=["mood_score"],
+    )
+    return records, next_cursor
 
 
-def get_transaction(tx_id: str) -> TransactionOut:
-    df = read_transactions()
+def happy_totals(user_id: str, period: str, year: Optional[int] = None) -> List[Dict[str, Any]]:
+    """happy_amount をプラス・マイナスに分けて、月ごと（period="month" は year の1年分）か年ごとに合計する。
+
+    カレンダーの月別・年別グラフ用。全件の行を返さずに、集計結果だけを label 順で返す。
+    """
+    df = read_transactions(user_id, columns=["date", "happy_amount"])
+    df = df[df["date"].notna()]
+    if period == "month":
+        df = df[df["date"].dt.year == year]
     if df.empty:
+        return []
+    amount = pd.to_numeric(df["happy_amount"], errors="coerce").fillna(0.0)
+    label = df["date"].dt.strftime("%Y-%m" if period == "month" else "%Y")
+    totals = (
+        pd.DataFrame(
+            {
+                "label": label,
+                "positive": amount.where(amount >= 0, 0.0),
+                "negative": amount.where(amount < 0, 0.0),
+            }
+        )
+        .groupby("label", sort=True)[["positive", "negative"]]
+        .sum()
+    )
+    return [
+        {"label": lbl, "positive": float(pos), "negative": float(neg)}
+        for lbl, pos, neg in zip(
+            totals.index.tolist(), totals["positive"].tolist(), totals["negative"].tolist()
+        )
+    ]
+
+
+def _find_row(tx_id: str) -> dict:
+    row = get_transaction_row(tx_id)
+    if row is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    match = df[df["id"] == tx_id]
-    if match.empty:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    return _row_to_out(match.iloc[0])
+    return row
+
+
+def get_transaction(tx_id: str) -> TransactionOut:
+    return _row_to_out(pd.Series(_find_row(tx_id)))
 
 
 def create_transaction(payload: TransactionCreate) -> TransactionOut:
@@ -85,43 +152,43 @@ def create_transaction(payload: TransactionCreate) -> TransactionOut:
         "updated_at": now,
     }
 
-    df = read_transactions()
-    df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-    write_transactions(df)
-    return _row_to_out(df.iloc[-1])
+    versions = versioned_write(
+        "transactions", payload.user_id, lambda: insert_transaction_row(new_row)
+    )
+    publish(ChangeEvent(TRANSACTION_CREATED, payload.user_id, tx_id, row=new_row, versions=versions))
+    return _row_to_out(pd.Series(new_row))
 
 
 def update_transaction(tx_id: str, payload: TransactionUpdate) -> TransactionOut:
-    df = read_transactions()
-    idx = df.index[df["id"] == tx_id]
-    if idx.empty:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    idx = idx[0]
+    row = _find_row(tx_id)
+    previous = dict(row)
 
     if payload.date is not None:
-        df.at[idx, "date"] = pd.to_datetime(payload.date)
+        row["date"] = pd.to_datetime(payload.date)
     if payload.item is not None:
-        df.at[idx, "item"] = payload.item
+        row["item"] = payload.item
     if payload.amount is not None:
-        df.at[idx, "amount"] = float(payload.amount)
+        row["amount"] = float(payload.amount)
     if payload.mood_score is not None:
-        df.at[idx, "mood_score"] = int(payload.mood_score)
-
-    amount = float(df.at[idx, "amount"])
-    mood = int(df.at[idx, "mood_score"])
-    df.at[idx, "happy_amount"] = compute_happy(amount, mood)
-    df.at[idx, "updated_at"] = datetime.utcnow()
-
-    write_transactions(df)
-    return _row_to_out(df.iloc[idx])
+        row["mood_score"] = int(payload.mood_score)
+
+    amount = float(row["amount"])
+    mood = int(row["mood_score"])
+    row["happy_amount"] = compute_happy(amount, mood)
+    row["updated_at"] = datetime.utcnow()
+
+    versions = versioned_write("transactions", row["user_id"], lambda: update_transaction_row(row))
+    publish(
+        ChangeEvent(
+            TRANSACTION_UPDATED, row["user_id"], tx_id, row=row, previous=previous, versions=versions
+        )
+    )
+    return _row_to_out(pd.Series(row))
 
 
 def delete_transaction(tx_id: str) -> None:
-    df = read_transactions()
-    if df.empty:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    new_df = df[df["id"] != tx_id]
-    if len(new_df) == len(df):
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    write_transactions(new_df)
-
+    row = _find_row(tx_id)
+    versions = versioned_write(
+        "transactions", row["user_id"], lambda: delete_transaction_row(tx_id, row["user_id"])
+    )
+    publish(ChangeEvent(TRANSACTION_DELETED, row["user_id"], tx_id, previous=row, versions=versions))
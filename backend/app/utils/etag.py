@@ -0,0 +1,41 @@
+"""条件付きGET（ETag / If-None-Match）の共通処理。
+
+ETag はリポジトリの table_version() と、ユーザー・クエリ文字列などレスポンスを左右する値から作る。
+一致すればデータを読まずに 304 を返す。
+"""
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# ブラウザには毎回 ETag で再検証させる
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: object) -> str:
+    digest = hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """If-None-Match が etag に一致するか（弱い比較）。"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _opaque(etag) in {_opaque(tag) for tag in header.split(",")}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def cache_headers(etag: str, extra: Optional[dict] = None) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, **(extra or {})}
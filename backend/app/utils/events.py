@@ -0,0 +1,57 @@
+"""書き込みの変更イベント（プロセス内の publish / subscribe）。
+
+サービス層は取引・日記を書き込んだ後に publish し、キャッシュや集計はそれを購読して
+該当ユーザーの分だけを捨てる・更新する。ハンドラーは publish したスレッドで同期的に呼ばれる。
+書き込み自体は成功しているため、ハンドラーの例外はログに残して握りつぶす。
+
+別ワーカーの書き込みはこのイベントでは届かない。プロセスをまたぐ鮮度は、各キャッシュ側で
+テーブルの版（table_version）や content_hash を見て保つこと。
+"""
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+TRANSACTION_CREATED = "transaction.created"
+TRANSACTION_UPDATED = "transaction.updated"
+TRANSACTION_DELETED = "transaction.deleted"
+DIARY_SAVED = "diary.saved"
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    kind: str
+    user_id: str
+    tx_id: str
+    # 変更後の行（削除では None）と変更前の行（作成では None）
+    row: Optional[dict] = None
+    previous: Optional[dict] = None
+    # 書き込みの直前・直後のテーブルの版（storage.versioned_write で取ったもの。なければ None）
+    versions: Optional[Tuple[str, str]] = None
+
+
+Handler = Callable[[ChangeEvent], None]
+
+_handlers: List[Handler] = []
+_handlers_lock = threading.Lock()
+
+
+def subscribe(handler: Handler) -> Handler:
+    """イベントのハンドラーを登録する（デコレーターとしても使える）。"""
+    with _handlers_lock:
+        if handler not in _handlers:
+            _handlers.append(handler)
+    return handler
+
+
+def publish(event: ChangeEvent) -> None:
+    with _handlers_lock:
+        handlers = list(_handlers)
+    for handler in handlers:
+        try:
+            handler(event)
+        except Exception:
+            logger.exception("change event handler failed: %s %s", event.kind, handler)
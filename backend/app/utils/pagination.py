@@ -0,0 +1,89 @@
+"""一覧APIのキーセットページングと fields= による列の絞り込み。
+
+カーソルは最後に返した行のソートキー値を JSON にして base64url で包んだもの。
+欠損したキー値（日付が空の行など）は null で表し、昇順・降順どちらでも非欠損の値より後ろに並べる。
+クライアントは中身を解釈せず、レスポンスヘッダー X-Next-Cursor の値をそのまま送り返す。
+"""
+
+import base64
+import binascii
+import json
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+from fastapi import HTTPException
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 1000
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """カンマ区切りの fields= を検証して列名のリストにする（未指定なら全列）。"""
+    if not fields:
+        return list(allowed)
+    selected = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in selected if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # 並びはモデルの定義順にそろえる
+    return [f for f in allowed if f in selected]
+
+
+def encode_cursor(row: pd.Series, keys: Sequence[str]) -> str:
+    values = []
+    for key in keys:
+        value = row[key]
+        if pd.isna(value):
+            values.append(None)
+        else:
+            values.append(value.isoformat() if isinstance(value, pd.Timestamp) else str(value))
+    raw = json.dumps(values, ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str, df: pd.DataFrame, keys: Sequence[str]) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [
+            None if v is None
+            else pd.Timestamp(v) if pd.api.types.is_datetime64_any_dtype(df[k])
+            else str(v)
+            for k, v in zip(keys, values)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(
+    df: pd.DataFrame,
+    keys: Sequence[str],
+    limit: Optional[int],
+    cursor: Optional[str] = None,
+    ascending: bool = True,
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """keys の辞書順で並べ、cursor の次から limit 行を返す。続きがあれば次のカーソルも返す。
+
+    limit も cursor も無ければ並べ替えただけの全件を返す（従来どおりの挙動）。
+    """
+    if cursor:
+        after = _decode_cursor(cursor, df, keys)
+        mask = pd.Series(False, index=df.index)
+        equal = pd.Series(True, index=df.index)
+        for key, value in zip(keys, after):
+            col = df[key]
+            if value is None:
+                # 欠損は最後に並ぶので、後ろにあるのは同じく欠損の行だけ
+                equal &= col.isna()
+                continue
+            beyond = (col > value) if ascending else (col < value)
+            mask |= equal & (beyond | col.isna())
+            equal &= col == value
+        df = df[mask]
+    df = df.sort_values(by=list(keys), ascending=ascending, na_position="last")
+    if limit is None or len(df) <= limit:
+        return df, None
+    page = df.iloc[:limit]
+    return page, encode_cursor(page.iloc[-1], keys)
@@ -0,0 +1,131 @@
+"""バックグラウンドでキーごとの再計算を行うワーカー（FastAPI の lifespan で起動・停止する）。
+
+- submit(key) はどのスレッドからでも呼べる。同じキーが待ち行列にある間は重ねて積まない。
+  実行中に submit されたら、終わった後にもう一度だけ実行する
+- 同時に実行するジョブは concurrency 件まで
+- interval 秒ごとに sweep() が返すキーを積み直す（期限切れ前の更新や、別ワーカーの書き込みの反映用）
+- RateLimiter はジョブ側で外部APIの呼び出し前に acquire() して、呼び出し回数を抑える
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Generic, Hashable, Iterable, List, Optional, Set, TypeVar
+
+logger = logging.getLogger("uvicorn.error")
+
+K = TypeVar("K", bound=Hashable)
+
+
+class RateLimiter:
+    """1分あたり rate_per_minute 回までに間隔をならす。"""
+
+    def __init__(self, rate_per_minute: float) -> None:
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RefreshWorker(Generic[K]):
+    def __init__(
+        self,
+        job: Callable[[K], Awaitable[None]],
+        concurrency: int,
+        interval: float,
+        sweep: Optional[Callable[[], Iterable[K]]] = None,
+    ) -> None:
+        self.job = job
+        self.concurrency = max(1, concurrency)
+        self.interval = interval
+        self.sweep = sweep
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # 待ち行列にあるか実行中のキーと、実行中に submit されたキー
+        self._pending: Set[K] = set()
+        self._running: Set[K] = set()
+        self._rerun: Set[K] = set()
+        self._pending_lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        if self.sweep is not None and self.interval > 0:
+            self._tasks.append(asyncio.create_task(self._sweep_loop()))
+
+    async def stop(self) -> None:
+        self._loop = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        with self._pending_lock:
+            self._pending.clear()
+            self._running.clear()
+            self._rerun.clear()
+
+    def submit(self, key: K) -> bool:
+        """key の再計算を積む。ワーカーが動いていなければ何もせず False を返す。"""
+        loop = self._loop
+        if loop is None:
+            return False
+        with self._pending_lock:
+            if key in self._running:
+                self._rerun.add(key)
+                return True
+            if key in self._pending:
+                return True
+            self._pending.add(key)
+        try:
+            loop.call_soon_threadsafe(self._queue.put_nowait, key)
+        except RuntimeError:
+            # 停止処理中でループが閉じている
+            with self._pending_lock:
+                self._pending.discard(key)
+            return False
+        return True
+
+    async def _consume(self) -> None:
+        while True:
+            key = await self._queue.get()
+            with self._pending_lock:
+                self._running.add(key)
+            try:
+                await self.job(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("background refresh failed: %s", key)
+            finally:
+                with self._pending_lock:
+                    self._running.discard(key)
+                    if key in self._rerun:
+                        self._rerun.discard(key)
+                        self._queue.put_nowait(key)
+                    else:
+                        self._pending.discard(key)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                keys = await asyncio.to_thread(lambda: list(self.sweep()))
+            except Exception:
+                logger.exception("background refresh sweep failed")
+                continue
+            for key in keys:
+                self.submit(key)
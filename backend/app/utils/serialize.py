@@ -0,0 +1,85 @@
+"""一覧APIのレスポンスを DataFrame から列単位でまとめて組み立てる。
+
+行ごとに Pydantic モデルを作らず、日付列は列ごとに1回だけ文字列化してから
+records（dict のリスト）にし、JSON へ直接シリアライズする。
+orjson が入っていれば使い（`pip install orjson`）、なければ標準の json で書き出す。
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson は任意
+    orjson = None
+
+
+def _to_datetime64(series: pd.Series) -> np.ndarray:
+    return pd.to_datetime(series, errors="coerce").to_numpy(dtype="datetime64[us]")
+
+
+def _with_none(text: np.ndarray, values: np.ndarray) -> List[Optional[str]]:
+    out = text.astype(object)
+    out[np.isnat(values)] = None
+    return out.tolist()
+
+
+def _iso_datetimes(series: pd.Series) -> List[Optional[str]]:
+    # Pydantic の datetime 出力と同じく、マイクロ秒が 0 のときは秒までにする
+    values = _to_datetime64(series)
+    text = np.datetime_as_string(values, unit="s")
+    fraction = values.astype("int64") % 1_000_000 != 0
+    if fraction.any():
+        text = np.where(fraction, np.datetime_as_string(values, unit="us"), text)
+    return _with_none(text, values)
+
+
+def _iso_dates(series: pd.Series) -> List[Optional[str]]:
+    values = _to_datetime64(series)
+    return _with_none(np.datetime_as_string(values, unit="D"), values)
+
+
+def frame_to_records(
+    df: pd.DataFrame,
+    columns: Sequence[str],
+    date_columns: Sequence[str] = (),
+    datetime_columns: Sequence[str] = (),
+    float_columns: Sequence[str] = (),
+    int_columns: Sequence[str] = (),
+    text_columns: Sequence[str] = (),
+) -> List[Dict[str, Any]]:
+    """指定列を JSON にそのまま渡せる型へ列単位で変換し、records で返す。"""
+    values: List[list] = []
+    for col in columns:
+        if col in date_columns:
+            values.append(_iso_dates(df[col]))
+        elif col in datetime_columns:
+            values.append(_iso_datetimes(df[col]))
+        elif col in float_columns:
+            values.append(df[col].astype(float).tolist())
+        elif col in int_columns:
+            values.append(df[col].astype(int).tolist())
+        elif col in text_columns:
+            values.append(df[col].fillna("").astype(str).tolist())
+        else:
+            values.append(df[col].tolist())
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RecordsResponse(Response):
+    """frame_to_records() の結果をそのまま JSON で返すレスポンス（検証は省く）。"""
+
+    media_type = "application/json"
+
+    def render(self, content: Optional[Any]) -> bytes:
+        return dumps(content)
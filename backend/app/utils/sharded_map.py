@@ -0,0 +1,59 @@
+"""書き換えると新しいマップを返す（元は変えない）辞書。
+
+キーのハッシュで SHARDS 個の辞書に分けて持ち、set() / delete() では触った区画だけを複製する。
+全体を複製するより1件あたりの更新が安く（O(件数 / SHARDS)）、読み手が持っている古いマップは
+書き換わらないので、ロックなしで読める。
+"""
+
+from typing import Dict, Generic, Hashable, Iterable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+SHARDS = 64
+
+
+class ShardedMap(Generic[K, V]):
+    __slots__ = ("_shards",)
+
+    def __init__(self, shards: Optional[Tuple[Dict[K, V], ...]] = None) -> None:
+        self._shards: Tuple[Dict[K, V], ...] = shards or tuple({} for _ in range(SHARDS))
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[K, V]]) -> "ShardedMap[K, V]":
+        shards: Tuple[Dict[K, V], ...] = tuple({} for _ in range(SHARDS))
+        for key, value in items:
+            shards[hash(key) % SHARDS][key] = value
+        return cls(shards)
+
+    def _shard(self, key: K) -> Dict[K, V]:
+        return self._shards[hash(key) % SHARDS]
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        return self._shard(key).get(key, default)
+
+    def __getitem__(self, key: K) -> V:
+        return self._shard(key)[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._shards[hash(key) % SHARDS]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def _with_shard(self, index: int, shard: Dict[K, V]) -> "ShardedMap[K, V]":
+        return ShardedMap(self._shards[:index] + (shard,) + self._shards[index + 1 :])
+
+    def set(self, key: K, value: V) -> "ShardedMap[K, V]":
+        index = hash(key) % SHARDS
+        shard = dict(self._shards[index])
+        shard[key] = value
+        return self._with_shard(index, shard)
+
+    def delete(self, key: K) -> "ShardedMap[K, V]":
+        index = hash(key) % SHARDS
+        if key not in self._shards[index]:
+            return self
+        shard = dict(self._shards[index])
+        del shard[key]
+        return self._with_shard(index, shard)
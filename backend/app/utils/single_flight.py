@@ -0,0 +1,49 @@
+"""同じキーの重い処理を同時に1回だけ実行する（single-flight）。
+
+実行中のキーに後から来た呼び出しは、新たに実行せず先行呼び出しの結果（または例外）を待って受け取る。
+プロセス内のスレッド間でのみ束ねる。
+"""
+
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call(Generic[T]):
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[T] = None
+    error: Optional[BaseException] = None
+
+
+class SingleFlight(Generic[T]):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call[T]] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
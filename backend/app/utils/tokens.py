@@ -0,0 +1,60 @@
+"""LLM に渡すテキストのトークン数を数え、会話履歴を上限に収める。
+
+tiktoken が入っていればモデルのトークナイザーで数える（`pip install tiktoken`）。
+入っていない・エンコーディングを取得できないときは文字数から見積もる
+（日本語など ASCII 以外は1文字1トークン、ASCII は4文字で1トークン）。
+"""
+
+import math
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+# メッセージ1件ごとに role などの区切りで増える分
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8)
+def _encoder(model: str) -> Optional[Callable[[str], list]]:
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        # 初回はエンコーディングをダウンロードするため、失敗したら見積もりに切り替える
+        return None
+    return encoding.encode
+
+
+def count_tokens(text: str, model: str) -> int:
+    encode = _encoder(model)
+    if encode is not None:
+        return len(encode(text))
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def count_message_tokens(text: str, model: str) -> int:
+    return count_tokens(text, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def leading_items_to_drop(texts: List[str], max_tokens: int, model: str, step: int) -> int:
+    """texts（古い順）の合計が max_tokens に収まるよう、先頭から落とす件数を返す。
+
+    落とす件数は step 件単位に切り上げる。履歴が少し伸びただけでは落とす位置が変わらないため、
+    残した部分の先頭が毎回同じになり、LLM 側のプロンプトキャッシュが効き続ける。
+    最後の1件は上限を超えていても落とさない。
+    """
+    counts = [count_message_tokens(text, model) for text in texts]
+    total = sum(counts)
+    drop = 0
+    while total > max_tokens and drop < len(counts) - 1:
+        total -= counts[drop]
+        drop += 1
+    if drop == 0:
+        return 0
+    return min(math.ceil(drop / step) * step, len(counts) - 1)
@@ -0,0 +1,57 @@
+"""件数上限つき・期限つきのメモリキャッシュ（スレッドセーフな LRU）。
+
+- get() で期限切れのエントリは捨てて None を返す。ヒットしたエントリは最近使った側へ移す
+- set() で上限を超えたら、最も長く使われていないエントリから追い出す
+- 期限はエントリごとに set(ttl=...) で短くできる（署名の有効期限に合わせる場合など）
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    def __init__(self, max_entries: int, ttl_seconds: Optional[float] = None) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # キー -> (値, 期限の time.monotonic()。期限なしは None)
+        self._entries: "OrderedDict[K, Tuple[V, Optional[float]]]" = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V, ttl_seconds: Optional[float] = None) -> None:
+        ttls = [t for t in (self.ttl_seconds, ttl_seconds) if t is not None]
+        expires_at = time.monotonic() + min(ttls) if ttls else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: K) -> Optional[V]:
+        with self._lock:
+            item = self._entries.pop(key, None)
+        return item[0] if item is not None else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,127 @@
+"""/diary/chat/stream を同時に複数本流し、ストリーム同士が直列化しないことを確かめる負荷テスト。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.chat_stream_concurrency --streams 16 --tokens 20 --token-delay 0.05
+
+benchmarks.fake_openai（OpenAI 互換スタブ）と、それを OPENAI_BASE_URL に向けた uvicorn
+（1ワーカー、一時 DATA_DIR）を起動して計測する。1本だけ流したときの所要時間に対して、
+同時に流したときの全体時間がほぼ変わらなければイベントループは塞がれていない。
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks import fake_openai
+from benchmarks.stress_transactions import (
+    _free_port,
+    _request,
+    _start_server,
+    _wait_until_ready,
+)
+
+USER_ID = "bench-user"
+
+
+def login(base_url: str, user_id: str) -> str:
+    """ログインしてセッションCookie（"name=value"）を返す。"""
+    req = urllib.request.Request(
+        f"{base_url}/auth/login",
+        data=json.dumps({"user_id": user_id}).encode("utf-8"),
+        method="POST",
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=30) as res:
+        return res.headers["Set-Cookie"].split(";", 1)[0]
+
+
+def stream_once(base_url: str, cookie: str, tx_id: str) -> tuple[float, float, int]:
+    """1本ストリームを最後まで読み、(最初のトークンまでの秒数, 全体の秒数, トークン数) を返す。"""
+    req = urllib.request.Request(
+        f"{base_url}/diary/chat/stream",
+        data=json.dumps({"tx_id": tx_id, "messages": []}).encode("utf-8"),
+        method="POST",
+        headers={"Content-Type": "application/json", "Cookie": cookie},
+    )
+    started = time.perf_counter()
+    first = None
+    tokens = 0
+    with urllib.request.urlopen(req, timeout=300) as res:
+        for raw in res:
+            line = raw.decode("utf-8").strip()
+            if line.startswith("event: error"):
+                raise RuntimeError("stream returned an error event")
+            if not line.startswith("data: "):
+                continue
+            if line == "data: [DONE]":
+                break
+            if first is None:
+                first = time.perf_counter() - started
+            tokens += 1
+    return first or 0.0, time.perf_counter() - started, tokens
+
+
+def run(base_url: str, streams: int) -> float:
+    status, tx = _request(
+        "POST",
+        f"{base_url}/transactions",
+        {"user_id": USER_ID, "date": "2024-01-01", "item": "bench", "amount": 1000, "mood_score": 1},
+    )
+    if status != 201:
+        raise RuntimeError(f"create failed: {status} {tx}")
+    cookie = login(base_url, USER_ID)
+
+    _, single, tokens = stream_once(base_url, cookie, tx["id"])
+    print(f"single stream: {single:.2f}s ({tokens} tokens)")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        results = list(pool.map(lambda _: stream_once(base_url, cookie, tx["id"]), range(streams)))
+    wall = time.perf_counter() - started
+    ttfbs = sorted(r[0] for r in results)
+
+    print(f"{streams} concurrent streams: {wall:.2f}s wall (serialized would be ~{single * streams:.2f}s)")
+    print(f"first token p50/max: {ttfbs[len(ttfbs) // 2] * 1000:.0f}ms / {ttfbs[-1] * 1000:.0f}ms")
+    overlap = single * streams / wall
+    print(f"effective concurrency: {overlap:.1f}x")
+    return overlap
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=16)
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    fake, fake_url = fake_openai.start_in_subprocess(args, _free_port())
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "users.csv").write_text(
+                f"user_id,display_name\n{USER_ID},bench\n", encoding="utf-8"
+            )
+            env = {"OPENAI_API_KEY": "sk-fake", "OPENAI_BASE_URL": fake_url}
+            proc, base_url = _start_server(1, data_dir, env)
+            try:
+                _wait_until_ready(base_url, proc)
+                overlap = run(base_url, args.streams)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        fake.terminate()
+        fake.wait(timeout=30)
+
+    # 半分以上重なっていれば直列化していないとみなす
+    if overlap < args.streams / 2:
+        sys.exit("FAILED: concurrent streams were serialized")
+    print("OK: streams ran concurrently")
+
+
+if __name__ == "__main__":
+    main()
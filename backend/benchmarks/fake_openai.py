@@ -0,0 +1,201 @@
+"""ベンチマーク用の OpenAI 互換スタブサーバー（POST /v1/chat/completions のみ）。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.fake_openai --port 8001 --ttft 0.3 --tokens 20 --token-delay 0.05
+
+アプリ側は OPENAI_BASE_URL=http://127.0.0.1:8001/v1 と任意の OPENAI_API_KEY を指定して起動する。
+
+- stream=true: --ttft 秒待ってから、トークンを --token-delay 秒おきに SSE で返す
+- それ以外: ttft + tokens * token_delay 秒待ってから一括で返す
+- response_format={"type": "json_object"}: 日記生成と同じ {"diary_title", "diary_body"} の JSON を返す
+- --error-rate: その割合のリクエストに --error-status のエラーを返す（OpenAI と同じエラー形式）
+- --stream-error-rate: その割合のストリームを途中で切る
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class FakeConfig:
+    ttft: float = 0.0
+    tokens: int = 20
+    token_delay: float = 0.05
+    error_rate: float = 0.0
+    error_status: int = 500
+    stream_error_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+config = FakeConfig()
+_random = random.Random()
+app = FastAPI(title="fake-openai")
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    body = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+
+def _tokens() -> List[str]:
+    return [f"トークン{i}っピィ " for i in range(config.tokens)]
+
+
+def _json_content() -> str:
+    return json.dumps(
+        {"diary_title": "スタブの日記っピィ", "diary_body": "".join(_tokens()).strip()},
+        ensure_ascii=False,
+    )
+
+
+def _error() -> JSONResponse:
+    return JSONResponse(
+        {
+            "error": {
+                "message": "Injected error from fake OpenAI server",
+                "type": "server_error",
+                "param": None,
+                "code": None,
+            }
+        },
+        status_code=config.error_status,
+    )
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    model = payload.get("model", "fake-model")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if _random.random() < config.error_rate:
+        return _error()
+
+    if payload.get("stream"):
+        broken = _random.random() < config.stream_error_rate
+
+        async def events():
+            await asyncio.sleep(config.ttft)
+            yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+            tokens = _tokens()
+            for i, token in enumerate(tokens):
+                if i > 0:
+                    await asyncio.sleep(config.token_delay)
+                if broken and i == len(tokens) // 2:
+                    # 接続を途中で切ったのと同じ状態にする
+                    raise RuntimeError("injected stream error")
+                yield _chunk(completion_id, model, {"content": token})
+            yield _chunk(completion_id, model, {}, finish_reason="stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(config.ttft + config.token_delay * config.tokens)
+    response_format = payload.get("response_format") or {}
+    if response_format.get("type") == "json_object":
+        content = _json_content()
+    else:
+        content = "".join(_tokens()).strip()
+    return JSONResponse(
+        {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": config.tokens, "total_tokens": config.tokens},
+        }
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """スタブの設定オプション（ベンチマーク側からも同じ名前で受け付ける）。"""
+    parser.add_argument("--ttft", type=float, default=config.ttft, help="最初のトークンまでの秒数")
+    parser.add_argument("--tokens", type=int, default=config.tokens, help="1応答のトークン数")
+    parser.add_argument("--token-delay", type=float, default=config.token_delay, help="トークン間の秒数")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--error-status", type=int, default=config.error_status)
+    parser.add_argument("--stream-error-rate", type=float, default=config.stream_error_rate)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def _argv(args: argparse.Namespace) -> List[str]:
+    argv = [
+        "--ttft", str(args.ttft),
+        "--tokens", str(args.tokens),
+        "--token-delay", str(args.token_delay),
+        "--error-rate", str(args.error_rate),
+        "--error-status", str(args.error_status),
+        "--stream-error-rate", str(args.stream_error_rate),
+    ]
+    if args.seed is not None:
+        argv += ["--seed", str(args.seed)]
+    return argv
+
+
+def start_in_subprocess(args: argparse.Namespace, port: int) -> tuple[subprocess.Popen, str]:
+    """別プロセスでスタブを起動し、(プロセス, OPENAI_BASE_URL に渡すURL) を返す。"""
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port), *_argv(args)],
+        cwd=BACKEND_DIR,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"fake server exited with code {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("fake server did not become ready")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    config.ttft = args.ttft
+    config.tokens = args.tokens
+    config.token_delay = args.token_delay
+    config.error_rate = args.error_rate
+    config.error_status = args.error_status
+    config.stream_error_rate = args.stream_error_rate
+    _random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
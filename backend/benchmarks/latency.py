@@ -0,0 +1,239 @@
+"""アプリ全体のエンドツーエンド遅延ベンチマーク（エンドポイントごとの p50 / p95 / p99）。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.latency --users 8 --iterations 5 --ttft 0.3 --tokens 30 --token-delay 0.03
+
+benchmarks.fake_openai（OpenAI 互換スタブ）と、それを OPENAI_BASE_URL に向けた uvicorn
+（一時 DATA_DIR）を起動する。仮想ユーザーごとに取引・日記を投入した後、各ユーザーが並行して
+一覧取得 → チャット（SSE）→ 日記生成 → 保存 → ふりかえり、を --iterations 回繰り返す。
+SSE は最初のトークンまで（TTFB）と最後まで（total）を分けて集計する。
+ふりかえりのまとめ文は TOP / WORST の日記が変わったときだけ、バックグラウンドで LLM により生成される
+（リクエストは生成を待たず、前回のまとめ文を返す）。
+"""
+
+import argparse
+import datetime as dt
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks import fake_openai
+from benchmarks.chat_stream_concurrency import login
+from benchmarks.stress_transactions import BACKEND_DIR, _free_port, _start_server, _wait_until_ready
+
+Samples = Dict[str, List[float]]
+
+
+def _call(
+    method: str, url: str, payload: Optional[dict] = None, cookie: Optional[str] = None
+) -> Tuple[int, float, object]:
+    headers = {"Content-Type": "application/json"}
+    if cookie:
+        headers["Cookie"] = cookie
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=300) as res:
+            body = res.read()
+            return res.status, time.perf_counter() - started, json.loads(body or b"null")
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        return exc.code, time.perf_counter() - started, None
+
+
+def _stream(url: str, payload: dict, cookie: str) -> Tuple[bool, float, float]:
+    """SSE を最後まで読み、(成功したか, 最初のトークンまでの秒数, 全体の秒数) を返す。"""
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        method="POST",
+        headers={"Content-Type": "application/json", "Cookie": cookie},
+    )
+    started = time.perf_counter()
+    first: Optional[float] = None
+    ok = False
+    try:
+        with urllib.request.urlopen(req, timeout=300) as res:
+            for raw in res:
+                line = raw.decode("utf-8").strip()
+                if line.startswith("event: error"):
+                    break
+                if line == "data: [DONE]":
+                    ok = True
+                    break
+                if line.startswith("data: ") and first is None:
+                    first = time.perf_counter() - started
+    except (urllib.error.URLError, OSError):
+        ok = False
+    total = time.perf_counter() - started
+    return ok, first if first is not None else total, total
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近順位法のパーセンタイル。"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _seed_user(base_url: str, user_id: str, transactions: int) -> Tuple[str, List[str]]:
+    # ふりかえりの集計期間（直近12か月）に入るよう、今日から遡った日付で投入する
+    today = dt.date.today()
+    tx_ids = []
+    for i in range(transactions):
+        status, _, body = _call(
+            "POST",
+            f"{base_url}/transactions",
+            {
+                "user_id": user_id,
+                "date": (today - dt.timedelta(days=i * 7 % 330)).isoformat(),
+                "item": f"event-{i}",
+                "amount": 500 + 37 * i,
+                "mood_score": i % 5 - 2,
+            },
+        )
+        if status != 201:
+            raise RuntimeError(f"seed failed: {status}")
+        tx_ids.append(body["id"])
+    cookie = login(base_url, user_id)
+    # ふりかえりの TOP / WORST に載るよう、前半の取引に日記を付けておく
+    for tx_id in tx_ids[: max(1, transactions // 2)]:
+        _call(
+            "POST",
+            f"{base_url}/diary/save",
+            {"tx_id": tx_id, "diary_title": "seed", "diary_body": "seed body"},
+            cookie,
+        )
+    return cookie, tx_ids
+
+
+def _user_session(
+    base_url: str, user_id: str, cookie: str, tx_ids: List[str], iterations: int
+) -> Tuple[Samples, Dict[str, int]]:
+    samples: Samples = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    def record(name: str, status: int, elapsed: float) -> None:
+        samples[name].append(elapsed)
+        if status >= 400:
+            errors[name] += 1
+
+    for i in range(iterations):
+        tx_id = tx_ids[i % len(tx_ids)]
+        status, elapsed, _ = _call("GET", f"{base_url}/transactions?user_id={user_id}")
+        record("GET /transactions", status, elapsed)
+        status, elapsed, _ = _call("GET", f"{base_url}/diary", cookie=cookie)
+        record("GET /diary", status, elapsed)
+
+        messages = [{"role": "user", "content": "楽しかった"}]
+        ok, ttfb, total = _stream(
+            f"{base_url}/diary/chat/stream", {"tx_id": tx_id, "messages": messages}, cookie
+        )
+        record("POST /diary/chat/stream (TTFB)", 200 if ok else 500, ttfb)
+        record("POST /diary/chat/stream (total)", 200 if ok else 500, total)
+
+        status, elapsed, body = _call(
+            "POST", f"{base_url}/diary/generate", {"tx_id": tx_id, "messages": messages}, cookie
+        )
+        record("POST /diary/generate", status, elapsed)
+        if status == 200:
+            status, elapsed, _ = _call(
+                "POST", f"{base_url}/diary/save", {"tx_id": tx_id, **body}, cookie
+            )
+            record("POST /diary/save", status, elapsed)
+
+        status, elapsed, _ = _call("GET", f"{base_url}/retrospective/summary", cookie=cookie)
+        record("GET /retrospective/summary", status, elapsed)
+    return samples, errors
+
+
+def run(base_url: str, users: int, iterations: int, transactions: int) -> int:
+    user_ids = [f"bench-{i:03d}" for i in range(users)]
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        seeded = list(pool.map(lambda uid: _seed_user(base_url, uid, transactions), user_ids))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(
+            pool.map(
+                lambda args: _user_session(base_url, args[0], args[1][0], args[1][1], iterations),
+                zip(user_ids, seeded),
+            )
+        )
+    elapsed = time.perf_counter() - started
+
+    samples: Samples = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    for user_samples, user_errors in results:
+        for name, values in user_samples.items():
+            samples[name].extend(values)
+        for name, count in user_errors.items():
+            errors[name] += count
+
+    print(f"{users} users x {iterations} iterations in {elapsed:.2f}s")
+    print(f"{'endpoint':<34} {'n':>5} {'err':>4} {'p50[ms]':>9} {'p95[ms]':>9} {'p99[ms]':>9}")
+    for name, values in samples.items():
+        print(
+            f"{name:<34} {len(values):>5} {errors[name]:>4} "
+            + " ".join(f"{percentile(values, q) * 1000:>9.1f}" for q in (0.5, 0.95, 0.99))
+        )
+    return sum(errors.values())
+
+
+def _prepare_data_dir(data_dir: Path, users: int, env: dict) -> None:
+    lines = ["user_id,display_name"] + [f"bench-{i:03d},bench {i}" for i in range(users)]
+    (data_dir / "users.csv").write_text("\n".join(lines) + "\n", encoding="utf-8")
+    if env.get("STORAGE_BACKEND", "csv").lower() == "sqlite":
+        # SQLite はユーザーも DB から読むため、CSV から移しておく
+        subprocess.run(
+            [sys.executable, "-m", "scripts.migrate_csv_to_sqlite"],
+            cwd=BACKEND_DIR,
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="並行する仮想ユーザー数")
+    parser.add_argument("--iterations", type=int, default=5, help="ユーザーごとの繰り返し回数")
+    parser.add_argument("--transactions", type=int, default=20, help="ユーザーごとに投入する取引数")
+    parser.add_argument("--workers", type=int, default=1, help="起動する uvicorn ワーカー数")
+    parser.add_argument("--verbose", action="store_true", help="アプリのログを表示する")
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    fake, fake_url = fake_openai.start_in_subprocess(args, _free_port())
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            env = {"OPENAI_API_KEY": "sk-fake", "OPENAI_BASE_URL": fake_url, "DATA_DIR": str(data_dir)}
+            _prepare_data_dir(data_dir, args.users, {**os.environ, **env})
+            proc, base_url = _start_server(args.workers, data_dir, env, quiet=not args.verbose)
+            try:
+                _wait_until_ready(base_url, proc)
+                errors = run(base_url, args.users, args.iterations, args.transactions)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+    finally:
+        fake.terminate()
+        fake.wait(timeout=30)
+
+    if errors and not (args.error_rate or args.stream_error_rate):
+        sys.exit(f"FAILED: {errors} requests failed")
+
+
+if __name__ == "__main__":
+    main()
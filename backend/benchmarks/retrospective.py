@@ -0,0 +1,205 @@
+"""ふりかえり集計の計算時間を比較するベンチマーク（1ユーザーあたりの取引数ごと）。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.retrospective --rows 1000 10000 100000
+
+- legacy:   従来の経路（merge → 行ごとの apply(_safe_date) → iterrows → 全件ソート → 日ごとの while ループ）
+- rowwise:  集計を1行ずつ add_transaction / upsert_diary で積み上げる経路
+- build:    aggregate_from_frames() で列単位に集計を作る経路（起動直後・更新/削除後の作り直し）
+- window:   集計済みの状態から直近12か月を切り出す経路（通常のリクエスト）
+
+まとめ文は LLM を呼ばず定型文になる（OPENAI_API_KEY は外して実行する）。
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+# まとめ文キャッシュの書き込み先を一時ディレクトリにし、LLM は呼ばない
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="retrospective-bench-")
+os.environ.pop("OPENAI_API_KEY", None)
+
+from app.services.retrospective import summarize_aggregate  # noqa: E402
+from app.services.retrospective_aggregates import (  # noqa: E402
+    UserAggregate,
+    _diary_fact,
+    _tx_fact,
+    aggregate_from_frames,
+)
+
+MONTHS = 12
+
+
+def _make_frames(rows: int, diary_ratio: float):
+    rng = np.random.default_rng(0)
+    today = pd.Timestamp(date.today())
+    mood = rng.integers(-2, 3, rows)
+    amount = rng.integers(100, 50000, rows).astype(float)
+    tx_df = pd.DataFrame(
+        {
+            "id": [f"tx-{i:08d}" for i in range(rows)],
+            "date": today - pd.to_timedelta(rng.integers(-7, 730, rows), unit="D"),
+            "item": [f"item {i}" for i in range(rows)],
+            "happy_amount": amount * mood / 2 + rng.random(rows),
+            "mood_score": mood,
+        }
+    )
+    picked = tx_df.sample(frac=diary_ratio, random_state=0)
+    diary_df = pd.DataFrame(
+        {
+            "id": [f"diary-{i:08d}" for i in range(len(picked))],
+            "tx_id": picked["id"].to_numpy(),
+            "diary_title": [f"title {i}" for i in range(len(picked))],
+            "diary_body": [f"body {i}" for i in range(len(picked))],
+            "transaction_date": picked["date"].to_numpy(),
+        }
+    )
+    return tx_df, diary_df
+
+
+def _legacy(tx_df: pd.DataFrame, diary_df: pd.DataFrame) -> dict:
+    """集計の差分更新・列単位化より前の summarize_retrospective と同じ計算（まとめ文を除く）。"""
+
+    def safe_date(val):
+        try:
+            ts = pd.to_datetime(val)
+        except Exception:
+            return None
+        if pd.isna(ts):
+            return None
+        return ts.date()
+
+    def filter_window(df, col, start):
+        df = df.copy()
+        df["__effective_date"] = df[col].apply(safe_date)
+        df = df[df["__effective_date"].notna()]
+        return df[df["__effective_date"] >= start]
+
+    start_date = date.today() - timedelta(days=MONTHS * 30)
+    tx = tx_df.copy()
+    tx["__date_only"] = tx["date"].dt.date
+    tx = filter_window(tx, "__date_only", start_date)
+    diary = diary_df.merge(tx, left_on="tx_id", right_on="id", how="inner", suffixes=("_diary", "_tx"))
+    diary["__effective_date"] = diary["transaction_date"].fillna(diary["date"])
+    diary = filter_window(diary, "__effective_date", start_date)
+
+    diaries = []
+    for _, row in diary.iterrows():
+        diaries.append(
+            {
+                "diary_id": str(row["id_diary"]),
+                "event_id": str(row["tx_id"]),
+                "title": row.get("diary_title") or "",
+                "date": safe_date(row.get("__effective_date")),
+                "amount": float(row.get("happy_amount") or 0),
+                "sentiment": int(row.get("mood_score") or 0),
+                "content": row.get("diary_body") or "",
+            }
+        )
+    top = sorted([d for d in diaries if d["sentiment"] > 0], key=lambda d: d["amount"], reverse=True)[:3]
+    worst = sorted([d for d in diaries if d["sentiment"] < 0], key=lambda d: d["amount"])[:3]
+    diary_by_event = {}
+    for d in diaries:
+        diary_by_event.setdefault(d["event_id"], d["diary_id"])
+
+    def event(row):
+        return {
+            "event_id": str(row["id"]),
+            "title": row.get("item") or "",
+            "date": safe_date(row.get("__date_only")),
+            "amount": float(row.get("happy_amount", 0) or 0),
+            "sentiment": int(row.get("mood_score", 0) or 0),
+            "has_diary": str(row["id"]) in diary_by_event,
+            "diary_id": diary_by_event.get(str(row["id"])),
+        }
+
+    positive = tx[tx["mood_score"] > 0].sort_values(by="happy_amount", ascending=False)
+    negative = tx[tx["mood_score"] < 0].sort_values(by="happy_amount", ascending=True)
+    events_top = [event(row) for _, row in positive.head(3).iterrows()]
+    events_worst = [event(row) for _, row in negative.head(3).iterrows()]
+
+    counts = tx["mood_score"].dropna().apply(lambda x: max(min(int(x), 2), -2)).value_counts().to_dict()
+    buckets = [{"value": v, "count": int(counts[v])} for v in [2, 1, 0, -1, -2] if counts.get(v, 0) > 0]
+
+    means = tx.groupby("__date_only")["mood_score"].mean().apply(lambda v: int(round(max(min(v, 2), -2))))
+    day_counts = tx["__date_only"].value_counts()
+    daily = []
+    current = start_date
+    while current <= date.today():
+        daily.append({"date": current, "mood_score": int(means.get(current, 0)), "count": int(day_counts.get(current, 0))})
+        current += timedelta(days=1)
+    return {
+        "happy_money_top3_diaries": top,
+        "happy_money_worst3_diaries": worst,
+        "yearly_happy_money_top3": events_top,
+        "yearly_happy_money_worst3": events_worst,
+        "emotion_buckets": buckets,
+        "daily_moods": daily,
+    }
+
+
+def _rowwise(tx_df: pd.DataFrame, diary_df: pd.DataFrame) -> UserAggregate:
+    agg = UserAggregate(("", ""))
+    for row in tx_df.to_dict("records"):
+        tx = _tx_fact(row)
+        if tx is not None:
+            agg.add_transaction(str(row["id"]), tx)
+    for row in diary_df.to_dict("records"):
+        diary = _diary_fact(row, agg.txs.get(str(row["tx_id"])))
+        if diary is not None:
+            agg.upsert_diary(str(row["tx_id"]), diary)
+    return agg
+
+
+def _window(agg: UserAggregate) -> dict:
+    summary = summarize_aggregate("bench", MONTHS, agg).model_dump()
+    summary["emotion_buckets"] = [{"value": b["value"], "count": b["count"]} for b in summary["emotion_buckets"]]
+    return summary
+
+
+def _best_of(fn: Callable[[], object], repeat: int) -> float:
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--diary-ratio", type=float, default=0.2, help="日記が付いている取引の割合")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        f"{'rows':>8} {'legacy[ms]':>11} {'rowwise[ms]':>12} {'build[ms]':>10} {'window[ms]':>11}"
+        f" {'build+window':>13} {'window only':>12}"
+    )
+    for rows in args.rows:
+        tx_df, diary_df = _make_frames(rows, args.diary_ratio)
+        agg = aggregate_from_frames(("", ""), tx_df, diary_df)
+        expected = _legacy(tx_df, diary_df)
+        got = _window(agg)
+        for key, value in expected.items():
+            assert got[key] == value, f"{key} differs at {rows} rows"
+
+        legacy = _best_of(lambda: _legacy(tx_df, diary_df), args.repeat)
+        rowwise = _best_of(lambda: _rowwise(tx_df, diary_df), args.repeat)
+        build = _best_of(lambda: aggregate_from_frames(("", ""), tx_df, diary_df), args.repeat)
+        window = _best_of(lambda: _window(agg), args.repeat)
+        print(
+            f"{rows:>8} {legacy * 1000:>11.1f} {rowwise * 1000:>12.1f} {build * 1000:>10.1f} {window * 1000:>11.2f}"
+            f" {legacy / (build + window):>12.1f}x {legacy / window:>11.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
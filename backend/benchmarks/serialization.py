@@ -0,0 +1,66 @@
+"""一覧APIのシリアライズ経路を比較するマイクロベンチマーク。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.serialization --rows 100 1000 10000
+
+- iterrows: 従来の経路（iterrows → 行ごとに pd.to_datetime → TransactionOut → FastAPI の JSON 化）
+- records:  frame_to_records() で列ごとに変換し、RecordsResponse と同じ dumps() で書き出す
+"""
+
+import argparse
+import json
+import time
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+
+from app.services.transactions import OUT_COLUMNS, _row_to_out
+from app.utils.serialize import dumps, frame_to_records, orjson
+from benchmarks.storage_formats import _make_transactions
+
+
+def _iterrows_path(df) -> bytes:
+    items = [_row_to_out(row) for _, row in df.iterrows()]
+    return json.dumps(jsonable_encoder(items)).encode("utf-8")
+
+
+def _records_path(df) -> bytes:
+    return dumps(
+        frame_to_records(
+            df,
+            OUT_COLUMNS,
+            date_columns=["date"],
+            datetime_columns=["created_at", "updated_at"],
+            float_columns=["amount", "happy_amount"],
+            int_columns=["mood_score"],
+        )
+    )
+
+
+def _best_of(fn: Callable[[], bytes], repeat: int) -> float:
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"json backend: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'rows':>8} {'iterrows[ms]':>13} {'records[ms]':>12} {'speedup':>8}")
+    for rows in args.rows:
+        df = _make_transactions(rows, users=1)
+        assert json.loads(_iterrows_path(df.head(50))) == json.loads(_records_path(df.head(50)))
+        old = _best_of(lambda: _iterrows_path(df), args.repeat)
+        new = _best_of(lambda: _records_path(df), args.repeat)
+        print(f"{rows:>8} {old * 1000:>13.1f} {new * 1000:>12.1f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""取引テーブルの読み込み時間とメモリ（RSS）を、保存形式ごとに比較するベンチマーク。
+
+使い方（backend ディレクトリで実行。parquet / feather には pyarrow が必要）:
+    python -m benchmarks.storage_formats --rows 10000 100000 1000000
+
+各形式・各行数ごとに別プロセスで app.repositories.csv_store と同じ読み込み経路を通し、
+全列ロードと list_diaries 相当の列射影（id, amount, mood_score）を計測する。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FORMATS = ("csv", "parquet", "feather")
+PROJECTION = ["id", "amount", "mood_score"]
+
+
+def _make_transactions(rows: int, users: int = 1000) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    created = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s")
+    mood = rng.integers(-2, 3, rows)
+    amount = rng.integers(100, 50000, rows).astype(float)
+    return pd.DataFrame(
+        {
+            "id": [f"tx-{i:08d}" for i in range(rows)],
+            "user_id": [f"user-{i % users:04d}" for i in range(rows)],
+            "date": created.normalize(),
+            "item": [f"item {i}" for i in range(rows)],
+            "amount": amount,
+            "mood_score": mood,
+            "happy_amount": amount * mood / 2,
+            "created_at": created,
+            "updated_at": created,
+        }
+    )
+
+
+def _measure(data_dir: Path, fmt: str) -> dict:
+    """子プロセスで1形式だけ読み込み、時間と最大RSSを返す。"""
+    code = f"""
+import json, resource, time
+from pathlib import Path
+from app.repositories import csv_store
+
+def rss_mb():
+    # Linux では現在のRSS、それ以外は最大RSSで代用する
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+base = Path({str(data_dir)!r}) / "transactions.{fmt}"
+journal = Path({str(data_dir)!r}) / "transactions_journal.csv"
+rss_before = rss_mb()
+t0 = time.perf_counter()
+df = csv_store._read_tx_table(base, journal)
+load = time.perf_counter() - t0
+t0 = time.perf_counter()
+proj = csv_store._read_tx_table(base, journal, select=csv_store._select(columns={PROJECTION!r}))
+projected = time.perf_counter() - t0
+rss_after = rss_mb()
+print(json.dumps({{"rows": len(df), "load": load, "projected": projected, "rss_mb": rss_after - rss_before}}))
+"""
+    env = {**os.environ, "DATA_DIR": str(data_dir), "TABLE_FORMAT": fmt}
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    args = parser.parse_args()
+
+    from app.repositories.table_formats import write_frame
+
+    print(f"{'rows':>9} {'format':>8} {'file MB':>8} {'load s':>8} {'proj s':>8} {'RSS MB':>8}")
+    for rows in args.rows:
+        df = _make_transactions(rows)
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "transactions_journal.csv").write_text(
+                "op," + ",".join(df.columns) + "\n", encoding="utf-8"
+            )
+            for fmt in args.formats:
+                path = data_dir / f"transactions.{fmt}"
+                write_frame(path, df, fmt)
+                result = _measure(data_dir, fmt)
+                size_mb = path.stat().st_size / 1024 / 1024
+                print(
+                    f"{rows:>9} {fmt:>8} {size_mb:>8.1f} {result['load']:>8.3f} "
+                    f"{result['projected']:>8.4f} {result['rss_mb']:>8.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""POST /transactions を並列に投げ、行の取りこぼしがないことを確認するストレステスト。
+
+使い方（backend ディレクトリで実行）:
+    python -m benchmarks.stress_transactions --workers 4 --requests 400 --concurrency 32
+
+--url を省略すると、一時ディレクトリを DATA_DIR にした uvicorn を --workers 個の
+ワーカーで起動して計測する。既存サーバーを叩く場合は --url と --user-id を指定する。
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _request(method: str, url: str, payload: dict | None = None) -> tuple[int, object]:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(
+        url, data=data, method=method, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=60) as res:
+            return res.status, json.loads(res.read() or b"null")
+    except urllib.error.HTTPError as exc:
+        return exc.code, exc.read().decode("utf-8", "replace")
+
+
+def _wait_until_ready(base_url: str, proc: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with code {proc.returncode}")
+        try:
+            if _request("GET", f"{base_url}/health")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def _start_server(
+    workers: int, data_dir: Path, extra_env: dict | None = None, quiet: bool = False
+) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {**os.environ, "DATA_DIR": str(data_dir), **(extra_env or {})}
+    proc = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL if quiet else None,
+        stderr=subprocess.DEVNULL if quiet else None,
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+def run(base_url: str, user_id: str, total: int, concurrency: int) -> int:
+    status, before = _request("GET", f"{base_url}/transactions?user_id={user_id}")
+    if status != 200:
+        raise RuntimeError(f"list failed: {status} {before}")
+
+    def create(i: int) -> tuple[int, float]:
+        started = time.perf_counter()
+        status, _ = _request(
+            "POST",
+            f"{base_url}/transactions",
+            {
+                "user_id": user_id,
+                "date": f"2024-01-{i % 28 + 1:02d}",
+                "item": f"stress-{i}",
+                "amount": 100 + i,
+                "mood_score": i % 5 - 2,
+            },
+        )
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(create, range(total)))
+    elapsed = time.perf_counter() - started
+
+    failures = [s for s, _ in results if s != 201]
+    latencies = sorted(t for _, t in results)
+    _, after = _request("GET", f"{base_url}/transactions?user_id={user_id}")
+    lost = len(before) + (total - len(failures)) - len(after)
+
+    print(f"requests: {total} (concurrency {concurrency}) in {elapsed:.2f}s")
+    print(f"throughput: {total / elapsed:.1f} req/s")
+    print(
+        "latency p50/p95/p99: "
+        + " / ".join(f"{latencies[int(len(latencies) * q) - 1] * 1000:.1f}ms" for q in (0.5, 0.95, 0.99))
+    )
+    print(f"failed requests: {len(failures)}, rows before: {len(before)}, rows after: {len(after)}")
+    print(f"lost rows: {lost}")
+    return lost + len(failures)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="既存サーバーのベースURL（省略時は一時サーバーを起動）")
+    parser.add_argument("--user-id", default="stress-user")
+    parser.add_argument("--workers", type=int, default=4, help="起動する uvicorn ワーカー数")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.url:
+        errors = run(args.url.rstrip("/"), args.user_id, args.requests, args.concurrency)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = Path(tmp)
+            (data_dir / "users.csv").write_text(
+                f"user_id,display_name\n{args.user_id},stress\n", encoding="utf-8"
+            )
+            proc, base_url = _start_server(args.workers, data_dir)
+            try:
+                _wait_until_ready(base_url, proc)
+                errors = run(base_url, args.user_id, args.requests, args.concurrency)
+            finally:
+                proc.terminate()
+                proc.wait(timeout=30)
+
+    if errors:
+        sys.exit(f"FAILED: {errors} rows lost or requests failed")
+    print("OK: no rows lost")
+
+
+if __name__ == "__main__":
+    main()
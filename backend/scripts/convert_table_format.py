@@ -0,0 +1,25 @@
+"""取引・日記の本体ファイルを TABLE_FORMAT の形式へ書き直す。
+
+使い方（backend ディレクトリで実行）:
+    TABLE_FORMAT=parquet python -m scripts.convert_table_format --from csv
+移行後は同じ TABLE_FORMAT で起動する。元のファイルは残る。
+"""
+
+import argparse
+
+from app.core.config import TABLE_FORMAT
+from app.repositories.csv_store import convert_table_format
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--from", dest="source", default="csv", help="変換元の形式")
+    args = parser.parse_args()
+    counts = convert_table_format(args.source)
+    print(f"converted {args.source} -> {TABLE_FORMAT}")
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+"""既存のCSVデータを SQLite バックエンドへ移行する。
+
+使い方（backend ディレクトリで実行）:
+    python -m scripts.migrate_csv_to_sqlite
+移行後は STORAGE_BACKEND=sqlite で起動する。
+"""
+
+from app.core.config import SQLITE_PATH
+from app.repositories.sqlite_store import migrate_from_csv
+
+
+def main() -> None:
+    counts = migrate_from_csv()
+    print(f"migrated to {SQLITE_PATH}")
+    for table, count in counts.items():
+        print(f"  {table}: {count} rows")
+
+
+if __name__ == "__main__":
+    main()
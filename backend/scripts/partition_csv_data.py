@@ -0,0 +1,19 @@
+"""単一ファイル構成のCSVを、ユーザーごとのパーティション構成へ移行する。
+
+使い方（backend ディレクトリで実行）:
+    python -m scripts.partition_csv_data
+移行後は CSV_LAYOUT=partitioned で起動する。元の transactions.csv などは残る。
+"""
+
+from app.repositories.csv_store import USERS_DIR, migrate_to_partitioned
+
+
+def main() -> None:
+    counts = migrate_to_partitioned()
+    print(f"partitioned into {USERS_DIR}")
+    for table, count in counts.items():
+        print(f"  {table}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -152,7 +152,7 @@ export default function CreateDiaryPage() {
     try {
       await streamDiaryChat(
         txId,
-        nextMessages,
+        userMessage.content,
         (token) => {
           setChat((prev) => ({
             ...prev,
@@ -172,7 +172,8 @@ export default function CreateDiaryPage() {
       });
     } catch (e) {
       const message = (e as Error).message || "チャットに失敗しました";
-      setChat((prev) => ({ ...prev, streaming: false, error: message }));
+      // 途中までの応答はサーバーの履歴に残らないので、表示からも消す
+      setChat((prev) => ({ ...prev, streamingAssistant: null, streaming: false, error: message }));
     } finally {
       abortRef.current = null;
     }
@@ -193,7 +194,7 @@ export default function CreateDiaryPage() {
     try {
       await streamDiaryChat(
         txId,
-        [],
+        null,
         (token) => {
           setChat((prev) => ({
             ...prev,
@@ -213,7 +214,8 @@ export default function CreateDiaryPage() {
       });
     } catch (e) {
       const message = (e as Error).message || "チャットに失敗しました";
-      setChat((prev) => ({ ...prev, streaming: false, error: message }));
+      // 途中までの応答はサーバーの履歴に残らないので、表示からも消す
+      setChat((prev) => ({ ...prev, streamingAssistant: null, streaming: false, error: message }));
     } finally {
       abortRef.current = null;
     }
@@ -17,9 +17,9 @@ import { CalendarView } from "@/components/calendar/CalendarView";
 import { DayModal } from "@/components/modals/DayModal";
 import { DiarySelectEventModal } from "@/components/modals/DiarySelectEventModal";
 import { useTransactions } from "@/hooks/useTransactions";
-import { fetchDiaries } from "@/lib/api";
+import { fetchDiaries, fetchHappyTotals } from "@/lib/api";
 import { moodOptions } from "@/lib/mood";
-import type { DiaryEntry, Transaction, TransactionForm, User } from "@/lib/types";
+import type { DiaryEntry, HappyTotal, Transaction, TransactionForm, User } from "@/lib/types";
 
 type Granularity = "day" | "month" | "year";
 
@@ -62,6 +62,16 @@ const formatMonthParam = (date: Date) => {
   return `${y}-${m}`;
 };
 
+// 月表示のカレンダーに並ぶ範囲（6週分なので、前月は最大6日・翌月は最大14日まで入る）
+const getVisibleRange = (monthStr: string) => {
+  const [y, m] = monthStr.split("-").map(Number);
+  if (!Number.isFinite(y) || !Number.isFinite(m)) return getVisibleRange(formatMonthParam(new Date()));
+  return {
+    start_date: formatDateLocal(new Date(y, m - 1, 1 - 6)),
+    end_date: formatDateLocal(new Date(y, m, 14)),
+  };
+};
+
 type HomeCalendarPanelProps = {
   user: User | null;
   selectedMonth: string;
@@ -94,6 +104,7 @@ export function HomeCalendarPanel({ user, selectedMonth, onChangeMonth }: HomeCa
     date?: string;
   } | null>(null);
   const [diaryModalLoading, setDiaryModalLoading] = useState(false);
+  const [periodTotals, setPeriodTotals] = useState<HappyTotal[]>([]);
 
   const {
     transactions,
@@ -112,8 +123,8 @@ export function HomeCalendarPanel({ user, selectedMonth, onChangeMonth }: HomeCa
       resetTransactions();
       return;
     }
-    loadTransactions(user.user_id);
-  }, [user, loadTransactions, resetTransactions]);
+    loadTransactions(user.user_id, getVisibleRange(selectedMonth));
+  }, [user, selectedMonth, loadTransactions, resetTransactions]);
 
   useEffect(() => {
     const firstDay = getFirstDayFromMonthStr(selectedMonth);
@@ -166,13 +177,34 @@ export function HomeCalendarPanel({ user, selectedMonth, onChangeMonth }: HomeCa
     };
   }, [selectedDate]);
 
-  const happyStats: HappyStats = useMemo(() => {
-    if (!transactions.length) {
-      return { data: [] as HappyStatDatum[], total: 0, label: "" };
-    }
+  const statsBaseYear = statsYear ?? selectedMonthInfo?.year ?? new Date().getFullYear();
 
+  // 月別・年別は全期間の取引が要るので、サーバーで合計したものだけを受け取る。
+  // 取引を保存・削除したら（transactions が変わったら）取り直す
+  useEffect(() => {
+    if (!user || granularity === "day") return;
+    let cancelled = false;
+    const loadTotals = async () => {
+      try {
+        const totals = await fetchHappyTotals(
+          user.user_id,
+          granularity,
+          granularity === "month" ? statsBaseYear : undefined,
+        );
+        if (!cancelled) setPeriodTotals(totals);
+      } catch {
+        if (!cancelled) setPeriodTotals([]);
+      }
+    };
+    loadTotals();
+    return () => {
+      cancelled = true;
+    };
+  }, [user, granularity, statsBaseYear, transactions]);
+
+  const happyStats: HappyStats = useMemo(() => {
     if (granularity === "day") {
-      if (!selectedMonthInfo) return { data: [], total: 0, label: "" };
+      if (!transactions.length || !selectedMonthInfo) return { data: [], total: 0, label: "" };
       const grouped = new Map<string, { positive: number; negative: number }>();
       transactions.forEach((t) => {
         const d = new Date(`${t.date}T00:00:00`);
@@ -199,53 +231,13 @@ export function HomeCalendarPanel({ user, selectedMonth, onChangeMonth }: HomeCa
       return { data, total, label: `${selectedMonthInfo.label}` };
     }
 
-    if (granularity === "month") {
-      const baseYear = statsYear ?? selectedMonthInfo?.year ?? new Date().getFullYear();
-      const grouped = new Map<number, { positive: number; negative: number }>();
-      transactions.forEach((t) => {
-        const d = new Date(`${t.date}T00:00:00`);
-        if (d.getFullYear() === baseYear) {
-          const current = grouped.get(d.getMonth()) ?? { positive: 0, negative: 0 };
-          if (t.happy_amount >= 0) {
-            current.positive += t.happy_amount;
-          } else {
-            current.negative += t.happy_amount;
-          }
-          grouped.set(d.getMonth(), current);
-        }
-      });
-      const data = Array.from(grouped.entries())
-        .map(([month, happy]) => ({
-          label: `${baseYear}-${String(month + 1).padStart(2, "0")}`,
-          positive: happy.positive,
-          negative: happy.negative,
-        }))
-        .sort((a, b) => a.label.localeCompare(b.label));
-      const total = data.reduce((sum, entry) => sum + entry.positive + entry.negative, 0);
-      return { data, total, label: `${baseYear}年` };
-    }
-
-    const grouped = new Map<number, { positive: number; negative: number }>();
-    transactions.forEach((t) => {
-      const d = new Date(`${t.date}T00:00:00`);
-      const current = grouped.get(d.getFullYear()) ?? { positive: 0, negative: 0 };
-      if (t.happy_amount >= 0) {
-        current.positive += t.happy_amount;
-      } else {
-        current.negative += t.happy_amount;
-      }
-      grouped.set(d.getFullYear(), current);
-    });
-    const data = Array.from(grouped.entries())
-      .map(([year, happy]) => ({
-        label: String(year),
-        positive: happy.positive,
-        negative: happy.negative,
-      }))
-      .sort((a, b) => a.label.localeCompare(b.label));
+    // 取得し直している間に前の年の合計が残っていても混ざらないよう、ラベルで絞る
+    const data = periodTotals
+      .filter((t) => granularity === "year" || t.label.startsWith(`${statsBaseYear}-`))
+      .map((t) => ({ label: t.label, positive: t.positive, negative: t.negative }));
     const total = data.reduce((sum, entry) => sum + entry.positive + entry.negative, 0);
-    return { data, total, label: "全期間" };
-  }, [granularity, selectedMonthInfo, transactions, statsYear]);
+    return { data, total, label: granularity === "month" ? `${statsBaseYear}年` : "全期間" };
+  }, [granularity, selectedMonthInfo, transactions, periodTotals, statsBaseYear]);
 
   const happyScaleDomain = useMemo<[number, number]>(() => {
     if (happyStats.data.length === 0) {
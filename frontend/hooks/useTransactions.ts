@@ -11,18 +11,21 @@ export function useTransactions() {
   const [saving, setSaving] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
-  const loadTransactions = useCallback(async (userId: string) => {
-    setLoading(true);
-    setError(null);
-    try {
-      const data = await fetchTransactions(userId);
-      setTransactions(data);
-    } catch (e) {
-      setError((e as Error).message);
-    } finally {
-      setLoading(false);
-    }
-  }, []);
+  const loadTransactions = useCallback(
+    async (userId: string, range: { start_date: string; end_date: string }) => {
+      setLoading(true);
+      setError(null);
+      try {
+        const data = await fetchTransactions(userId, range);
+        setTransactions(data);
+      } catch (e) {
+        setError((e as Error).message);
+      } finally {
+        setLoading(false);
+      }
+    },
+    [],
+  );
 
   const upsertTransaction = useCallback(
     async (userId: string, form: TransactionForm) => {
@@ -1,8 +1,11 @@
 import { API_BASE } from "./constants";
 import type {
   ChatMessage,
+  DailyMood,
+  DailyMoodGrid,
   DiaryEntry,
   DiaryGenerateResponse,
+  HappyTotal,
   SaveDiaryResponse,
   Transaction,
   TransactionForm,
@@ -73,11 +76,68 @@ export async function me(): Promise<User> {
   return res.json();
 }
 
-export async function fetchTransactions(userId: string): Promise<Transaction[]> {
-  const res = await fetch(
-    `${API_BASE}/transactions?user_id=${encodeURIComponent(userId)}`,
-    { credentials: "include" },
-  );
+const NEXT_CURSOR_HEADER = "X-Next-Cursor";
+// カレンダーで使う列（created_at / updated_at は読まない）
+const CALENDAR_FIELDS: Array<keyof Transaction> = [
+  "id",
+  "user_id",
+  "date",
+  "item",
+  "amount",
+  "mood_score",
+  "happy_amount",
+];
+
+export type Page<T> = {
+  items: T[];
+  nextCursor: string | null;
+};
+
+export async function fetchTransactionsPage(
+  userId: string,
+  params?: {
+    limit?: number;
+    cursor?: string | null;
+    fields?: Array<keyof Transaction>;
+    start_date?: string;
+    end_date?: string;
+  },
+): Promise<Page<Transaction>> {
+  const searchParams = new URLSearchParams({ user_id: userId });
+  if (params?.limit) searchParams.set("limit", String(params.limit));
+  if (params?.cursor) searchParams.set("cursor", params.cursor);
+  if (params?.fields?.length) searchParams.set("fields", params.fields.join(","));
+  if (params?.start_date) searchParams.set("start_date", params.start_date);
+  if (params?.end_date) searchParams.set("end_date", params.end_date);
+
+  const res = await fetch(`${API_BASE}/transactions?${searchParams.toString()}`, {
+    credentials: "include",
+  });
+  if (!res.ok) {
+    await handleError(res);
+  }
+  return { items: await res.json(), nextCursor: res.headers.get(NEXT_CURSOR_HEADER) };
+}
+
+export async function fetchTransactions(
+  userId: string,
+  range: { start_date: string; end_date: string },
+): Promise<Transaction[]> {
+  // 表示中の期間だけを1回で取得する（全期間をページ送りで集めない）
+  const page = await fetchTransactionsPage(userId, { ...range, fields: CALENDAR_FIELDS });
+  return page.items;
+}
+
+export async function fetchHappyTotals(
+  userId: string,
+  period: "month" | "year",
+  year?: number,
+): Promise<HappyTotal[]> {
+  const searchParams = new URLSearchParams({ user_id: userId, period });
+  if (year !== undefined) searchParams.set("year", String(year));
+  const res = await fetch(`${API_BASE}/transactions/happy-totals?${searchParams.toString()}`, {
+    credentials: "include",
+  });
   if (!res.ok) {
     await handleError(res);
   }
@@ -142,16 +202,19 @@ export async function getTransaction(txId: string): Promise<Transaction> {
   return res.json();
 }
 
+// message を渡すと新しい発話だけを送り、履歴はサーバー側の保存済みの会話を使う。
+// null のときは会話を最初からやり直す。
 export async function streamDiaryChat(
   txId: string,
-  messages: ChatMessage[],
+  message: string | null,
   onToken: (token: string) => void,
   signal?: AbortSignal,
 ): Promise<void> {
+  const payload = message === null ? { tx_id: txId, messages: [] } : { tx_id: txId, message };
   const res = await fetch(`${API_BASE}/diary/chat/stream`, {
     method: "POST",
     headers: jsonHeaders,
-    body: JSON.stringify({ tx_id: txId, messages }),
+    body: JSON.stringify(payload),
     credentials: "include",
     signal,
   });
@@ -171,6 +234,11 @@ export async function streamDiaryChat(
     buffer = parts.pop() ?? "";
     for (const part of parts) {
       const lines = part.split("\n");
+      // サーバー側の失敗は event: error で届く。応答の続きとして表示しないよう例外にする
+      if (lines.includes("event: error")) {
+        const detail = lines.find((line) => line.startsWith("data: "))?.slice(6);
+        throw new Error(detail || "チャットに失敗しました");
+      }
       for (const line of lines) {
         if (line.startsWith("data: ")) {
           const data = line.slice(6);
@@ -265,13 +333,36 @@ export async function fetchDiaries(params?: {
   return res.json();
 }
 
+function base64ToBytes(value: string): Uint8Array {
+  const binary = atob(value);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i += 1) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+}
+
+export function decodeDailyMoodGrid(grid: DailyMoodGrid): DailyMood[] {
+  const moods = new Int8Array(base64ToBytes(grid.mood_scores).buffer);
+  const counts = new DataView(base64ToBytes(grid.counts).buffer);
+  const [year, month, day] = grid.start.split("-").map(Number);
+  const daily: DailyMood[] = [];
+  for (let i = 0; i < grid.days; i += 1) {
+    const date = new Date(Date.UTC(year, month - 1, day + i)).toISOString().slice(0, 10);
+    daily.push({ date, mood_score: moods[i], count: counts.getUint16(i * 2, true) });
+  }
+  return daily;
+}
+
 export async function fetchRetrospectiveSummary(months: number = 12): Promise<RetrospectiveSummary> {
   const searchParams = new URLSearchParams();
   if (months && Number.isFinite(months)) {
     searchParams.set("months", String(months));
   }
+  // 日ごとの気分は base64 の配列で受け取り、ここで daily_moods に戻す
+  searchParams.set("daily_format", "compact");
   const qs = searchParams.toString();
-  const url = qs ? `${API_BASE}/retrospective/summary?${qs}` : `${API_BASE}/retrospective/summary`;
+  const url = `${API_BASE}/retrospective/summary?${qs}`;
 
   const res = await fetch(url, {
     credentials: "include",
@@ -279,6 +370,10 @@ export async function fetchRetrospectiveSummary(months: number = 12): Promise<Re
   if (!res.ok) {
     await handleError(res);
   }
-  return res.json();
+  const summary: RetrospectiveSummary = await res.json();
+  if (summary.daily_mood_grid) {
+    summary.daily_moods = decodeDailyMoodGrid(summary.daily_mood_grid);
+  }
+  return summary;
 }
 
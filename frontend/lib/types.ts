@@ -15,6 +15,12 @@ export type Transaction = {
   updated_at?: string;
 };
 
+export type HappyTotal = {
+  label: string;
+  positive: number;
+  negative: number;
+};
+
 export type TransactionForm = {
   id?: string;
   date: string;
@@ -93,6 +99,14 @@ export type DailyMood = {
   count: number;
 };
 
+// mood_scores は int8、counts は uint16（リトルエンディアン）の列を base64 にしたもの
+export type DailyMoodGrid = {
+  start: string;
+  days: number;
+  mood_scores: string;
+  counts: string;
+};
+
 export type RetrospectiveSummary = {
   happy_money_top3_diaries: RetrospectiveDiary[];
   happy_money_worst3_diaries: RetrospectiveDiary[];
@@ -100,6 +114,7 @@ export type RetrospectiveSummary = {
   yearly_happy_money_worst3: RetrospectiveEvent[];
   emotion_buckets: EmotionBucket[];
   daily_moods: DailyMood[];
+  daily_mood_grid?: DailyMoodGrid | null;
   summary_text: string;
   diary_top_insufficient: boolean;
   diary_worst_insufficient: boolean;